@@ -1,29 +1,49 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Callable, Optional
+from contextlib import asynccontextmanager
+import asyncio
+import logging
 import os
+import time
 from pathlib import Path
 from io import BytesIO
 
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Request
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse
 from pydantic import BaseModel
 
 from DetectSegment.pipelines.detect_and_segment import DetectAndSegmentPipeline
-from DetectSegment.utils.io_utils import load_image
+from DetectSegment.models.sam3_segmenter import Sam3Segmenter
+from DetectSegment.utils.device_utils import RuntimeConfig, apply_runtime, describe_runtime, format_runtime
+from DetectSegment.utils.embedding_cache import EmbeddingCache, hash_image_bytes
+from DetectSegment.utils.io_utils import (
+    DEFAULT_RASTER_CACHE_DIR, ImageReader, RasterTooLargeError, image_size, load_image, open_image,
+)
+from DetectSegment.utils.viz_utils import render_instances, render_masks
+from DetectSegment.utils.mask_utils import encode_rle, encode_rle_cropped
+from DetectSegment.utils.mask_stats import (
+    instance_areas_centroids, instance_records, mask_areas_centroids, summarize_segmentations,
+)
+from DetectSegment.utils.tiling import subsample_instances
+from DetectSegment.utils.result_store import ClassResultStore, expand_result
 import UserPromptProcess.chat  # ensure chat module is loaded
-from UserPromptProcess.chat import suggest_classes, chat_answer
+from UserPromptProcess.chat import asuggest_classes, achat_answer, get_model, get_response_cache
+from UserPromptProcess.image_prep import PreparedImage, prepare_image
 
 import torch
-from transformers import Sam3Processor, Sam3Model
 from PIL import Image
 
-import numpy as np
-import matplotlib
-from PIL import ImageDraw, ImageFont
-
 import json
 from fastapi.responses import StreamingResponse
-import base64
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
+
+from API.inference_worker import InferenceWorker
+from API.model_registry import ModelRegistry
+from API import metrics
+from API.metrics import span
+
+metrics.configure_logging()
+logger = logging.getLogger(__name__)
 
 """FastAPI application for Detect + Segment + Chat reasoning."""
 
@@ -46,30 +66,97 @@ except Exception:
                 break
         return f"(Fallback) Klasy: {', '.join(classes)}. Ostatnia wiadomość: {last_user}"
 
-device = "cuda" if torch.cuda.is_available() else "cpu"
-
-print(f"Using device: {device}")
+# Device, torch thread pools, CPU affinity, autograd and conv memory format: DEVICE, TORCH_THREADS,
+# CPU_AFFINITY, WORKERS / WORKER_INDEX, NO_GRAD, CHANNELS_LAST (see DetectSegment.utils.device_utils)
+runtime = apply_runtime(RuntimeConfig.from_env())
+device = runtime["device"]
+
+logger.info("Runtime: %s", format_runtime(runtime))
+
+# Number of class prompts decoded together in one SAM3 forward pass; lower it on small CPU boxes
+SAM3_BATCH_SIZE = int(os.environ.get("SAM3_BATCH_SIZE", "4"))
+
+# SAM3 detection score / mask binarization thresholds (also part of the class result key)
+SAM3_SCORE_THRESHOLD = float(os.environ.get("SAM3_SCORE_THRESHOLD", "0.60"))
+SAM3_MASK_THRESHOLD = float(os.environ.get("SAM3_MASK_THRESHOLD", "0.5"))
+
+# Inference precision per model: fp32, bf16 (autocast) or int8 (dynamic quantization, CPU only);
+# see benchmarks/bench_precision.py for the accuracy / latency trade-off on your images
+SAM3_PRECISION = os.environ.get("SAM3_PRECISION", "fp32")
+SAM_PRECISION = os.environ.get("SAM_PRECISION", "fp32")
+DETECTOR_PRECISION = os.environ.get("DETECTOR_PRECISION", "fp32")
+
+# PIPELINE_RUNTIME=onnx runs the OWL-ViT + SAM pipeline with ONNX Runtime on CPU from the graphs
+# exported to ONNX_DIR (`python -m DetectSegment.pipelines.cli export_onnx`); ORT_THREADS=0: all cores
+PIPELINE_RUNTIME = os.environ.get("PIPELINE_RUNTIME", "torch")
+ONNX_DIR = os.environ.get("ONNX_DIR") or None
+ORT_THREADS = int(os.environ.get("ORT_THREADS", "0")) or None
+
+# Sliding-window inference for large orthophotos; 0 disables tiling
+SAM3_TILE_SIZE = int(os.environ.get("SAM3_TILE_SIZE", "0"))
+SAM3_TILE_OVERLAP = int(os.environ.get("SAM3_TILE_OVERLAP", "128"))
+# Uploads larger than one tile are memory-mapped (decoded once into RASTER_CACHE_DIR, which
+# RASTER_CACHE_BYTES bounds, see io_utils) instead of decoded in memory; their overlay is rendered
+# on a preview of at most RASTER_PREVIEW_MAX_SIDE px.
+# Those are limited by RASTER_MAX_PIXELS (io_utils), the rest by Pillow's MAX_IMAGE_PIXELS
+RASTER_CACHE_DIR = os.environ.get("RASTER_CACHE_DIR") or DEFAULT_RASTER_CACHE_DIR
+RASTER_PREVIEW_MAX_SIDE = int(os.environ.get("RASTER_PREVIEW_MAX_SIDE", "4096"))
+
+# Ground sample distance (metres per pixel) for object areas in m²; overridable per request
+PIXEL_SIZE_M = float(os.environ.get("PIXEL_SIZE_M", "0")) or None
+
+# Image embeddings keyed by upload content hash: follow-up questions on the same photo
+# skip the vision encoder. EMBEDDING_CACHE_DIR adds a disk tier that survives restarts,
+# bounded by EMBEDDING_CACHE_DISK_BYTES.
+embedding_cache = EmbeddingCache(
+    max_bytes=int(os.environ.get("EMBEDDING_CACHE_BYTES", str(2 << 30))),
+    disk_dir=os.environ.get("EMBEDDING_CACHE_DIR") or None,
+    max_disk_bytes=int(os.environ.get("EMBEDDING_CACHE_DISK_BYTES", str(10 << 30))),
+)
 
-model = Sam3Model.from_pretrained("facebook/sam3").to(device)
-processor = Sam3Processor.from_pretrained("facebook/sam3")
-model.eval()
+# Finished per-class masks keyed by upload hash + class + thresholds: "also show the cranes"
+# segments one new class and re-renders the overlay with the cached ones
+class_result_store = ClassResultStore(EmbeddingCache(
+    max_bytes=int(os.environ.get("CLASS_RESULT_CACHE_BYTES", str(1 << 30))),
+    disk_dir=os.environ.get("CLASS_RESULT_CACHE_DIR") or None,
+    max_disk_bytes=int(os.environ.get("CLASS_RESULT_CACHE_DISK_BYTES", str(10 << 30))),
+))
 
 ASSETS_DIR = Path("Images")
 OUTPUTS_DIR = Path("src/DetectSegment/tests/outputs_api")
 OUTPUTS_DIR.mkdir(parents=True, exist_ok=True)
 
-SAM_CHECKPOINT = os.environ.get("SAM_CHECKPOINT")
-if not SAM_CHECKPOINT:
-    # Reuse tests checkpoint auto download if present
-    checkpoints_dir = Path("src/DetectSegment/tests/checkpoints")
-    try:
-        from DetectSegment.tests.test_run import download_random_checkpoint
-        SAM_CHECKPOINT = download_random_checkpoint(checkpoints_dir)
-    except Exception:
-        SAM_CHECKPOINT = None
+# Resolved lazily by build_pipeline (may download a checkpoint)
+SAM_CHECKPOINT: Optional[str] = os.environ.get("SAM_CHECKPOINT")
+
+# Models backing the API load on first use, or up front on a background thread for the
+# ones listed in WARMUP_MODELS (comma separated, "" disables warm-up). /readyz reports
+# ready once every warm-up model is loaded.
+WARMUP_MODELS = [m.strip() for m in os.environ.get("WARMUP_MODELS", "sam3,gemini").split(",") if m.strip()]
+
+
+def _resolve_sam_checkpoint() -> Optional[str]:
+    global SAM_CHECKPOINT
+    if not SAM_CHECKPOINT:
+        # Reuse tests checkpoint auto download if present
+        checkpoints_dir = Path("src/DetectSegment/tests/checkpoints")
+        try:
+            from DetectSegment.tests.test_run import download_random_checkpoint
+            SAM_CHECKPOINT = download_random_checkpoint(checkpoints_dir)
+        except Exception:
+            SAM_CHECKPOINT = None
+    return SAM_CHECKPOINT
 
 
-app = FastAPI(title="DetectSegment API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if WARMUP_MODELS:
+        registry.start_warmup(WARMUP_MODELS)
+    yield
+    inference_worker.stop()
+
+
+app = FastAPI(title="DetectSegment API", lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=[""],          # Allow all origins
@@ -78,13 +165,45 @@ app.add_middleware(
     allow_headers=["*"],          # Allow all headers
 )
 
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """Request id for log correlation (X-Request-ID in/out) and per-endpoint latency.
+    For streaming responses the latency covers the time to the first byte."""
+    request_id = request.headers.get("x-request-id") or metrics.new_request_id()
+    token = metrics.request_id_var.set(request_id)
+    t0 = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        response.headers["X-Request-ID"] = request_id
+        return response
+    finally:
+        path = request.scope.get("route").path if request.scope.get("route") else "unmatched"
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - t0, path=path, method=request.method, status=status)
+        metrics.request_id_var.reset(token)
+
 class SegmentImageRequest(BaseModel):
     chat_history: List[Dict[str, Any]]
     classes: List[str]
 
 
 def build_pipeline() -> DetectAndSegmentPipeline:
-    if not SAM_CHECKPOINT:
+    if PIPELINE_RUNTIME == "onnx":
+        # SAM variant from the exported encoder's file name (sam_<type>_encoder.onnx)
+        encoders = sorted(Path(ONNX_DIR).glob("sam_vit_*_encoder.onnx")) if ONNX_DIR else []
+        if not encoders:
+            raise RuntimeError("No SAM encoder in ONNX_DIR. Run `python -m DetectSegment.pipelines.cli export_onnx`.")
+        return DetectAndSegmentPipeline(
+            sam_model_type=encoders[0].name[len("sam_"):-len("_encoder.onnx")],
+            confidence_threshold=0.25,
+            embedding_cache=embedding_cache,
+            runtime="onnx",
+            onnx_dir=ONNX_DIR,
+            ort_threads=ORT_THREADS,
+        )
+    if not _resolve_sam_checkpoint():
         raise RuntimeError("SAM checkpoint not available. Set SAM_CHECKPOINT env or place in tests/checkpoints.")
     # Infer type from filename suffix
     inferred_type = "vit_h"
@@ -97,50 +216,281 @@ def build_pipeline() -> DetectAndSegmentPipeline:
         sam_checkpoint=SAM_CHECKPOINT,
         sam_model_type=inferred_type,
         confidence_threshold=0.25,
+        embedding_cache=embedding_cache,
+        detector_precision=DETECTOR_PRECISION,
+        sam_precision=SAM_PRECISION,
     )
 
-def process_image_with_class_list(image: Image.Image, class_names: List[str],
-                              score_threshold: float = 0.5,
-                              mask_threshold: float = 0.5):
+
+registry = ModelRegistry()
+registry.register(
+    "sam3",
+    lambda: Sam3Segmenter("facebook/sam3", device=device, batch_size=SAM3_BATCH_SIZE,
+                          embedding_cache=embedding_cache, precision=SAM3_PRECISION),
+    warmup=lambda m: m.warmup(),
+)
+registry.register("gemini", get_model)
+registry.register("pipeline", build_pipeline)
+
+
+def _result_params(image: Any, score_threshold: float, mask_threshold: float, tile_size: int) -> Dict[str, Any]:
+    """Everything besides image and class that shapes a SAM3 class result (class_result_store key)."""
+    tiled = bool(tile_size and max(image.size) > tile_size)
+    return {
+        "model": "facebook/sam3",
+        "precision": SAM3_PRECISION,
+        "score_threshold": score_threshold,
+        "mask_threshold": mask_threshold,
+        "tile_size": tile_size if tiled else None,
+        "tile_overlap": SAM3_TILE_OVERLAP if tiled else None,
+    }
+
+
+def process_image_with_class_list(image: Any, class_names: List[str],
+                              score_threshold: float = None,
+                              mask_threshold: float = None,
+                              batch_size: int = None,
+                              tile_size: int = None,
+                              image_key: str = None,
+                              image_embeds: Dict[str, Any] = None,
+                              on_class_result: Callable[[str, Dict[str, Any]], None] = None,
+                              render: bool = True):
+    """
+    Segment `class_names` with SAM3 and render all masks onto the image.
+    `on_class_result(class_name, result)` is called as soon as each class is done.
+    With `image_key`, classes already in `class_result_store` for this image (same
+    thresholds and tiling) are reused and only the new ones run through SAM3; the
+    overlay is re-rendered from all of them.
+    An ImageReader (huge raster) is segmented tile by tile without full-size masks;
+    the overlay is then rendered on its preview (RASTER_PREVIEW_MAX_SIDE).
+    `render=False` (headless) skips the overlay and returns None.
+    """
+    score_threshold = SAM3_SCORE_THRESHOLD if score_threshold is None else score_threshold
+    mask_threshold = SAM3_MASK_THRESHOLD if mask_threshold is None else mask_threshold
+    tile_size = SAM3_TILE_SIZE if tile_size is None else tile_size
+    if isinstance(image, ImageReader):
+        return _process_raster_with_class_list(image, class_names, score_threshold, mask_threshold, batch_size,
+                                               tile_size, image_key, on_class_result, render)
+    sam3 = registry.get("sam3")
+    params = _result_params(image, score_threshold, mask_threshold, tile_size)
+    cached, missing = class_result_store.lookup(image_key, class_names, **params)
+    tiled = bool(tile_size and max(image.size) > tile_size)
     all_masks = []
     all_labels = []
-    for class_name in class_names:
-        res = predict_for_class(image, class_name)
-        if len(res["masks"]) == 0:
-            continue
-        # res["masks"] is [N, H, W] tensor; extend as individual masks
-        all_masks.extend(list(res["masks"]))
-        all_labels.extend([class_name] * len(res["masks"]))
-
-    if len(all_masks) == 0:
-        # No masks found: return original image (or you can choose to 404)
-        overlayed = image.convert("RGBA")
-    else:
-        masks_tensor = torch.stack(all_masks, dim=0)
-        overlayed = overlay_masks_with_labels(image, masks_tensor, all_labels)
+    with span("sam3_classes", classes=len(class_names), cached=len(cached), tiled=tiled) as attrs:
+        if not missing:
+            fresh = iter(())
+        elif tiled:
+            # eager: every tile runs here, inside the span
+            fresh = zip(missing, sam3.predict_for_classes_tiled(
+                image, missing,
+                score_threshold=score_threshold, mask_threshold=mask_threshold,
+                tile_size=tile_size, overlap=SAM3_TILE_OVERLAP, batch_size=batch_size,
+                cache_key=image_key,
+            ))
+        else:
+            # Vision backbone runs once; class prompts go through the decoder in batches
+            fresh = sam3.iter_predict_for_classes(image, missing, batch_size=batch_size,
+                                                  score_threshold=score_threshold, mask_threshold=mask_threshold,
+                                                  cache_key=image_key, image_embeds=image_embeds)
+        for class_name, res, from_cache in class_result_store.merge(class_names, cached, fresh):
+            if from_cache:
+                res = expand_result(res)
+            elif image_key:
+                class_result_store.put(image_key, class_name, res, **params)
+            if on_class_result is not None:
+                on_class_result(class_name, res)
+            if not render or len(res["masks"]) == 0:
+                continue
+            # res["masks"] is [N, H, W] tensor; extend as individual masks
+            all_masks.extend(list(res["masks"].cpu()))
+            all_labels.extend([class_name] * len(res["masks"]))
+        attrs["masks"] = len(all_masks)
+
+    if not render:
+        return None
+    with span("overlay", masks=len(all_masks), width=image.width, height=image.height):
+        if len(all_masks) == 0:
+            # No masks found: return original image (or you can choose to 404)
+            overlayed = image.convert("RGBA")
+        else:
+            masks_tensor = torch.stack(all_masks, dim=0)
+            overlayed = overlay_masks_with_labels(image, masks_tensor, all_labels)
 
     return overlayed
 
 
+def _process_raster_with_class_list(reader: ImageReader, class_names: List[str],
+                                    score_threshold: float,
+                                    mask_threshold: float,
+                                    batch_size: int = None,
+                                    tile_size: int = None,
+                                    image_key: str = None,
+                                    on_class_result: Callable[[str, Dict[str, Any]], None] = None,
+                                    render: bool = True):
+    """`process_image_with_class_list` for a memory-mapped raster: cropped instances only."""
+    sam3 = registry.get("sam3")
+    tile_size = tile_size or max(reader.size)
+    params = _result_params(reader, score_threshold, mask_threshold, tile_size)
+    cached, missing = class_result_store.lookup(image_key, class_names, **params)
+    instances = []
+    with span("sam3_classes", classes=len(class_names), cached=len(cached), tiled=True) as attrs:
+        fresh = zip(missing, sam3.predict_for_classes_tiled(
+            reader, missing,
+            score_threshold=score_threshold, mask_threshold=mask_threshold,
+            tile_size=tile_size, overlap=SAM3_TILE_OVERLAP, batch_size=batch_size,
+            cache_key=image_key, paste_masks=False,
+        )) if missing else iter(())
+        for class_name, res, from_cache in class_result_store.merge(class_names, cached, fresh):
+            if not from_cache and image_key:
+                res = class_result_store.put(image_key, class_name, res, **params)
+            if on_class_result is not None:
+                on_class_result(class_name, res)
+            if render:
+                instances.extend(res["instances"])
+        attrs["masks"] = len(instances)
+
+    if not render:
+        return None
+    with span("overlay", masks=len(instances), width=reader.width, height=reader.height):
+        preview = reader.thumbnail(RASTER_PREVIEW_MAX_SIDE)
+        return render_instances(preview, subsample_instances(instances, reader.stride_for(RASTER_PREVIEW_MAX_SIDE)))
+
+
+def _segmentations(class_name: str, res: Dict[str, Any], pixel_size_m: Optional[float] = None) -> List[Dict[str, Any]]:
+    """Per-instance JSON records for one class result; masks as COCO RLE, plus area / centroid."""
+    if "instances" in res:
+        width, height = res["size"]
+        stats = instance_records(*instance_areas_centroids(res["instances"]), pixel_size_m)
+        return [
+            {
+                "label": class_name,
+                "score": round(float(inst["score"]), 4),
+                "box": [round(float(v), 1) for v in inst["box"]],
+                "rle": encode_rle_cropped(inst["mask"], inst["box"], (height, width)),
+                **inst_stats,
+            }
+            for inst, inst_stats in zip(res["instances"], stats)
+        ]
+    # areas / centroids reduced on the masks' device; only the RLE needs them on the host
+    stats = instance_records(*mask_areas_centroids(res["masks"]), pixel_size_m)
+    masks = res["masks"].bool().cpu().numpy()
+    return [
+        {
+            "label": class_name,
+            "score": round(float(score), 4),
+            "box": [round(float(v), 1) for v in box],
+            "rle": encode_rle(mask),
+            **inst_stats,
+        }
+        for mask, score, box, inst_stats in zip(masks, res["scores"].tolist(), res["boxes"].tolist(), stats)
+    ]
+
+
+def _segment_batch(jobs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    InferenceWorker handler: segment a micro-batch of concurrent requests.
+    Non-tiled images share one SAM3 vision-backbone forward pass.
+    Returns {'image_masked': overlay (None if headless), 'segmentations': [...], 'stats': {...}} per job,
+    or the exception for a job that failed, so it does not fail the rest of the batch.
+    A job's `on_class_result(class_name, segmentations)` gets each class's JSON records.
+    """
+    now = time.perf_counter()
+    metrics.BATCH_SIZE.observe(len(jobs))
+    for job in jobs:
+        if "submitted_at" in job:
+            metrics.QUEUE_WAIT_SECONDS.observe(now - job["submitted_at"])
+
+    # Shared encode only for non-tiled images that still have classes to segment
+    plain = [
+        i for i, job in enumerate(jobs)
+        if not (SAM3_TILE_SIZE and max(job["image"].size) > SAM3_TILE_SIZE)
+        and class_result_store.missing(
+            job.get("image_key"), job["class_names"],
+            **_result_params(job["image"], SAM3_SCORE_THRESHOLD, SAM3_MASK_THRESHOLD, SAM3_TILE_SIZE),
+        )
+    ]
+    embeds = {}
+    if plain:
+        try:
+            with span("sam3_encode", images=len(plain), requests=[job.get("request_id") for job in jobs]):
+                embeds = dict(zip(plain, registry.get("sam3").encode_images(
+                    [jobs[i]["image"] for i in plain],
+                    [jobs[i].get("image_key") for i in plain],
+                )))
+        except Exception:
+            # e.g. one undecodable image: every job encodes its own image below, so only that one fails
+            logger.exception("shared sam3 encode failed; encoding per request")
+
+    outputs = []
+    for i, job in enumerate(jobs):
+        # worker thread: adopt the submitting request's id for log correlation
+        metrics.request_id_var.set(job.get("request_id", "-"))
+        segmentations: List[Dict[str, Any]] = []
+        user_callback = job.get("on_class_result")
+        pixel_size_m = job.get("pixel_size_m") or PIXEL_SIZE_M
+
+        def on_class_result(class_name, res, segmentations=segmentations, user_callback=user_callback,
+                            pixel_size_m=pixel_size_m):
+            records = _segmentations(class_name, res, pixel_size_m)
+            segmentations.extend(records)
+            if user_callback is not None:
+                user_callback(class_name, records)
+
+        try:
+            image_masked = process_image_with_class_list(
+                job["image"], job["class_names"],
+                image_key=job.get("image_key"),
+                image_embeds=embeds.get(i),
+                on_class_result=on_class_result,
+                render=not job.get("headless", False),
+            )
+            stats = summarize_segmentations(segmentations, pixel_size_m, job["class_names"])
+        except Exception as e:
+            logger.exception("segmentation failed")
+            outputs.append(e)
+            continue
+        outputs.append({"image_masked": image_masked, "segmentations": segmentations, "stats": stats})
+    metrics.request_id_var.set("-")
+    return outputs
+
+
+def _segment_job(image: Any, class_names: List[str], img_bytes: bytes, **extra: Any) -> Dict[str, Any]:
+    """Inference worker payload for one request; records size/class-count attributes."""
+    metrics.IMAGE_MEGAPIXELS.observe(image.width * image.height / 1e6)
+    metrics.CLASS_COUNT.observe(len(class_names))
+    return {
+        "image": image,
+        "class_names": class_names,
+        "image_key": hash_image_bytes(img_bytes),
+        "request_id": metrics.request_id_var.get(),
+        "submitted_at": time.perf_counter(),
+        **extra,
+    }
+
+
+# Model work runs on dedicated threads; concurrent requests arriving within the
+# batch window are segmented together. Gemini calls are async; file I/O uses the threadpool.
+inference_worker = InferenceWorker(
+    _segment_batch,
+    max_batch_size=int(os.environ.get("INFERENCE_MAX_BATCH", "4")),
+    batch_window_s=float(os.environ.get("INFERENCE_BATCH_WINDOW_MS", "10")) / 1000.0,
+    max_concurrency=int(os.environ.get("INFERENCE_MAX_CONCURRENCY", "1")),
+)
+
+
 def predict_for_class(image: Image.Image, class_name: str,
                       score_threshold: float = 0.60,
                       mask_threshold: float = 0.5):
     """
     Run SAM3 for a single text prompt and return post-processed results.
     """
-    inputs = processor(images=image, text=class_name, return_tensors="pt").to(device)
-
-    with torch.no_grad():
-        outputs = model(**inputs)
-
-    results = processor.post_process_instance_segmentation(
-        outputs,
-        threshold=score_threshold,
+    return registry.get("sam3").predict_for_class(
+        image,
+        class_name,
+        score_threshold=score_threshold,
         mask_threshold=mask_threshold,
-        target_sizes=inputs.get("original_sizes").tolist()
-    )[0]
-
-    return results
+    )
 
 
 def overlay_masks_with_labels(image: Image.Image,
@@ -149,69 +499,7 @@ def overlay_masks_with_labels(image: Image.Image,
     """
     Overlay colored masks and bounding boxes with labels on the image.
     """
-    image = image.convert("RGBA")
-    masks_np = 255 * masks.cpu().numpy().astype(np.uint8)
-
-    n_masks = masks_np.shape[0]
-    if n_masks == 0:
-        return image  # nothing to draw
-
-    cmap = matplotlib.colormaps.get_cmap("rainbow").resampled(n_masks)
-    colors = [
-        tuple(int(c * 255) for c in cmap(i)[:3])
-        for i in range(n_masks)
-    ]
-
-    # Overlay masks
-    for mask, color in zip(masks_np, colors):
-        mask_img = Image.fromarray(mask)
-        overlay = Image.new("RGBA", image.size, color + (0,))
-        alpha = mask_img.point(lambda v: int(v * 0.5))
-        overlay.putalpha(alpha)
-        image = Image.alpha_composite(image, overlay)
-
-    draw = ImageDraw.Draw(image)
-
-    # Font
-    w, h = image.size
-    font_size = max(4, int(min(w, h) * 0.02))
-    try:
-        font = ImageFont.truetype("arial.ttf", font_size)
-    except Exception:
-        try:
-            # Try available system fonts
-            font = ImageFont.truetype("/usr/share/fonts/cantarell/Cantarell-Bold.otf", font_size)
-        except Exception:
-            try:
-                font = ImageFont.truetype("/usr/share/fonts/adobe-source-code-pro/SourceCodePro-Bold.otf", font_size)
-            except Exception:
-                print(f"Warning: truetype fonts not found. Using default font.")
-                font = ImageFont.load_default()
-
-    # Draw bounding boxes + labels
-    for idx, (mask, color) in enumerate(zip(masks_np, colors)):
-        ys, xs = np.where(mask > 0)
-        if len(xs) == 0 or len(ys) == 0:
-            continue
-
-        x1, y1, x2, y2 = xs.min(), ys.min(), xs.max(), ys.max()
-        draw.rectangle([(x1, y1), (x2, y2)], outline=color + (255,), width=3)
-
-        label = labels[idx] if labels and idx < len(labels) else "object"
-        text = f"{label}"
-
-        text_bbox = draw.textbbox((0, 0), text, font=font)
-        tw = text_bbox[2] - text_bbox[0]
-        th = text_bbox[3] - text_bbox[1]
-
-        # text background
-        draw.rectangle(
-            [(x1, y1 - th - 4), (x1 + tw + 4, y1)],
-            fill=(0, 0, 0, 160)
-        )
-        draw.text((x1 + 2, y1 - th - 2), text, fill=(255, 255, 255), font=font)
-
-    return image
+    return render_masks(image, masks.cpu().numpy(), labels)
 
 
 @app.get("/images_list")
@@ -225,6 +513,128 @@ def images_list() -> List[str]:
     return imgs
 
 
+@app.get("/healthz")
+def healthz() -> Dict[str, Any]:
+    """Liveness: the process is up and serving requests."""
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+def readyz():
+    """Readiness: 200 once every WARMUP_MODELS entry is loaded, 503 before; per-model load times."""
+    ready = registry.is_ready(WARMUP_MODELS)
+    body = {"ready": ready, "models": registry.status()}
+    return JSONResponse(body, status_code=200 if ready else 503)
+
+
+def _collect_component_metrics() -> None:
+    """Scrape-time gauges from the embedding cache, inference worker and model registry."""
+    cache = embedding_cache.stats()
+    for k in ("hits", "misses", "evictions", "disk_hits", "disk_writes"):
+        _CACHE_EVENTS.set(cache[k], event=k)
+    _CACHE_HIT_RATE.set(cache["hit_rate"])
+    _CACHE_BYTES.set(cache["bytes"])
+    _CACHE_ENTRIES.set(cache["entries"])
+
+    results = class_result_store.stats()
+    for k in ("hits", "misses", "evictions"):
+        _RESULT_STORE_EVENTS.set(results[k], event=k)
+    _RESULT_STORE_BYTES.set(results["bytes"])
+
+    response_cache = get_response_cache()
+    if response_cache is not None:
+        llm = response_cache.stats()
+        for k in ("hits", "misses", "sqlite_hits", "expired", "evictions", "bypassed"):
+            _LLM_CACHE_EVENTS.set(llm[k], event=k)
+        _LLM_CACHE_HIT_RATE.set(llm["hit_rate"])
+
+    worker = inference_worker.stats()
+    _WORKER_GAUGE.set(worker["queue_depth"], kind="queue_depth")
+    _WORKER_GAUGE.set(worker["in_flight"], kind="in_flight")
+    _WORKER_GAUGE.set(worker["avg_batch_size"], kind="avg_batch_size")
+
+    for kind, value in metrics.process_memory().items():
+        _PROCESS_MEMORY.set(value, kind=kind)
+
+    for name, st in registry.status().items():
+        _MODEL_READY.set(1 if st["state"] == "ready" else 0, model=name)
+        if st["load_time_s"] is not None:
+            _MODEL_LOAD_SECONDS.set(st["load_time_s"], model=name, phase="load")
+        if st["warmup_time_s"] is not None:
+            _MODEL_LOAD_SECONDS.set(st["warmup_time_s"], model=name, phase="warmup")
+
+
+_CACHE_EVENTS = metrics.REGISTRY.gauge(
+    "embedding_cache_events", "Embedding cache lookups and writes since start", ["event"])
+_CACHE_HIT_RATE = metrics.REGISTRY.gauge("embedding_cache_hit_rate", "Embedding cache hit rate")
+_CACHE_BYTES = metrics.REGISTRY.gauge("embedding_cache_bytes", "Embedding cache memory use")
+_CACHE_ENTRIES = metrics.REGISTRY.gauge("embedding_cache_entries", "Embedding cache entries in memory")
+_RESULT_STORE_EVENTS = metrics.REGISTRY.gauge(
+    "class_result_store_events", "Per-class result store lookups since start", ["event"])
+_RESULT_STORE_BYTES = metrics.REGISTRY.gauge("class_result_store_bytes", "Per-class result store memory use")
+_LLM_CACHE_EVENTS = metrics.REGISTRY.gauge(
+    "gemini_response_cache_events", "Gemini response cache lookups since start", ["event"])
+_LLM_CACHE_HIT_RATE = metrics.REGISTRY.gauge("gemini_response_cache_hit_rate", "Gemini response cache hit rate")
+_LLM_IMAGE_BYTES = metrics.REGISTRY.counter(
+    "gemini_image_bytes_total", "Image bytes before (original) and after (sent) LLM preprocessing", ["kind"])
+_WORKER_GAUGE = metrics.REGISTRY.gauge("inference_worker", "Inference worker state", ["kind"])
+_MODEL_READY = metrics.REGISTRY.gauge("model_ready", "1 once the model is loaded and warmed up", ["model"])
+_MODEL_LOAD_SECONDS = metrics.REGISTRY.gauge(
+    "model_load_seconds", "Model load / warm-up duration", ["model", "phase"])
+_PROCESS_MEMORY = metrics.REGISTRY.gauge(
+    "process_memory_bytes", "Memory of this worker process (rss, pss, shared, private, swap)", ["kind"])
+metrics.REGISTRY.add_collector(_collect_component_metrics)
+
+
+@app.get("/metrics")
+def metrics_endpoint() -> PlainTextResponse:
+    """Prometheus text exposition: stage/request latency histograms, cache, worker and model gauges."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/cache_stats")
+def cache_stats() -> Dict[str, Any]:
+    """Hit/miss/eviction counters of the image embedding cache."""
+    return embedding_cache.stats()
+
+
+@app.get("/class_result_stats")
+def class_result_stats() -> Dict[str, Any]:
+    """Hit/miss/eviction counters of the per-image class result store."""
+    return class_result_store.stats()
+
+
+@app.get("/response_cache_stats")
+def response_cache_stats() -> Dict[str, Any]:
+    """Hit/miss/TTL counters of the Gemini response cache ({"enabled": false} when GEMINI_CACHE=0)."""
+    cache = get_response_cache()
+    if cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **cache.stats()}
+
+
+@app.get("/runtime")
+def runtime_settings() -> Dict[str, Any]:
+    """Effective device, thread pools, CPU affinity and autograd settings of this worker process."""
+    return describe_runtime()
+
+
+@app.get("/memory")
+def memory() -> Dict[str, Any]:
+    """RSS / PSS / shared / private bytes of this worker (and of the serving parent under API.serve)."""
+    body: Dict[str, Any] = {"pid": os.getpid(), **metrics.process_memory()}
+    parent = os.environ.get("SERVE_PARENT_PID")
+    if parent:
+        body["parent"] = {"pid": int(parent), **metrics.process_memory(parent)}
+    return body
+
+
+@app.get("/worker_stats")
+def worker_stats() -> Dict[str, Any]:
+    """Queue depth, batch-size and queue-wait metrics of the inference worker."""
+    return inference_worker.stats()
+
+
 @app.get("/image")
 def get_image(path: str):
     p = Path(path)
@@ -233,11 +643,109 @@ def get_image(path: str):
     return FileResponse(str(p))
 
 
+def _parse_chat_history(chat_history: str) -> Any:
+    try:
+        return json.loads(chat_history)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid JSON payload: {e}")
+
+
+def _save_and_decode_upload(img_bytes: bytes, filename: str):
+    """
+    Persist the upload next to API outputs and decode it; returns (path, RGB image).
+    Uploads larger than one SAM3 tile come back as a memory-mapped ImageReader instead.
+    """
+    tmp_img_path = OUTPUTS_DIR / f"upload_{filename}"
+    with open(tmp_img_path, "wb") as f:
+        f.write(img_bytes)
+    try:
+        if SAM3_TILE_SIZE and max(image_size(str(tmp_img_path))) > SAM3_TILE_SIZE:
+            return tmp_img_path, open_image(str(tmp_img_path), cache_dir=RASTER_CACHE_DIR)
+        return tmp_img_path, Image.open(BytesIO(img_bytes)).convert("RGB")
+    except RasterTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except Image.DecompressionBombError as e:
+        raise HTTPException(status_code=413, detail=f"{e} Set SAM3_TILE_SIZE to accept large rasters.")
+
+
+def _parse_crop(crop: str) -> Optional[tuple]:
+    """Optional "x0,y0,x1,y1" form field (pixels) limiting what the LLM sees."""
+    if not crop:
+        return None
+    try:
+        x0, y0, x1, y1 = (int(float(v)) for v in crop.split(","))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="crop must be 'x0,y0,x1,y1'")
+    if x1 <= x0 or y1 <= y0:
+        raise HTTPException(status_code=400, detail="crop must have x1 > x0 and y1 > y0")
+    return (x0, y0, x1, y1)
+
+
+def _prepare_for_llm(image: Any, crop: Optional[tuple] = None,
+                     source_nbytes: Optional[int] = None) -> PreparedImage:
+    """Downscale + encode once for Gemini (GEMINI_IMAGE_* settings); records bytes saved."""
+    with span("image_prep", width=image.width, height=image.height) as attrs:
+        if isinstance(image, ImageReader):
+            # Strided preview of the (cropped) raster at 2x the target, then the usual LANCZOS resize
+            max_side = get_model().image_config.max_side
+            image = image.thumbnail(2 * max_side if max_side else RASTER_PREVIEW_MAX_SIDE, box=crop)
+            crop = None
+        prepared = prepare_image(image, get_model().image_config, crop=crop, source_nbytes=source_nbytes)
+        attrs.update(sent_bytes=prepared.nbytes, saved_bytes=prepared.bytes_saved)
+    _LLM_IMAGE_BYTES.inc(prepared.original_nbytes, kind="original")
+    _LLM_IMAGE_BYTES.inc(prepared.nbytes, kind="sent")
+    return prepared
+
+
+def _overlay_crop(image: Any, crop: Optional[tuple]) -> Optional[tuple]:
+    """`crop` (pixels of the upload) in overlay pixels: an ImageReader's overlay is its strided preview."""
+    if crop is None or not isinstance(image, ImageReader):
+        return crop
+    stride = image.stride_for(RASTER_PREVIEW_MAX_SIDE)
+    x0, y0, x1, y1 = crop
+    return (x0 // stride, y0 // stride, -(-x1 // stride), -(-y1 // stride))
+
+
+def _save_classes_json(tmp_img_path: Path, refined_classes: List[str]) -> None:
+    classes_path = str(tmp_img_path) + ".classes.json"
+    with open(classes_path, "w", encoding="utf-8") as f:
+        json.dump({"classes": refined_classes}, f, ensure_ascii=False, indent=2)
+
+
+def _save_masked_image(image_masked: Image.Image, tmp_img_path: Path) -> Path:
+    ASSETS_DIR.mkdir(parents=True, exist_ok=True)
+    out_path = ASSETS_DIR / f"masked_{Path(tmp_img_path).stem}.png"
+    image_masked.save(out_path, format="PNG")
+    return out_path
+
+
+def _class_result_event(class_name: str, segmentations: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Streaming payload for one finished class: count and per-instance score/box/RLE mask/area."""
+    return {
+        "event": "class_result",
+        "class": class_name,
+        "count": len(segmentations),
+        "segmentations": segmentations,
+    }
+
+
+def _answer_json(seg_output: Dict[str, Any]) -> Dict[str, Any]:
+    """Detection metadata for the chat answer: labels/scores and the per-class counts and areas."""
+    return {
+        "detections": [{"label": s["label"], "score": s["score"]} for s in seg_output["segmentations"]],
+        "stats": seg_output["stats"],
+    }
+
+
 @app.post("/segment_image")
 async def segment_image(
     chat_history: str = Form(...),
     # classes_json: str = Form(...),
     image: UploadFile = File(...),
+    fresh: bool = Form(False),
+    crop: str = Form(""),
+    pixel_size_m: Optional[float] = Form(None),
+    headless: bool = Form(False),
 ):
     """Main endpoint: upload image + chat history + proposed classes.
 
@@ -248,49 +756,139 @@ async def segment_image(
       4. Persist refined classes JSON for pipeline.
       5. Run detect+segment pipeline.
       6. Invoke chat answer model for user response.
+
+    `fresh=true` bypasses the Gemini response cache for this request.
+    `crop="x0,y0,x1,y1"` limits the region sent to Gemini (segmentation uses the whole image).
+    `pixel_size_m` (metres per pixel, default PIXEL_SIZE_M) adds areas in m² to "stats".
+    `headless=true` skips overlay rendering and the PNG: only counts, areas and masks are returned.
     """
-    print("chat_History na początku endpointu:", chat_history)
-    try:
-        import json
-        chat_hist = json.loads(chat_history)
-        #classes_data = json.loads(classes_json)
-        #proposed_classes = classes_data.get("classes", [])
-        # if not proposed_classes:
-        #     raise ValueError("classes list required")
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Invalid JSON payload: {e}")
+    logger.debug("chat_history", extra={"fields": {"chat_history": chat_history}})
+    chat_hist = _parse_chat_history(chat_history)
+    crop_box = _parse_crop(crop)
 
     # Save uploaded image
     img_bytes = await image.read()
-    img_pillow = Image.open(BytesIO(img_bytes)).convert("RGB")
-    tmp_img_path = OUTPUTS_DIR / f"upload_{image.filename}"
-    with open(tmp_img_path, "wb") as f:
-        f.write(img_bytes)
+    with span("decode", bytes=len(img_bytes)) as attrs:
+        tmp_img_path, img_pillow = await run_in_threadpool(_save_and_decode_upload, img_bytes, image.filename)
+        attrs.update(width=img_pillow.width, height=img_pillow.height)
+
+    # Downscaled + encoded once; reused by both LLM calls when there is nothing to overlay
+    llm_image = await run_in_threadpool(_prepare_for_llm, img_pillow, crop_box, len(img_bytes))
 
     # Refine classes using LLM with image context
-    refined_classes = suggest_classes(str(tmp_img_path), chat_hist)
-    print(refined_classes)
+    with span("suggest_classes") as attrs:
+        refined_classes = await asuggest_classes(llm_image, chat_hist, fresh=fresh)
+        attrs["classes"] = refined_classes
+    logger.info("classes", extra={"fields": {"classes": refined_classes}})
 
     # Persist refined classes JSON
-    classes_path = str(tmp_img_path) + ".classes.json"
-
-    with open(classes_path, "w", encoding="utf-8") as f:
-        json.dump({"classes": refined_classes}, f, ensure_ascii=False, indent=2)
+    _save_classes_json(tmp_img_path, refined_classes)
 
-    image_masked = process_image_with_class_list(img_pillow, refined_classes)
+    with span("segmentation", classes=len(refined_classes)):
+        seg_output = await inference_worker.run(_segment_job(
+            img_pillow, refined_classes, img_bytes, pixel_size_m=pixel_size_m, headless=headless,
+        ))
+    image_masked = seg_output["image_masked"]
+    answer_image = llm_image
+    if image_masked is not None and seg_output["segmentations"]:
+        answer_image = await run_in_threadpool(_prepare_for_llm, image_masked, _overlay_crop(img_pillow, crop_box))
 
     # Generate chat answer (LLM-based, fallback handled internally)
-    chat_response = chat_answer(
-        chat_hist,
-        refined_classes,
-        image_masked,
-    )
+    with span("chat_answer"):
+        chat_response = await achat_answer(chat_hist, refined_classes, answer_image,
+                                           answer_json=_answer_json(seg_output), fresh=fresh)
 
+    out_path = None
+    if image_masked is not None:
+        with span("png_save"):
+            out_path = await run_in_threadpool(_save_masked_image, image_masked, tmp_img_path)
 
-    ASSETS_DIR.mkdir(parents=True, exist_ok=True)
-    out_name = f"masked_{Path(tmp_img_path).stem}.png"
-    out_path = ASSETS_DIR / out_name
-    image_masked.save(out_path, format="PNG")
+    return {
+        "chat_response": chat_response,
+        "masked_image_path": str(out_path) if out_path else None,
+        "segmentations": seg_output["segmentations"],
+        "stats": seg_output["stats"],
+    }
+
+
+@app.post("/segment_image_stream")
+async def segment_image_stream(
+    chat_history: str = Form(...),
+    image: UploadFile = File(...),
+    fresh: bool = Form(False),
+    crop: str = Form(""),
+    pixel_size_m: Optional[float] = Form(None),
+    headless: bool = Form(False),
+):
+    """Streaming variant of /segment_image (NDJSON, one event per line).
+
+    Events, in order:
+      {"event": "classes", "classes": [...]}            after the class-suggestion LLM call
+      {"event": "class_result", "class": ..., "count": ..., "segmentations": [...]}
+                                                        once per class as SAM3 finishes it
+      {"event": "stats", "stats": {...}}                per-class counts and areas
+      {"event": "overlay", "masked_image_path": ...}    rendered overlay saved (not when headless)
+      {"event": "answer", "chat_response": ...}         chat answer, last
+      {"event": "error", "detail": ...}                 on failure, then the stream ends
+    """
+    chat_hist = _parse_chat_history(chat_history)
+    crop_box = _parse_crop(crop)
+    img_bytes = await image.read()
+    filename = image.filename
 
-    return {"chat_response": chat_response, "masked_image_path": str(out_path)}
-        
\ No newline at end of file
+    def line(event: Dict[str, Any]) -> bytes:
+        return (json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8")
+
+    async def events():
+        try:
+            with span("decode", bytes=len(img_bytes)):
+                tmp_img_path, img_pillow = await run_in_threadpool(_save_and_decode_upload, img_bytes, filename)
+            llm_image = await run_in_threadpool(_prepare_for_llm, img_pillow, crop_box, len(img_bytes))
+            with span("suggest_classes"):
+                refined_classes = await asuggest_classes(llm_image, chat_hist, fresh=fresh)
+            yield line({"event": "classes", "classes": refined_classes})
+            await run_in_threadpool(_save_classes_json, tmp_img_path, refined_classes)
+
+            loop = asyncio.get_running_loop()
+            class_events: asyncio.Queue = asyncio.Queue()
+
+            def on_class_result(class_name: str, records: List[Dict[str, Any]]) -> None:
+                # called on the inference thread
+                loop.call_soon_threadsafe(class_events.put_nowait, _class_result_event(class_name, records))
+
+            segmentation = asyncio.wrap_future(inference_worker.submit(
+                _segment_job(img_pillow, refined_classes, img_bytes, on_class_result=on_class_result,
+                             pixel_size_m=pixel_size_m, headless=headless)
+            ))
+            while True:
+                getter = asyncio.ensure_future(class_events.get())
+                done, _ = await asyncio.wait({getter, segmentation}, return_when=asyncio.FIRST_COMPLETED)
+                if getter in done:
+                    yield line(getter.result())
+                    continue
+                getter.cancel()
+                break
+            while not class_events.empty():
+                yield line(class_events.get_nowait())
+            seg_output = segmentation.result()
+            image_masked = seg_output["image_masked"]
+            yield line({"event": "stats", "stats": seg_output["stats"]})
+
+            if image_masked is not None:
+                with span("png_save"):
+                    out_path = await run_in_threadpool(_save_masked_image, image_masked, tmp_img_path)
+                yield line({"event": "overlay", "masked_image_path": str(out_path)})
+
+            answer_image = llm_image
+            if image_masked is not None and seg_output["segmentations"]:
+                answer_image = await run_in_threadpool(_prepare_for_llm, image_masked,
+                                                       _overlay_crop(img_pillow, crop_box))
+            with span("chat_answer"):
+                chat_response = await achat_answer(chat_hist, refined_classes, answer_image,
+                                                   answer_json=_answer_json(seg_output), fresh=fresh)
+            yield line({"event": "answer", "chat_response": chat_response})
+        except Exception as e:
+            logger.exception("segment_image_stream failed")
+            yield line({"event": "error", "detail": str(e)})
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
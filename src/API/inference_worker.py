@@ -0,0 +1,142 @@
+"""Dedicated inference worker with a request queue and cross-request micro-batching."""
+from typing import Any, Callable, Dict, List
+from concurrent.futures import Future
+import asyncio
+import queue
+import threading
+import time
+
+
+class InferenceWorker:
+    """
+    Runs a batch handler on dedicated threads, off the asyncio event loop.
+
+    Requests are queued with `submit` (returns a concurrent Future) or awaited with
+    `run`. Each worker thread takes the first queued request, then keeps collecting
+    requests for up to `batch_window_s` seconds or until `max_batch_size` are
+    gathered, and calls `handler(payloads) -> results` once for the whole batch.
+    `max_concurrency` is the number of worker threads, i.e. batches in flight.
+    A handler isolates per-request failures by returning the exception in that request's
+    slot; only that request's future fails. If the handler itself raises, the whole batch fails.
+
+    Threads start lazily on the first submit (so the worker survives a fork).
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[List[Any]], List[Any]],
+        max_batch_size: int = 4,
+        batch_window_s: float = 0.01,
+        max_concurrency: int = 1,
+        name: str = "inference",
+    ) -> None:
+        self.handler = handler
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.batch_window_s = max(0.0, float(batch_window_s))
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.name = name
+        self._queue: "queue.Queue" = queue.Queue()
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        # metrics
+        self.requests = 0
+        self.batches = 0
+        self.in_flight = 0
+        self.max_batch_seen = 0
+        self.batch_size_counts: Dict[int, int] = {}
+        self.total_queue_wait_s = 0.0
+
+    def _ensure_started(self) -> None:
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.max_concurrency):
+                t = threading.Thread(target=self._loop, name=f"{self.name}-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def stop(self) -> None:
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(None)
+        for t in threads:
+            t.join()
+
+    def submit(self, payload: Any) -> Future:
+        self._ensure_started()
+        fut: Future = Future()
+        self._queue.put((payload, fut, time.perf_counter()))
+        return fut
+
+    async def run(self, payload: Any) -> Any:
+        return await asyncio.wrap_future(self.submit(payload))
+
+    def _collect(self, first) -> List[Any]:
+        batch = [first]
+        deadline = time.perf_counter() + self.batch_window_s
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # keep the shutdown sentinel for this thread's next iteration
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _loop(self) -> None:
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = self._collect(first)
+            # drop requests whose caller already gave up
+            batch = [item for item in batch if item[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            now = time.perf_counter()
+            with self._lock:
+                self.requests += len(batch)
+                self.batches += 1
+                self.in_flight += len(batch)
+                self.max_batch_seen = max(self.max_batch_seen, len(batch))
+                self.batch_size_counts[len(batch)] = self.batch_size_counts.get(len(batch), 0) + 1
+                self.total_queue_wait_s += sum(now - enq for _, _, enq in batch)
+
+            try:
+                results = self.handler([payload for payload, _, _ in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError("Batch handler returned a wrong number of results")
+            except BaseException as e:
+                for _, fut, _ in batch:
+                    fut.set_exception(e)
+            else:
+                for (_, fut, _), res in zip(batch, results):
+                    if isinstance(res, BaseException):
+                        fut.set_exception(res)
+                    else:
+                        fut.set_result(res)
+            finally:
+                with self._lock:
+                    self.in_flight -= len(batch)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "in_flight": self.in_flight,
+                "requests": self.requests,
+                "batches": self.batches,
+                "avg_batch_size": self.requests / self.batches if self.batches else 0.0,
+                "max_batch_size_seen": self.max_batch_seen,
+                "batch_size_counts": dict(sorted(self.batch_size_counts.items())),
+                "avg_queue_wait_s": self.total_queue_wait_s / self.requests if self.requests else 0.0,
+                "max_batch_size": self.max_batch_size,
+                "batch_window_s": self.batch_window_s,
+                "max_concurrency": self.max_concurrency,
+            }
@@ -0,0 +1,300 @@
+"""In-process metrics, timing spans and structured logging for the API.
+
+Metrics are kept in memory and rendered in the Prometheus text exposition format
+by `render()` (served at /metrics), so no collector or client library is needed.
+"""
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+from contextlib import contextmanager
+import contextvars
+import json
+import logging
+import math
+import os
+import threading
+import time
+import uuid
+
+LabelValues = Tuple[str, ...]
+
+# Seconds; spans range from sub-millisecond rendering to multi-second Gemini calls
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+request_id_var: contextvars.ContextVar[str] = contextvars.ContextVar("request_id", default="-")
+
+logger = logging.getLogger("API.metrics")
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, help, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS) -> None:
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # per label set: [bucket counts..., sum, count]
+        self._values: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._values.items()]
+        lines = []
+        for key, state in items:
+            for bound, count in zip(self.buckets, state):
+                le = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {_format_value(count)}")
+            inf = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{inf} {_format_value(state[-1])}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(state[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {_format_value(state[-1])}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Named metrics plus scrape-time collectors: callables that refresh gauges from
+    other components' stats (caches, worker queue, model registry) right before rendering.
+    """
+
+    def __init__(self) -> None:
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], None]] = []
+
+    def _add(self, metric: _Metric) -> Any:
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._add(Gauge(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def add_collector(self, fn: Callable[[], None]) -> None:
+        self._collectors.append(fn)
+
+    def render(self) -> str:
+        for fn in self._collectors:
+            try:
+                fn()
+            except Exception:
+                logger.exception("metrics collector failed")
+        return "\n".join(m.render() for m in self._metrics.values()) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "segment_stage_seconds", "Wall time of one request stage", ["stage"])
+REQUEST_SECONDS = REGISTRY.histogram(
+    "http_request_seconds", "HTTP request latency", ["path", "method", "status"])
+IMAGE_MEGAPIXELS = REGISTRY.histogram(
+    "segment_image_megapixels", "Uploaded image size", buckets=(0.25, 0.5, 1, 2, 4, 8, 16, 32, 64, 128))
+CLASS_COUNT = REGISTRY.histogram(
+    "segment_class_count", "Classes segmented per request", buckets=(0, 1, 2, 3, 4, 6, 8, 10, 15, 20))
+QUEUE_WAIT_SECONDS = REGISTRY.histogram(
+    "inference_queue_wait_seconds", "Time a request waited for the inference worker")
+BATCH_SIZE = REGISTRY.histogram(
+    "inference_batch_size", "Requests per inference micro-batch", buckets=(1, 2, 3, 4, 6, 8, 12, 16))
+
+
+@contextmanager
+def span(stage: str, **attrs: Any) -> Iterator[Dict[str, Any]]:
+    """
+    Time a request stage: observes `segment_stage_seconds{stage=...}` and logs one
+    structured DEBUG record with `attrs`. The yielded dict can be updated inside the
+    block to attach attributes known only afterwards (e.g. the number of masks).
+    """
+    fields = dict(attrs)
+    t0 = time.perf_counter()
+    try:
+        yield fields
+    finally:
+        duration = time.perf_counter() - t0
+        STAGE_SECONDS.observe(duration, stage=stage)
+        logger.debug("span", extra={"fields": {"stage": stage, "duration_ms": round(duration * 1000, 2), **fields}})
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+def render() -> str:
+    return REGISTRY.render()
+
+
+# --- Process memory ---
+
+_SMAPS_FIELDS = {
+    "Rss": "rss", "Pss": "pss", "Shared_Clean": "shared_clean", "Shared_Dirty": "shared_dirty",
+    "Private_Clean": "private_clean", "Private_Dirty": "private_dirty", "Swap": "swap",
+}
+
+
+def process_memory(pid: Any = "self") -> Dict[str, int]:
+    """
+    Memory of a process in bytes from /proc/<pid>/smaps_rollup (Linux): "rss", "pss"
+    (shared pages divided among the processes mapping them), "shared" / "private"
+    (clean + dirty) and "swap". Forked workers sharing copy-on-write model weights show a
+    large "shared" and a small "private" part; summing "pss" over processes gives the real total.
+    Falls back to VmRSS from /proc/<pid>/status; {} where neither exists.
+    """
+    values: Dict[str, int] = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", encoding="ascii") as f:
+            for line in f:
+                key, _, rest = line.partition(":")
+                if key in _SMAPS_FIELDS:
+                    values[_SMAPS_FIELDS[key]] = int(rest.split()[0]) * 1024
+    except OSError:
+        try:
+            with open(f"/proc/{pid}/status", encoding="ascii") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return {"rss": int(line.split()[1]) * 1024}
+        except OSError:
+            pass
+        return {}
+    return {
+        "rss": values.get("rss", 0),
+        "pss": values.get("pss", 0),
+        "shared": values.get("shared_clean", 0) + values.get("shared_dirty", 0),
+        "private": values.get("private_clean", 0) + values.get("private_dirty", 0),
+        "swap": values.get("swap", 0),
+    }
+
+
+# --- Structured logging ---
+
+class _RequestIdFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+
+class StructuredFormatter(logging.Formatter):
+    """`key=value` text, or one JSON object per line with `json=True`; `extra={"fields": {...}}` is merged in."""
+
+    def __init__(self, json_lines: bool = False) -> None:
+        super().__init__()
+        self.json_lines = json_lines
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload: Dict[str, Any] = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "msg": record.getMessage(),
+        }
+        payload.update(getattr(record, "fields", None) or {})
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        if self.json_lines:
+            return json.dumps(payload, ensure_ascii=False, default=str)
+        return " ".join(
+            f"{k}={json.dumps(v, ensure_ascii=False, default=str) if isinstance(v, str) and ' ' in v else v}"
+            for k, v in payload.items()
+        )
+
+
+def configure_logging(level: Optional[str] = None, json_lines: Optional[bool] = None) -> None:
+    """Root logging from LOG_LEVEL (default INFO) and LOG_FORMAT ("text" or "json")."""
+    level = (level or os.environ.get("LOG_LEVEL", "INFO")).upper()
+    if json_lines is None:
+        json_lines = os.environ.get("LOG_FORMAT", "text").lower() == "json"
+    handler = logging.StreamHandler()
+    handler.setFormatter(StructuredFormatter(json_lines=json_lines))
+    handler.addFilter(_RequestIdFilter())
+    root = logging.getLogger()
+    for h in list(root.handlers):
+        if getattr(h, "_structured", False):
+            root.removeHandler(h)
+    handler._structured = True
+    root.addHandler(handler)
+    root.setLevel(level)
@@ -0,0 +1,105 @@
+"""Lazy model registry: models load on first use or via a background warm-up."""
+from typing import Any, Callable, Dict, Iterable, List, Optional
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class _Entry:
+    def __init__(self, loader: Callable[[], Any], warmup: Optional[Callable[[Any], None]]) -> None:
+        self.loader = loader
+        self.warmup = warmup
+        self.lock = threading.Lock()
+        self.instance: Any = None
+        self.state = "pending"  # pending -> loading -> warming -> ready | error
+        self.load_time_s: Optional[float] = None
+        self.warmup_time_s: Optional[float] = None
+        self.error: Optional[str] = None
+
+
+class ModelRegistry:
+    """
+    Holds named model loaders. `get(name)` loads a model on first use (thread-safe,
+    at most once) and runs its optional warm-up, e.g. a dummy forward pass to prime
+    kernels. `start_warmup` does the same for several models on a background thread.
+    """
+
+    def __init__(self) -> None:
+        self._entries: Dict[str, _Entry] = {}
+
+    def register(
+        self,
+        name: str,
+        loader: Callable[[], Any],
+        warmup: Optional[Callable[[Any], None]] = None,
+    ) -> None:
+        self._entries[name] = _Entry(loader, warmup)
+
+    def names(self) -> List[str]:
+        return list(self._entries)
+
+    def get(self, name: str) -> Any:
+        entry = self._entries[name]
+        if entry.state == "ready":
+            return entry.instance
+        with entry.lock:
+            if entry.state != "ready":
+                self._load(name, entry)
+        return entry.instance
+
+    def _load(self, name: str, entry: _Entry) -> None:
+        # caller holds entry.lock
+        try:
+            entry.state = "loading"
+            t0 = time.perf_counter()
+            instance = entry.loader()
+            entry.load_time_s = time.perf_counter() - t0
+            if entry.warmup is not None:
+                entry.state = "warming"
+                t0 = time.perf_counter()
+                entry.warmup(instance)
+                entry.warmup_time_s = time.perf_counter() - t0
+            entry.instance = instance
+            entry.error = None
+            entry.state = "ready"
+            logger.info("model ready", extra={"fields": {
+                "model": name, "load_s": round(entry.load_time_s, 3),
+                "warmup_s": None if entry.warmup_time_s is None else round(entry.warmup_time_s, 3),
+            }})
+        except Exception as e:
+            entry.state = "error"
+            entry.error = f"{type(e).__name__}: {e}"
+            logger.exception("model load failed", extra={"fields": {"model": name}})
+            raise
+
+    def warmup(self, names: Optional[Iterable[str]] = None) -> None:
+        """Load (and warm up) the given models, continuing past failures."""
+        for name in self.names() if names is None else names:
+            try:
+                self.get(name)
+            except Exception:
+                pass
+
+    def start_warmup(self, names: Optional[Iterable[str]] = None) -> threading.Thread:
+        names = self.names() if names is None else list(names)
+        thread = threading.Thread(target=self.warmup, args=(names,),
+                                  name="model-warmup", daemon=True)
+        thread.start()
+        return thread
+
+    def is_ready(self, names: Optional[Iterable[str]] = None) -> bool:
+        names = self.names() if names is None else names
+        return all(self._entries[n].state == "ready" for n in names)
+
+    def status(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            name: {
+                "state": e.state,
+                "load_time_s": e.load_time_s,
+                "warmup_time_s": e.warmup_time_s,
+                "error": e.error,
+            }
+            for name, e in self._entries.items()
+        }
@@ -0,0 +1,373 @@
+"""
+Production serving: the models load once in this (parent) process, then `--workers`
+uvicorn workers are forked from it and share the weights copy-on-write. The parent
+accepts connections on the public port and hands each one to the worker with the fewest
+open connections (over per-worker Unix sockets), restarts workers that die and logs
+per-process RSS / PSS / shared / private memory.
+
+Run from `src/`:
+    python -m API.serve --workers 4 --port 8000
+
+- `--preload` (PRELOAD_MODELS, default "sam3") are the registry models loaded before the
+  fork; others (e.g. "gemini", whose client is not fork-safe) load lazily in each worker.
+- The parent loads and warms up single-threaded: GNU OpenMP hangs in a forked child once
+  the parent has run a multi-threaded parallel region. Each worker then applies the
+  device_utils runtime config with its own WORKER_INDEX: TORCH_THREADS / CPU_AFFINITY as
+  set, otherwise an even, disjoint slice of the cores with as many threads.
+- Per-worker state is not shared: EMBEDDING_CACHE_BYTES / CLASS_RESULT_CACHE_BYTES apply
+  per worker (their disk tiers can be shared), as do the inference queues.
+- CUDA cannot be initialized before a fork, so with a GPU nothing is preloaded and every
+  worker loads its own models.
+"""
+from dataclasses import replace
+from typing import Dict, List, Optional, Set
+import argparse
+import asyncio
+import gc
+import itertools
+import logging
+import os
+import shutil
+import signal
+import tempfile
+import time
+
+from DetectSegment.utils.device_utils import RuntimeConfig, apply_runtime, available_cpus, format_runtime
+
+logger = logging.getLogger("API.serve")
+
+# A worker's first crash restarts it right away; each further crash within _STABLE_S of its
+# start counts as a crash loop and waits 1, 2, 4... s (at most _MAX_BACKOFF_S) before restarting
+_STABLE_S = 60.0
+_MAX_BACKOFF_S = 30.0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser("DetectSegment API, pre-forked workers sharing preloaded models")
+    p.add_argument("--host", default=os.environ.get("HOST", "0.0.0.0"))
+    p.add_argument("--port", type=int, default=int(os.environ.get("PORT", "8000")))
+    p.add_argument("--workers", type=int, default=int(os.environ.get("WORKERS", "2")))
+    p.add_argument("--preload", default=os.environ.get("PRELOAD_MODELS", "sam3"),
+                   help="Comma separated registry models loaded before forking")
+    p.add_argument("--socket_dir", default=None, help="Directory for the worker sockets (default: a temp dir)")
+    p.add_argument("--memory_report_s", type=float, default=300.0,
+                   help="Log per-process memory every N seconds (0: only at startup)")
+    p.add_argument("--graceful_timeout", type=float, default=30.0,
+                   help="Seconds workers get to finish requests on shutdown")
+    p.add_argument("--max_restarts", type=int, default=5,
+                   help=f"Give up after a worker crashed this many times in a row, each within "
+                        f"{_STABLE_S:.0f} s of its start")
+    return p
+
+
+def _pipe_closed(writer: asyncio.StreamWriter) -> None:
+    if not writer.is_closing():
+        writer.close()
+
+
+async def _pipe(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        while True:
+            data = await reader.read(1 << 16)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+        if writer.can_write_eof():
+            writer.write_eof()
+    except (ConnectionError, OSError):
+        pass
+    finally:
+        _pipe_closed(writer)
+
+
+class Dispatcher:
+    """Least-connections TCP proxy from the public port to the workers' Unix sockets."""
+
+    def __init__(self, socket_paths: List[str]) -> None:
+        self.socket_paths = socket_paths
+        self.open = [0] * len(socket_paths)
+        self.alive = [False] * len(socket_paths)
+        self._rr = itertools.count()
+
+    def _candidates(self) -> List[int]:
+        # fewest open connections first; round-robin among ties
+        start = next(self._rr)
+        n = len(self.socket_paths)
+        order = [(start + k) % n for k in range(n)]
+        return sorted((i for i in order if self.alive[i]), key=lambda i: self.open[i])
+
+    async def handle(self, client_reader: asyncio.StreamReader, client_writer: asyncio.StreamWriter) -> None:
+        for i in self._candidates():
+            try:
+                worker_reader, worker_writer = await asyncio.open_unix_connection(self.socket_paths[i])
+            except OSError:
+                continue
+            self.open[i] += 1
+            try:
+                await asyncio.gather(_pipe(client_reader, worker_writer), _pipe(worker_reader, client_writer))
+            finally:
+                self.open[i] -= 1
+            return
+        logger.warning("no worker available; dropping connection")
+        _pipe_closed(client_writer)
+
+
+def _open_fds() -> Set[int]:
+    fd_dir = "/proc/self/fd" if os.path.isdir("/proc/self/fd") else "/dev/fd"
+    return {int(fd) for fd in os.listdir(fd_dir)}
+
+
+def _detach_from_parent_loop(inherited: Set[int]) -> None:
+    """
+    In a worker forked while the supervisor's event loop runs: stop signals from reaching the
+    parent's loop through its wakeup fd, and drop every descriptor the parent opened since
+    `inherited` was taken (epoll, self-pipe, public and proxied sockets). They are pointed at
+    /dev/null rather than closed, so the numbers are not reused while the parent's socket
+    objects still refer to them.
+    """
+    signal.set_wakeup_fd(-1)
+    devnull = os.open(os.devnull, os.O_RDWR)
+    for fd in _open_fds() - inherited - {devnull}:
+        try:
+            os.dup2(devnull, fd)
+        except OSError:
+            pass  # the descriptor listing itself
+    os.close(devnull)
+
+
+def _memory_report(pids: Dict[str, int]) -> None:
+    from API import metrics
+
+    rows = {name: metrics.process_memory(pid) for name, pid in pids.items()}
+    mb = lambda v: round(v / 2 ** 20, 1)  # noqa: E731
+    for name, mem in rows.items():
+        logger.info("memory", extra={"fields": {"process": name, "pid": pids[name],
+                                                **{f"{k}_mb": mb(v) for k, v in mem.items()}}})
+    logger.info("memory total", extra={"fields": {
+        "processes": len(rows),
+        "sum_rss_mb": mb(sum(m.get("rss", 0) for m in rows.values())),
+        "sum_pss_mb": mb(sum(m.get("pss", 0) for m in rows.values())),
+    }})
+
+
+class Supervisor:
+    def __init__(self, args: argparse.Namespace, app, runtime: RuntimeConfig, cpus: List[int]) -> None:
+        self.args = args
+        self.app = app
+        self.runtime = runtime
+        self.cpus = cpus
+        self.socket_dir = args.socket_dir or tempfile.mkdtemp(prefix="detectsegment-serve-")
+        os.makedirs(self.socket_dir, exist_ok=True)
+        self.socket_paths = [os.path.join(self.socket_dir, f"worker-{i}.sock") for i in range(args.workers)]
+        self.pids: List[Optional[int]] = [None] * args.workers
+        self.started = [0.0] * args.workers
+        self.crashes = [0] * args.workers
+        self.dispatcher = Dispatcher(self.socket_paths)
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.stopping = False
+        self.exit_code = 0
+        self._stop: Optional[asyncio.Event] = None
+        self._any_ready: Optional[asyncio.Event] = None
+        self._ready_tasks: Dict[int, asyncio.Future] = {}
+        # descriptors workers keep; the ones opened later belong to the supervisor's loop
+        self._inherited_fds = _open_fds()
+
+    def spawn(self, index: int) -> None:
+        path = self.socket_paths[index]
+        if os.path.exists(path):
+            os.unlink(path)
+        self.dispatcher.alive[index] = False
+        pid = os.fork()
+        if pid:
+            self.pids[index] = pid
+            self.started[index] = time.monotonic()
+            return
+        # --- worker ---
+        try:
+            # replacements are forked from inside the running loop
+            _detach_from_parent_loop(self._inherited_fds)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            gc.enable()
+            self._run_worker(index, path)
+            code = 0
+        except BaseException:
+            logger.exception("worker crashed", extra={"fields": {"worker": index}})
+            code = 1
+        os._exit(code)
+
+    def _run_worker(self, index: int, path: str) -> None:
+        import uvicorn
+
+        if hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, self.cpus)
+        os.environ.update(WORKER_INDEX=str(index), SERVE_PARENT_PID=str(os.getppid()))
+        report = apply_runtime(replace(self.runtime, worker_index=index))
+        logger.info("Runtime: %s", format_runtime(report), extra={"fields": {"worker": index}})
+        config = uvicorn.Config(self.app, uds=path, log_config=None, lifespan="on",
+                                timeout_graceful_shutdown=self.args.graceful_timeout)
+        uvicorn.Server(config).run()
+
+    def request_stop(self, exit_code: int = 0) -> None:
+        self.stopping = True
+        self.exit_code = self.exit_code or exit_code
+        if self._stop is not None:
+            self._stop.set()
+
+    def _watch(self, index: int) -> None:
+        """(Re)start waiting for worker `index` to listen, dropping the wait for its previous process."""
+        stale = self._ready_tasks.pop(index, None)
+        if stale is not None:
+            stale.cancel()
+        self._ready_tasks[index] = asyncio.ensure_future(self._wait_ready(index))
+
+    async def _wait_ready(self, index: int, timeout_s: float = 120.0) -> None:
+        deadline = time.monotonic() + timeout_s
+        while time.monotonic() < deadline and not self.stopping:
+            try:
+                _, writer = await asyncio.open_unix_connection(self.socket_paths[index])
+            except OSError:
+                await asyncio.sleep(0.2)
+                continue
+            writer.close()
+            self.dispatcher.alive[index] = True
+            self._any_ready.set()
+            logger.info("worker ready", extra={"fields": {"worker": index, "pid": self.pids[index]}})
+            return
+        if not self.stopping:
+            logger.error("worker did not start listening", extra={"fields": {"worker": index, "pid": self.pids[index]}})
+
+    def _respawn(self, index: int) -> None:
+        if self.stopping:
+            return
+        self.spawn(index)
+        self._watch(index)
+
+    async def _reap(self) -> None:
+        loop = asyncio.get_running_loop()
+        while not self.stopping:
+            await asyncio.sleep(1.0)
+            for i, pid in enumerate(self.pids):
+                if pid is None:
+                    continue
+                done, status = os.waitpid(pid, os.WNOHANG)
+                if not done or self.stopping:
+                    continue
+                self.pids[i] = None
+                self.dispatcher.alive[i] = False
+                uptime = time.monotonic() - self.started[i]
+                self.crashes[i] = self.crashes[i] + 1 if uptime < _STABLE_S else 1
+                fields = {"worker": i, "pid": pid, "status": os.waitstatus_to_exitcode(status),
+                          "uptime_s": round(uptime, 1), "crashes": self.crashes[i]}
+                if self.crashes[i] > self.args.max_restarts:
+                    logger.critical("worker keeps crashing; stopping", extra={"fields": fields})
+                    self.request_stop(exit_code=1)
+                    return
+                delay = 0.0 if self.crashes[i] == 1 else min(_MAX_BACKOFF_S, 2.0 ** (self.crashes[i] - 2))
+                logger.error("worker exited; restarting", extra={"fields": {**fields, "delay_s": delay}})
+                loop.call_later(delay, self._respawn, i)
+
+    async def _report_memory(self) -> None:
+        while not self.stopping:
+            pids = {"parent": os.getpid(), **{f"worker-{i}": p for i, p in enumerate(self.pids) if p}}
+            _memory_report(pids)
+            if not self.args.memory_report_s:
+                return
+            await asyncio.sleep(self.args.memory_report_s)
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        self._stop, self._any_ready = asyncio.Event(), asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self.request_stop)
+        for i in range(len(self.pids)):
+            self._watch(i)
+        tasks = [asyncio.ensure_future(self._reap())]
+        # serve as soon as one worker listens
+        await asyncio.wait([asyncio.ensure_future(self._any_ready.wait()), asyncio.ensure_future(self._stop.wait())],
+                           return_when=asyncio.FIRST_COMPLETED)
+        if not self.stopping:
+            self.server = await asyncio.start_server(self.dispatcher.handle, self.args.host, self.args.port)
+            logger.info("serving", extra={"fields": {"host": self.args.host, "port": self.args.port,
+                                                     "workers": len(self.pids)}})
+            tasks.append(asyncio.ensure_future(self._report_memory()))
+            await self._stop.wait()
+        for task in tasks + list(self._ready_tasks.values()):
+            task.cancel()
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+    def shutdown(self) -> None:
+        pids = [p for p in self.pids if p]
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + self.args.graceful_timeout + 5
+        for pid in pids:
+            while True:
+                try:
+                    done, _ = os.waitpid(pid, os.WNOHANG)
+                except ChildProcessError:
+                    break
+                if done:
+                    break
+                if time.monotonic() > deadline:
+                    os.kill(pid, signal.SIGKILL)
+                    os.waitpid(pid, 0)
+                    break
+                time.sleep(0.1)
+        if not self.args.socket_dir:
+            shutil.rmtree(self.socket_dir, ignore_errors=True)
+
+
+def main(argv=None) -> None:
+    args = build_parser().parse_args(argv)
+    if args.workers < 1:
+        raise SystemExit("--workers must be >= 1")
+    # Worker runtime (threads / affinity per WORKER_INDEX) is applied after the fork; the
+    # parent imports the app single-threaded and unpinned
+    runtime = replace(RuntimeConfig.from_env(), workers=args.workers)
+    cpus = available_cpus()
+    os.environ.update(TORCH_THREADS="1", OMP_NUM_THREADS="1", MKL_NUM_THREADS="1",
+                      CPU_AFFINITY="", WORKERS="1", WORKER_INDEX="0")
+    gc.disable()
+
+    from API import app as app_module
+
+    preload = [m.strip() for m in args.preload.split(",") if m.strip()]
+    unknown = sorted(set(preload) - set(app_module.registry.names()))
+    if unknown:
+        raise SystemExit(f"Unknown models in --preload: {unknown} (available: {app_module.registry.names()})")
+    if app_module.device.startswith("cuda"):
+        logger.warning("CUDA device: not preloading models; every worker loads its own")
+        preload = []
+    t0 = time.perf_counter()
+    app_module.registry.warmup(preload)
+    status = app_module.registry.status()
+    failed = {name: status[name]["error"] for name in preload if status[name]["state"] != "ready"}
+    if failed:
+        raise SystemExit(f"Preloading failed: {failed}")
+    logger.info("models preloaded", extra={"fields": {"models": preload, "seconds": round(time.perf_counter() - t0, 1)}})
+
+    # Keep the preloaded objects out of the collector, so workers' GC passes do not write to
+    # (and un-share) their pages
+    gc.collect()
+    gc.freeze()
+
+    supervisor = Supervisor(args, app_module.app, runtime, cpus)
+    for i in range(args.workers):
+        supervisor.spawn(i)
+    try:
+        asyncio.run(supervisor.run())
+    finally:
+        supervisor.shutdown()
+    if supervisor.exit_code:
+        raise SystemExit(supervisor.exit_code)
+
+
+if __name__ == "__main__":
+    main()
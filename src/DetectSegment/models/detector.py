@@ -1,13 +1,45 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
+from collections import OrderedDict
+import threading
 
+import numpy as np
 import torch
-from transformers import pipeline
+from PIL import Image
+from transformers import AutoModelForZeroShotObjectDetection, AutoProcessor
+from transformers.image_transforms import center_to_corners_format
+from transformers.image_utils import load_image
+
+from ..utils.device_utils import get_default_device, prepare_module
+from ..utils.precision import autocast, prepare_model, resolve_precision
+
+# Score floor of the transformers zero-shot-object-detection pipeline, kept so that
+# results match the previous pipeline-based implementation
+_PIPELINE_THRESHOLD = 0.1
+
+
+def detection_head(model: Any, pixel_values: torch.Tensor, query_embeds: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    OWL-ViT image tower and class / box heads for (Q, D) normalized query embeddings:
+    (B, P, Q) class logits and (B, P, 4) boxes (cx, cy, w, h, relative) per image patch.
+    """
+    feature_map, _ = model.image_embedder(pixel_values=pixel_values)
+    b, h, w, d = feature_map.shape
+    image_feats = feature_map.reshape(b, h * w, d)
+    queries = query_embeds[None].expand(b, -1, -1)
+    logits, _ = model.class_predictor(image_feats, queries, None)
+    return logits, model.box_predictor(image_feats, feature_map)
 
 
 class ZeroShotDetector:
     """
     Zero-shot object detector using OWL-ViT via Hugging Face transformers.
     Accepts a list of candidate classes and returns bounding boxes and scores.
+
+    Text query embeddings are cached per label (LRU, `max_cached_labels`), so a stable
+    class vocabulary is encoded once; images go through the vision tower `batch_size`
+    at a time and are scored against all labels in one pass.
+    `precision` is "fp32" (default), "bf16" (autocast) or "int8" (dynamic quantization,
+    CPU only); see utils.precision.
     """
 
     def __init__(
@@ -15,21 +47,126 @@ class ZeroShotDetector:
         model_name: str = "google/owlvit-base-patch32",
         device: Optional[str] = None,
         confidence_threshold: float = 0.2,
+        batch_size: int = 8,
+        max_cached_labels: int = 1024,
+        precision: Optional[str] = None,
     ) -> None:
         if device is None:
-            device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.device = 0 if device == "cuda" else -1
+            device = get_default_device()
+        self.device = device
+        self.precision = resolve_precision(precision, device)
         self.confidence_threshold = confidence_threshold
-        self.detector = pipeline(
-            task="zero-shot-object-detection",
-            model=model_name,
-            device=self.device,
-        )
+        self.batch_size = max(1, int(batch_size))
+        self.max_cached_labels = max(1, int(max_cached_labels))
+        self.processor = AutoProcessor.from_pretrained(model_name)
+        self.model = self._load_model(model_name)
+        self._text_cache: "OrderedDict[str, torch.Tensor]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.text_hits = 0
+        self.text_misses = 0
+
+    def _load_model(self, model_name: str) -> Any:
+        model = AutoModelForZeroShotObjectDetection.from_pretrained(model_name).to(self.device).eval()
+        return prepare_module(prepare_model(model, self.precision), self.device)
+
+    def _text_features(self, text_inputs: Dict[str, torch.Tensor]) -> torch.Tensor:
+        """(1, D) pooled text embedding of one tokenized label."""
+        with torch.no_grad(), autocast(self.precision, self.device):
+            # OwlViTModel / Owlv2Model behind the detection head
+            backbone = getattr(self.model, self.model.base_model_prefix)
+            return backbone.get_text_features(**text_inputs).pooler_output
+
+    def _encode_label(self, label: str) -> torch.Tensor:
+        # One label per tokenizer call (no padding), as the pipeline did
+        text_inputs = self.processor.tokenizer(label, return_tensors="pt").to(self.device)
+        embeds = self._text_features(text_inputs)[0].float()
+        return embeds / torch.linalg.norm(embeds, ord=2, dim=-1, keepdim=True)
+
+    def text_embeddings(self, classes: List[str]) -> torch.Tensor:
+        """(len(classes), D) normalized query embeddings, encoding only labels not seen before."""
+        rows = []
+        with self._lock:
+            for label in classes:
+                embeds = self._text_cache.get(label)
+                if embeds is None:
+                    self.text_misses += 1
+                    embeds = self._encode_label(label)
+                    self._text_cache[label] = embeds
+                    while len(self._text_cache) > self.max_cached_labels:
+                        self._text_cache.popitem(last=False)
+                else:
+                    self.text_hits += 1
+                    self._text_cache.move_to_end(label)
+                rows.append(embeds)
+        return torch.stack(rows)
+
+    def cache_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.text_hits + self.text_misses
+            return {
+                "labels": len(self._text_cache),
+                "max_labels": self.max_cached_labels,
+                "hits": self.text_hits,
+                "misses": self.text_misses,
+                "hit_rate": self.text_hits / lookups if lookups else 0.0,
+            }
+
+    @staticmethod
+    def _to_pil(image: Any) -> Image.Image:
+        if isinstance(image, np.ndarray):
+            return Image.fromarray(image).convert("RGB")
+        return load_image(image)
+
+    def _forward(self, pixel_values: torch.Tensor, query_embeds: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        pixel_values = pixel_values.to(self.device, dtype=self.model.dtype)
+        with torch.no_grad(), autocast(self.precision, self.device):
+            return detection_head(self.model, pixel_values, query_embeds)
+
+    def _detect(self, images: List[Image.Image], classes: List[str], query_embeds: torch.Tensor) -> List[List[Dict[str, Any]]]:
+        pixel_values = self.processor.image_processor(images, return_tensors="pt")["pixel_values"]
+        logits, pred_boxes = self._forward(pixel_values, query_embeds)
+
+        # Per label, as if each label had been queried on its own: (B, P, Q) scores
+        scores = torch.sigmoid(logits.float()).cpu()
+        corners = center_to_corners_format(pred_boxes.float().cpu())
+        results = []
+        for i, image in enumerate(images):
+            scale = torch.tensor([image.width, image.height, image.width, image.height], dtype=torch.float32)
+            boxes = (corners[i] * scale).int()
+            dets = []
+            for q, label in enumerate(classes):
+                s = scores[i, :, q]
+                keep = ((s > _PIPELINE_THRESHOLD) & (s >= self.confidence_threshold)).nonzero()[:, 0]
+                for p in keep.tolist():
+                    xmin, ymin, xmax, ymax = boxes[p].tolist()
+                    dets.append({
+                        "score": s[p].item(),
+                        "label": label,
+                        "box": {"xmin": xmin, "ymin": ymin, "xmax": xmax, "ymax": ymax},
+                    })
+            dets.sort(key=lambda x: x["score"], reverse=True)
+            results.append(dets)
+        return results
+
+    def predict_batch(self, images: List[Any], classes: List[str]) -> List[List[Dict[str, Any]]]:
+        """
+        `predict` for several images (or tiles) at once; returns one detection list per image.
+        """
+        if not images:
+            return []
+        if not classes:
+            return [[] for _ in images]
+        query_embeds = self.text_embeddings(classes)
+        results: List[List[Dict[str, Any]]] = []
+        for start in range(0, len(images), self.batch_size):
+            chunk = [self._to_pil(img) for img in images[start:start + self.batch_size]]
+            results.extend(self._detect(chunk, classes, query_embeds))
+        return results
 
     def predict(self, image: Any, classes: List[str]) -> List[Dict[str, Any]]:
         """
         Args:
-            image: PIL.Image, numpy array, or path accepted by transformers pipeline
+            image: PIL.Image, numpy array, or path/URL
             classes: list of labels to search for
         Returns:
             List of dicts: {
@@ -38,7 +175,4 @@ class ZeroShotDetector:
               'box': {'xmin': int, 'ymin': int, 'xmax': int, 'ymax': int}
             }
         """
-        outputs = self.detector(image, candidate_labels=classes)
-        # Filter by threshold
-        results = [o for o in outputs if o.get("score", 0.0) >= self.confidence_threshold]
-        return results
+        return self.predict_batch([image], classes)[0]
@@ -0,0 +1,288 @@
+"""
+ONNX export of OWL-ViT and of the SAM v1 image encoder / box-prompted mask decoder, and
+ONNX Runtime (CPU) drop-ins for ZeroShotDetector and SAMSegmenter.
+
+An export directory holds:
+
+- detector_text.onnx: input_ids, attention_mask -> text_embeds (pooled, not normalized)
+- detector_image.onnx: pixel_values, query_embeds -> logits, pred_boxes (see detector.detection_head)
+- the detector's processor files (tokenizer, image processor)
+- sam_<type>_encoder.onnx: resized image (1, 3, h, w), longest side 1024 -> image_embeddings
+- sam_<type>_decoder.onnx: image_embeddings, boxes (N, 4) in the resized frame -> low_res_masks (N, 1, 256, 256)
+
+Export needs the `onnx` package, inference `onnxruntime`.
+"""
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import torch
+from torch import nn
+from torch.nn import functional as F
+from transformers import AutoModelForZeroShotObjectDetection, AutoProcessor
+
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
+try:
+    # SAM v1
+    from segment_anything import sam_model_registry
+    from segment_anything.utils.transforms import ResizeLongestSide
+except Exception:
+    sam_model_registry = None
+    ResizeLongestSide = None
+
+from .detector import ZeroShotDetector, detection_head
+from .sam_segmenter import SAMSegmenter
+from ..utils.device_utils import runtime_threads
+from ..utils.embedding_cache import EmbeddingCache
+
+DEFAULT_OPSET = 17
+DETECTOR_TEXT = "detector_text.onnx"
+DETECTOR_IMAGE = "detector_image.onnx"
+SAM_IMAGE_SIZE = 1024
+
+
+def sam_encoder_file(model_type: str) -> str:
+    return f"sam_{model_type}_encoder.onnx"
+
+
+def sam_decoder_file(model_type: str) -> str:
+    return f"sam_{model_type}_decoder.onnx"
+
+
+def make_session(path: str, num_threads: Optional[int] = None) -> Any:
+    """
+    CPU InferenceSession with all graph optimizations; `num_threads` intra-op threads
+    (None: the applied device_utils runtime config, else the ONNX Runtime default of one per physical core).
+    """
+    if ort is None:
+        raise RuntimeError("onnxruntime is not installed. Please install it to use the ONNX runtime.")
+    num_threads = num_threads or runtime_threads()
+    opts = ort.SessionOptions()
+    opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    opts.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    if num_threads:
+        opts.intra_op_num_threads = int(num_threads)
+    opts.inter_op_num_threads = 1
+    return ort.InferenceSession(str(path), opts, providers=["CPUExecutionProvider"])
+
+
+# --- export -----------------------------------------------------------------------------------
+
+class _TextEncoder(nn.Module):
+    def __init__(self, model: nn.Module) -> None:
+        super().__init__()
+        self.backbone = getattr(model, model.base_model_prefix)
+
+    def forward(self, input_ids: torch.Tensor, attention_mask: torch.Tensor) -> torch.Tensor:
+        return self.backbone.get_text_features(input_ids=input_ids, attention_mask=attention_mask).pooler_output
+
+
+class _DetectionHead(nn.Module):
+    def __init__(self, model: nn.Module) -> None:
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values: torch.Tensor, query_embeds: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        return detection_head(self.model, pixel_values, query_embeds)
+
+
+class _SamEncoder(nn.Module):
+    def __init__(self, sam: nn.Module) -> None:
+        super().__init__()
+        self.sam = sam
+
+    def forward(self, image: torch.Tensor) -> torch.Tensor:
+        # normalization and zero padding to 1024x1024, as Sam.preprocess
+        return self.sam.image_encoder(self.sam.preprocess(image))
+
+
+class _SamBoxDecoder(nn.Module):
+    def __init__(self, sam: nn.Module) -> None:
+        super().__init__()
+        self.sam = sam
+        self.register_buffer("image_pe", sam.prompt_encoder.get_dense_pe())
+
+    def forward(self, image_embeddings: torch.Tensor, boxes: torch.Tensor) -> torch.Tensor:
+        sparse, dense = self.sam.prompt_encoder(points=None, boxes=boxes, masks=None)
+        low_res_masks, _ = self.sam.mask_decoder(
+            image_embeddings=image_embeddings,
+            image_pe=self.image_pe,
+            sparse_prompt_embeddings=sparse,
+            dense_prompt_embeddings=dense,
+            multimask_output=False,
+        )
+        return low_res_masks
+
+
+def _export(module: nn.Module, args: Tuple[torch.Tensor, ...], path: Path, input_names: List[str],
+            output_names: List[str], dynamic_axes: Dict[str, Dict[int, str]], opset: int) -> str:
+    with torch.no_grad():
+        torch.onnx.export(
+            module.eval(), args, str(path),
+            input_names=input_names, output_names=output_names, dynamic_axes=dynamic_axes,
+            opset_version=opset, do_constant_folding=True, dynamo=False,
+        )
+    return str(path)
+
+
+def export_detector(model_name: str, out_dir: str, opset: int = DEFAULT_OPSET) -> List[str]:
+    """Write the OWL-ViT text and image graphs plus the processor to `out_dir`; returns the graph paths."""
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    processor = AutoProcessor.from_pretrained(model_name)
+    model = AutoModelForZeroShotObjectDetection.from_pretrained(model_name).eval()
+    processor.save_pretrained(str(out))
+
+    text = processor.tokenizer("a photo", return_tensors="pt")
+    text_path = _export(
+        _TextEncoder(model), (text["input_ids"], text["attention_mask"]), out / DETECTOR_TEXT,
+        ["input_ids", "attention_mask"], ["text_embeds"],
+        {"input_ids": {1: "tokens"}, "attention_mask": {1: "tokens"}}, opset,
+    )
+    from PIL import Image
+    pixel_values = processor.image_processor(Image.new("RGB", (64, 64)), return_tensors="pt")["pixel_values"]
+    queries = torch.randn(2, model.config.projection_dim)
+    image_path = _export(
+        _DetectionHead(model), (pixel_values, queries), out / DETECTOR_IMAGE,
+        ["pixel_values", "query_embeds"], ["logits", "pred_boxes"],
+        {"pixel_values": {0: "batch"}, "query_embeds": {0: "queries"},
+         "logits": {0: "batch", 2: "queries"}, "pred_boxes": {0: "batch"}}, opset,
+    )
+    return [text_path, image_path]
+
+
+def export_sam(sam: Any, model_type: str, out_dir: str, opset: int = DEFAULT_OPSET) -> List[str]:
+    """Write the encoder / box decoder graphs of a loaded SAM v1 model (`sam_model_registry[...]`)."""
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    sam = sam.cpu().eval()
+    encoder_path = _export(
+        _SamEncoder(sam), (torch.rand(1, 3, SAM_IMAGE_SIZE, 768) * 255,), out / sam_encoder_file(model_type),
+        ["image"], ["image_embeddings"], {"image": {2: "height", 3: "width"}}, opset,
+    )
+    embed_dim = sam.prompt_encoder.embed_dim
+    h, w = sam.prompt_encoder.image_embedding_size
+    boxes = torch.tensor([[10.0, 20.0, 300.0, 400.0], [0.0, 0.0, 1000.0, 700.0]])
+    decoder_path = _export(
+        _SamBoxDecoder(sam), (torch.randn(1, embed_dim, h, w), boxes), out / sam_decoder_file(model_type),
+        ["image_embeddings", "boxes"], ["low_res_masks"],
+        {"boxes": {0: "boxes"}, "low_res_masks": {0: "boxes"}}, opset,
+    )
+    return [encoder_path, decoder_path]
+
+
+def export_sam_checkpoint(sam_checkpoint: str, model_type: str, out_dir: str, opset: int = DEFAULT_OPSET) -> List[str]:
+    if sam_model_registry is None:
+        raise RuntimeError("segment_anything is not installed. Please install the SAM package.")
+    return export_sam(sam_model_registry[model_type](checkpoint=sam_checkpoint), model_type, out_dir, opset)
+
+
+# --- inference --------------------------------------------------------------------------------
+
+class OrtZeroShotDetector(ZeroShotDetector):
+    """
+    ZeroShotDetector running the graphs of `export_detector` with ONNX Runtime on CPU.
+    Pre/post-processing, label embedding cache and batching are shared with the torch version.
+    """
+
+    def __init__(
+        self,
+        onnx_dir: str,
+        confidence_threshold: float = 0.2,
+        batch_size: int = 8,
+        max_cached_labels: int = 1024,
+        num_threads: Optional[int] = None,
+    ) -> None:
+        self.onnx_dir = Path(onnx_dir)
+        self.num_threads = num_threads
+        super().__init__(
+            model_name=str(onnx_dir),
+            device="cpu",
+            confidence_threshold=confidence_threshold,
+            batch_size=batch_size,
+            max_cached_labels=max_cached_labels,
+        )
+
+    def _load_model(self, model_name: str) -> Any:
+        self.text_session = make_session(self.onnx_dir / DETECTOR_TEXT, self.num_threads)
+        self.image_session = make_session(self.onnx_dir / DETECTOR_IMAGE, self.num_threads)
+        return None
+
+    def _text_features(self, text_inputs: Dict[str, torch.Tensor]) -> torch.Tensor:
+        (embeds,) = self.text_session.run(None, {
+            "input_ids": text_inputs["input_ids"].numpy().astype(np.int64),
+            "attention_mask": text_inputs["attention_mask"].numpy().astype(np.int64),
+        })
+        return torch.from_numpy(embeds)
+
+    def _forward(self, pixel_values: torch.Tensor, query_embeds: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        logits, pred_boxes = self.image_session.run(None, {
+            "pixel_values": pixel_values.numpy().astype(np.float32),
+            "query_embeds": query_embeds.numpy().astype(np.float32),
+        })
+        return torch.from_numpy(logits), torch.from_numpy(pred_boxes)
+
+
+class OrtSAMSegmenter(SAMSegmenter):
+    """
+    SAMSegmenter running the graphs of `export_sam` with ONNX Runtime on CPU; no torch
+    checkpoint is loaded. Embeddings share the embedding cache keys of the fp32 torch model.
+    """
+
+    def __init__(
+        self,
+        onnx_dir: str,
+        model_type: str = "vit_h",
+        embedding_cache: Optional[EmbeddingCache] = None,
+        box_batch_size: Optional[int] = None,
+        num_threads: Optional[int] = None,
+    ) -> None:
+        if ResizeLongestSide is None:
+            raise RuntimeError(
+                "segment_anything is not installed. Please install the SAM package."
+            )
+        self.device = "cpu"
+        self.precision = "fp32"
+        self.model_type = model_type
+        self.embedding_cache = embedding_cache
+        self.box_batch_size = max(1, int(box_batch_size or 4))
+        self.transform = ResizeLongestSide(SAM_IMAGE_SIZE)
+        onnx_dir = Path(onnx_dir)
+        self.encoder_session = make_session(onnx_dir / sam_encoder_file(model_type), num_threads)
+        self.decoder_session = make_session(onnx_dir / sam_decoder_file(model_type), num_threads)
+        self._entry: Optional[Dict[str, Any]] = None
+
+    def _encode(self, image_np: np.ndarray) -> Dict[str, Any]:
+        resized = self.transform.apply_image(image_np)
+        image = np.ascontiguousarray(resized.transpose(2, 0, 1)[None], dtype=np.float32)
+        (embeddings,) = self.encoder_session.run(None, {"image": image})
+        return {
+            "features": torch.from_numpy(embeddings),
+            "original_size": tuple(image_np.shape[:2]),
+            "input_size": tuple(resized.shape[:2]),
+        }
+
+    def _set_features(self, entry: Dict[str, Any]) -> None:
+        self._entry = entry
+
+    def _predict_boxes(self, boxes: np.ndarray) -> Iterator[np.ndarray]:
+        if self._entry is None:
+            raise RuntimeError("An image must be set with .set_image(...) before mask prediction.")
+        features = self._entry["features"].cpu().numpy()
+        original_size, input_size = self._entry["original_size"], self._entry["input_size"]
+        for start in range(0, len(boxes), self.box_batch_size):
+            chunk = self.transform.apply_boxes(boxes[start:start + self.box_batch_size], original_size)
+            (low_res_masks,) = self.decoder_session.run(None, {
+                "image_embeddings": features,
+                "boxes": chunk.astype(np.float32),
+            })
+            for low_res in torch.from_numpy(low_res_masks):
+                # Sam.postprocess_masks: upscale to the padded input, crop the padding, resize to the image
+                mask = F.interpolate(low_res[None], (SAM_IMAGE_SIZE, SAM_IMAGE_SIZE), mode="bilinear", align_corners=False)
+                mask = mask[..., :input_size[0], :input_size[1]]
+                mask = F.interpolate(mask, original_size, mode="bilinear", align_corners=False)
+                yield (mask[0, 0] > 0.0).numpy()
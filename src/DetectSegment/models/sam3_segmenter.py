@@ -0,0 +1,281 @@
+from typing import List, Dict, Any, Iterator, Optional, Tuple
+
+import numpy as np
+import torch
+from PIL import Image
+from transformers import Sam3Processor, Sam3Model
+from transformers.models.sam3.modeling_sam3 import Sam3VisionEncoderOutput
+
+from ..utils.embedding_cache import EmbeddingCache
+from ..utils.device_utils import get_default_device, prepare_module
+from ..utils.precision import autocast, prepare_model, resolve_precision
+from ..utils.tiling import InstanceMerger, iter_tiles, paste_mask
+
+
+class Sam3Segmenter:
+    """
+    SAM3 text-prompted segmenter.
+    Encodes an image once and reuses the vision embeddings for every class prompt,
+    so only the text encoder and the DETR/mask decoders run per class.
+    Class prompts can be batched: `batch_size` prompts share one decoder forward pass.
+    With an `embedding_cache`, embeddings are reused across calls for the same image content.
+    `precision` is "fp32" (default), "bf16" (autocast) or "int8" (dynamic quantization,
+    CPU only); see utils.precision.
+    """
+
+    def __init__(
+        self,
+        model_name: str = "facebook/sam3",
+        device: Optional[str] = None,
+        batch_size: int = 1,
+        embedding_cache: Optional[EmbeddingCache] = None,
+        precision: Optional[str] = None,
+    ) -> None:
+        if device is None:
+            device = get_default_device()
+        self.device = device
+        self.precision = resolve_precision(precision, device)
+        self.model_name = model_name
+        self.batch_size = max(1, int(batch_size))
+        self.embedding_cache = embedding_cache
+        self.model = Sam3Model.from_pretrained(model_name).to(device)
+        self.processor = Sam3Processor.from_pretrained(model_name)
+        self.model.eval()
+        self.model = prepare_module(prepare_model(self.model, self.precision), device)
+
+    def encode_image(self, image: Image.Image, cache_key: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Run the vision backbone once.
+        `cache_key` (e.g. a hash of the image bytes) enables the embedding cache.
+        Returns:
+            {'vision_embeds': Sam3VisionEncoderOutput, 'original_sizes': [[H, W]]}
+        """
+        return self.encode_images([image], [cache_key])[0]
+
+    def encode_images(
+        self,
+        images: List[Image.Image],
+        cache_keys: Optional[List[Optional[str]]] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Batched `encode_image`: images missing from the cache go through the
+        vision backbone together in one forward pass.
+        Returns one embeddings dict per image, in input order.
+        """
+        if cache_keys is None:
+            cache_keys = [None] * len(images)
+        keys = [f"sam3:{self.model_name}:{self.precision}:{k}" if k else None for k in cache_keys]
+        out: List[Optional[Dict[str, Any]]] = [None] * len(images)
+
+        if self.embedding_cache is not None:
+            for i, key in enumerate(keys):
+                cached = self.embedding_cache.get(key) if key else None
+                if cached is not None:
+                    out[i] = {
+                        "vision_embeds": self._move_vision_embeds(cached["vision_embeds"], self.device),
+                        "original_sizes": cached["original_sizes"],
+                    }
+
+        todo = [i for i, e in enumerate(out) if e is None]
+        if todo:
+            inputs = self.processor(images=[images[i] for i in todo], return_tensors="pt").to(self.device)
+            with torch.no_grad(), autocast(self.precision, self.device):
+                vision_embeds = self.model.get_vision_features(pixel_values=inputs["pixel_values"])
+            original_sizes = inputs["original_sizes"].tolist()
+
+            def take(t, b):
+                # Own the storage when batched, so cached entries don't pin the whole batch
+                return t if len(todo) == 1 else t[b:b + 1].clone()
+
+            for b, i in enumerate(todo):
+                # Only the FPN levels are consumed by the decoder; drop the backbone output
+                out[i] = {
+                    "vision_embeds": Sam3VisionEncoderOutput(
+                        fpn_hidden_states=tuple(take(t, b) for t in vision_embeds.fpn_hidden_states),
+                        fpn_position_encoding=tuple(take(t, b) for t in vision_embeds.fpn_position_encoding),
+                    ),
+                    "original_sizes": [original_sizes[b]],
+                }
+                if keys[i] and self.embedding_cache is not None:
+                    self.embedding_cache.put(keys[i], out[i])
+        return out
+
+    @staticmethod
+    def _move_vision_embeds(vision_embeds: Sam3VisionEncoderOutput, device: str) -> Sam3VisionEncoderOutput:
+        return Sam3VisionEncoderOutput(
+            fpn_hidden_states=tuple(t.to(device) for t in vision_embeds.fpn_hidden_states),
+            fpn_position_encoding=tuple(t.to(device) for t in vision_embeds.fpn_position_encoding),
+        )
+
+    @staticmethod
+    def _expand_vision_embeds(vision_embeds: Sam3VisionEncoderOutput, n: int) -> Sam3VisionEncoderOutput:
+        """Broadcast single-image embeddings to a batch of `n` prompts (views, no copy)."""
+        if n == 1:
+            return vision_embeds
+
+        def expand(t):
+            return None if t is None else t.expand(n, *t.shape[1:])
+
+        return Sam3VisionEncoderOutput(
+            last_hidden_state=expand(vision_embeds.last_hidden_state),
+            fpn_hidden_states=tuple(expand(t) for t in vision_embeds.fpn_hidden_states),
+            fpn_position_encoding=tuple(expand(t) for t in vision_embeds.fpn_position_encoding),
+        )
+
+    def _predict_prompts(
+        self,
+        image_embeds: Dict[str, Any],
+        class_names: List[str],
+        score_threshold: float,
+        mask_threshold: float,
+    ) -> List[Dict[str, Any]]:
+        """One decoder forward pass and one post-processing call for a batch of prompts."""
+        n = len(class_names)
+        text_inputs = self.processor(text=class_names, return_tensors="pt").to(self.device)
+        with torch.no_grad(), autocast(self.precision, self.device):
+            outputs = self.model(
+                vision_embeds=self._expand_vision_embeds(image_embeds["vision_embeds"], n),
+                input_ids=text_inputs["input_ids"],
+                attention_mask=text_inputs["attention_mask"],
+            )
+        if self.precision == "bf16":
+            # upsample / threshold in float32 and hand back float32 scores (bfloat16 has no numpy interop)
+            for k, v in outputs.items():
+                if isinstance(v, torch.Tensor) and v.dtype == torch.bfloat16:
+                    outputs[k] = v.float()
+
+        return self.processor.post_process_instance_segmentation(
+            outputs,
+            threshold=score_threshold,
+            mask_threshold=mask_threshold,
+            target_sizes=image_embeds["original_sizes"] * n,
+        )
+
+    def predict_for_class(
+        self,
+        image: Image.Image,
+        class_name: str,
+        score_threshold: float = 0.60,
+        mask_threshold: float = 0.5,
+        image_embeds: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Run SAM3 for a single text prompt and return post-processed results.
+        Pass `image_embeds` from `encode_image` to skip the vision backbone.
+        """
+        if image_embeds is None:
+            image_embeds = self.encode_image(image)
+        return self._predict_prompts(image_embeds, [class_name], score_threshold, mask_threshold)[0]
+
+    def iter_predict_for_classes(
+        self,
+        image: Image.Image,
+        class_names: List[str],
+        score_threshold: float = 0.60,
+        mask_threshold: float = 0.5,
+        batch_size: Optional[int] = None,
+        image_embeds: Optional[Dict[str, Any]] = None,
+        cache_key: Optional[str] = None,
+    ) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Generator form of `predict_for_classes`: yields (class_name, result) as soon as
+        each batch of prompts is decoded, so callers can stream partial results.
+        """
+        if not class_names:
+            return
+        if image_embeds is None:
+            image_embeds = self.encode_image(image, cache_key=cache_key)
+        batch_size = max(1, int(batch_size or self.batch_size))
+        for start in range(0, len(class_names), batch_size):
+            chunk = class_names[start:start + batch_size]
+            results = self._predict_prompts(image_embeds, chunk, score_threshold, mask_threshold)
+            yield from zip(chunk, results)
+
+    def predict_for_classes(
+        self,
+        image: Image.Image,
+        class_names: List[str],
+        score_threshold: float = 0.60,
+        mask_threshold: float = 0.5,
+        batch_size: Optional[int] = None,
+        image_embeds: Optional[Dict[str, Any]] = None,
+        cache_key: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Segment every class prompt against one image, encoding the image once.
+        Prompts are decoded in chunks of `batch_size` (defaults to `self.batch_size`),
+        which bounds how many full-resolution mask sets are alive at once.
+        Returns one post-processed result dict per class, in `class_names` order.
+        """
+        return [
+            res for _, res in self.iter_predict_for_classes(
+                image,
+                class_names,
+                score_threshold=score_threshold,
+                mask_threshold=mask_threshold,
+                batch_size=batch_size,
+                image_embeds=image_embeds,
+                cache_key=cache_key,
+            )
+        ]
+
+    def predict_for_classes_tiled(
+        self,
+        image: Image.Image,
+        class_names: List[str],
+        tile_size: int = 1008,
+        overlap: int = 128,
+        score_threshold: float = 0.60,
+        mask_threshold: float = 0.5,
+        batch_size: Optional[int] = None,
+        merge_threshold: float = 0.5,
+        cache_key: Optional[str] = None,
+        paste_masks: bool = True,
+    ) -> List[Dict[str, Any]]:
+        """
+        Sliding-window variant of `predict_for_classes` for large orthophotos.
+        Each tile is segmented at (close to) native resolution, one tile at a time;
+        instances crossing tile borders are merged into whole-image instances.
+        Returns the same per-class dicts as `predict_for_classes`
+        ('scores', 'boxes' in xyxy, 'masks' as bool [N, H, W] at full image size).
+        `image` may be an io_utils.ImageReader. With `paste_masks=False` the full-size masks
+        (N * H * W bytes) are not built; 'instances' holds the cropped tiling instances
+        and 'size' the image (width, height) instead.
+        """
+        mergers = {name: InstanceMerger(merge_threshold) for name in class_names}
+        for box, tile in iter_tiles(image, tile_size, overlap):
+            x0, y0 = box[0], box[1]
+            tile_results = self.predict_for_classes(
+                tile,
+                class_names,
+                score_threshold=score_threshold,
+                mask_threshold=mask_threshold,
+                batch_size=batch_size,
+                cache_key=f"{cache_key}:tile{box}" if cache_key else None,
+            )
+            for name, res in zip(class_names, tile_results):
+                masks = res["masks"].bool().cpu().numpy()
+                scores = res["scores"].tolist()
+                for mask, score in zip(masks, scores):
+                    mergers[name].add(mask, name, score, (x0, y0))
+
+        width, height = image.size
+        results = []
+        for name in class_names:
+            instances = mergers[name].merge()
+            scores = torch.tensor([i["score"] for i in instances], dtype=torch.float32)
+            boxes = torch.tensor([list(i["box"]) for i in instances], dtype=torch.float32).reshape(-1, 4)
+            if not paste_masks:
+                results.append({"scores": scores, "boxes": boxes, "instances": instances, "size": (width, height)})
+                continue
+            if instances:
+                masks = torch.from_numpy(np.stack([paste_mask(i, width, height) for i in instances]))
+            else:
+                masks = torch.zeros((0, height, width), dtype=torch.bool)
+            results.append({"scores": scores, "boxes": boxes, "masks": masks})
+        return results
+
+    def warmup(self, size: int = 256, class_name: str = "object") -> None:
+        """One dummy encode + decode pass so kernels and allocator pools are primed before real traffic."""
+        image = Image.new("RGB", (size, size))
+        self.predict_for_class(image, class_name)
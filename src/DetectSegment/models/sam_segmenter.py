@@ -1,4 +1,4 @@
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Iterator, Tuple, Optional
 
 import torch
 import numpy as np
@@ -11,11 +11,20 @@ except Exception:
     sam_model_registry = None
     SamPredictor = None
 
+from ..utils.embedding_cache import EmbeddingCache
+from ..utils.device_utils import get_default_device, prepare_module
+from ..utils.precision import autocast, prepare_model, resolve_precision
+
 
 class SAMSegmenter:
     """
     Segment Anything (SAM) segmenter.
     Uses detected boxes (x1,y1,x2,y2) as prompts to generate masks.
+    Boxes go through the prompt encoder and mask decoder together, `box_batch_size` at a time
+    (default 64 on CUDA; 4 on CPU, where the decoder is compute-bound and large chunks only add cache misses).
+    With an `embedding_cache`, image embeddings are reused for the same image content.
+    `precision` is "fp32" (default), "bf16" (autocast) or "int8" (dynamic quantization,
+    CPU only); see utils.precision.
     """
 
     def __init__(
@@ -23,50 +32,126 @@ class SAMSegmenter:
         sam_checkpoint: str,
         model_type: str = "vit_h",
         device: str = None,
+        embedding_cache: Optional[EmbeddingCache] = None,
+        box_batch_size: Optional[int] = None,
+        precision: Optional[str] = None,
     ) -> None:
         if device is None:
-            device = "cuda" if torch.cuda.is_available() else "cpu"
+            device = get_default_device()
         if sam_model_registry is None:
             raise RuntimeError(
                 "segment_anything is not installed. Please install the SAM package."
             )
         self.device = device
+        self.precision = resolve_precision(precision, device)
+        self.model_type = model_type
+        self.embedding_cache = embedding_cache
+        if box_batch_size is None:
+            box_batch_size = 64 if str(device).startswith("cuda") else 4
+        self.box_batch_size = max(1, int(box_batch_size))
         self.sam = sam_model_registry[model_type](checkpoint=sam_checkpoint)
         self.sam.to(device)
+        self.sam.eval()
+        self.sam = prepare_module(prepare_model(self.sam, self.precision), device)
         self.predictor = SamPredictor(self.sam)
 
+    def set_image(self, image_np: np.ndarray, cache_key: Optional[str] = None) -> None:
+        """
+        `SamPredictor.set_image`, restoring the image embedding from the cache when
+        `cache_key` (e.g. a hash of the image bytes) was seen before.
+        """
+        key = f"sam_{self.model_type}:{self.precision}:{cache_key}" if cache_key else None
+        if key and self.embedding_cache is not None:
+            cached = self.embedding_cache.get(key)
+            if cached is not None:
+                self._set_features(cached)
+                return
+
+        entry = self._encode(image_np)
+        self._set_features(entry)
+        if key and self.embedding_cache is not None:
+            self.embedding_cache.put(key, entry)
+
+    def _encode(self, image_np: np.ndarray) -> Dict[str, Any]:
+        """Image embedding as {"features", "original_size", "input_size"} (the embedding cache entry)."""
+        with autocast(self.precision, self.device):
+            self.predictor.set_image(image_np)
+        return {
+            "features": self.predictor.features,
+            "original_size": tuple(self.predictor.original_size),
+            "input_size": tuple(self.predictor.input_size),
+        }
+
+    def _set_features(self, entry: Dict[str, Any]) -> None:
+        if entry["features"] is self.predictor.features:
+            return
+        self.predictor.reset_image()
+        self.predictor.features = entry["features"].to(self.device)
+        self.predictor.original_size = tuple(entry["original_size"])
+        self.predictor.input_size = tuple(entry["input_size"])
+        self.predictor.is_image_set = True
+
     @staticmethod
     def _box_to_np(box: Dict[str, int]) -> np.ndarray:
         return np.array([box["xmin"], box["ymin"], box["xmax"], box["ymax"]])
 
+    def _predict_boxes(self, boxes: np.ndarray) -> Iterator[np.ndarray]:
+        """
+        Batched `predictor.predict(box=b, multimask_output=False)` for an (N, 4) array of
+        xyxy boxes in original image pixels; yields one (H, W) boolean mask per box.
+        Decoder outputs stay at 256x256 per chunk and are upscaled one mask at a time,
+        so at most one full-resolution float mask is alive; a chunk's boolean masks are
+        yielded once the chunk is done.
+        """
+        predictor = self.predictor
+        if not predictor.is_image_set:
+            raise RuntimeError("An image must be set with .set_image(...) before mask prediction.")
+        image_pe = self.sam.prompt_encoder.get_dense_pe()
+        for start in range(0, len(boxes), self.box_batch_size):
+            # same numpy transform as SamPredictor.predict; batched matmuls may still flip
+            # the odd pixel sitting exactly on the mask threshold
+            chunk = predictor.transform.apply_boxes(boxes[start:start + self.box_batch_size], predictor.original_size)
+            boxes_torch = torch.as_tensor(chunk, dtype=torch.float, device=self.device)
+            with torch.no_grad(), autocast(self.precision, self.device):
+                sparse_embeddings, dense_embeddings = self.sam.prompt_encoder(
+                    points=None, boxes=boxes_torch, masks=None,
+                )
+                low_res_masks, _ = self.sam.mask_decoder(
+                    image_embeddings=predictor.features,
+                    image_pe=image_pe,
+                    sparse_prompt_embeddings=sparse_embeddings,
+                    dense_prompt_embeddings=dense_embeddings,
+                    multimask_output=False,
+                )
+                masks = []
+                for low_res in low_res_masks:
+                    mask = self.sam.postprocess_masks(low_res[None], predictor.input_size, predictor.original_size)
+                    masks.append((mask[0, 0] > self.sam.mask_threshold).cpu().numpy())
+            # yield outside no_grad / autocast: their state must not leak into the caller
+            yield from masks
+
     def segment_with_boxes(
-        self, image: Image.Image, boxes: List[Dict[str, Any]]
+        self, image: Image.Image, boxes: List[Dict[str, Any]], cache_key: Optional[str] = None
     ) -> List[Dict[str, Any]]:
         """
         Args:
             image: PIL Image
             boxes: list of detection entries with 'box'
+            cache_key: optional image content hash for the embedding cache
         Returns:
             List of dicts with {'mask': np.ndarray(H,W), 'box': box, 'label': str, 'score': float}
         """
         image_np = np.array(image)
-        self.predictor.set_image(image_np)
-        results = []
-        for det in boxes:
-            b = det["box"]
-            input_box = self._box_to_np(b)
-            masks, scores, _ = self.predictor.predict(
-                box=input_box,
-                multimask_output=False,
-            )
-            # masks: list of (H, W) boolean arrays
-            if len(masks) > 0:
-                results.append(
-                    {
-                        "mask": masks[0],
-                        "box": b,
-                        "label": det.get("label"),
-                        "score": det.get("score"),
-                    }
-                )
-        return results
+        self.set_image(image_np, cache_key=cache_key)
+        if not boxes:
+            return []
+        input_boxes = np.stack([self._box_to_np(det["box"]) for det in boxes])
+        return [
+            {
+                "mask": mask,
+                "box": det["box"],
+                "label": det.get("label"),
+                "score": det.get("score"),
+            }
+            for det, mask in zip(boxes, self._predict_boxes(input_boxes))
+        ]
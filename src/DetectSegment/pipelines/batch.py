@@ -0,0 +1,267 @@
+"""
+Batch mode: many images through one loaded DetectAndSegmentPipeline.
+
+- inputs: a directory, a glob pattern, or a manifest file (.txt with one path per line,
+  .json/.jsonl with {"image": path} records); relative manifest paths are resolved
+  against the manifest's directory
+- images are read and decoded in `prefetch_workers` background threads, at most
+  `prefetch_depth` ahead of the models; with tiling, images larger than a tile are
+  opened lazily (io_utils.ImageReader) instead of decoded into memory
+- visualizations and results.json are encoded in `writers` threads while the next
+  image is processed; at most 2 * `writers` results wait in memory
+- every finished image is appended to a JSONL run manifest; a rerun with the same
+  settings skips images already recorded as "ok"
+"""
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from itertools import islice
+from pathlib import Path
+import glob
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from ..utils.embedding_cache import hash_file
+from ..utils.io_utils import load_image, sidecar_pixel_size
+from .detect_and_segment import DetectAndSegmentPipeline
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".tif", ".tiff", ".bmp", ".webp"}
+MANIFEST_NAME = "batch_manifest.jsonl"
+
+
+def _read_manifest_paths(path: Path) -> List[str]:
+    base = path.parent
+    entries = []
+    text = path.read_text(encoding="utf-8")
+    if path.suffix.lower() == ".json":
+        records = json.loads(text)
+        records = records.get("images", []) if isinstance(records, dict) else records
+    elif path.suffix.lower() == ".jsonl":
+        records = [json.loads(line) for line in text.splitlines() if line.strip()]
+    else:
+        records = [line.strip() for line in text.splitlines() if line.strip() and not line.startswith("#")]
+    for rec in records:
+        p = Path(rec["image"] if isinstance(rec, dict) else rec)
+        entries.append(str(p if p.is_absolute() else base / p))
+    return entries
+
+
+def collect_inputs(source: str, recursive: bool = False) -> List[str]:
+    """Image paths from a directory, glob pattern or manifest file (see module docstring)."""
+    path = Path(source)
+    if path.is_dir():
+        candidates = path.rglob("*") if recursive else path.iterdir()
+        return sorted(str(p) for p in candidates if p.is_file() and p.suffix.lower() in IMAGE_EXTENSIONS)
+    if path.is_file() and path.suffix.lower() not in IMAGE_EXTENSIONS:
+        return _read_manifest_paths(path)
+    paths = sorted(glob.glob(source, recursive=recursive))
+    return [p for p in paths if Path(p).suffix.lower() in IMAGE_EXTENSIONS]
+
+
+def output_dirs(image_paths: List[str], output_root: str) -> Dict[str, str]:
+    """
+    One output directory per image, mirroring the inputs' layout below their common parent:
+    `site1/img_001.jpg` -> `<output_root>/site1/img_001`. Name clashes (a.jpg next to a.png)
+    get the extension appended.
+    """
+    if not image_paths:
+        return {}
+    absolute = [os.path.abspath(p) for p in image_paths]
+    common = os.path.commonpath([os.path.dirname(p) for p in absolute])
+    taken: Set[str] = set()
+    dirs = {}
+    for original, p in zip(image_paths, absolute):
+        rel = os.path.splitext(os.path.relpath(p, common))[0]
+        if rel in taken:
+            rel = rel + "_" + os.path.splitext(p)[1].lstrip(".").lower()
+        taken.add(rel)
+        dirs[original] = os.path.join(output_root, rel)
+    return dirs
+
+
+def settings_fingerprint(settings: Dict[str, Any]) -> str:
+    """Short hash of everything that changes results (classes, models, thresholds, tiling)."""
+    return hashlib.sha256(json.dumps(settings, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+class RunManifest:
+    """
+    Append-only JSONL record of finished images, one line per image:
+    {"image" (absolute path), "output_dir", "status": "ok"|"error", "settings", "detections", "seconds", "error"}.
+    Each line is flushed and fsynced before the next image is recorded, so an interrupted
+    run loses at most the images still in flight; a torn last line is ignored on load.
+    """
+
+    def __init__(self, path: str, settings: str) -> None:
+        self.path = path
+        self.settings = settings
+        self._lock = threading.Lock()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._terminate_torn_line()
+
+    def _terminate_torn_line(self) -> None:
+        # a run killed mid-write leaves a last line without "\n"; appending to it would
+        # glue the next record onto the fragment and lose that record too
+        try:
+            with open(self.path, "rb+") as f:
+                if f.seek(0, os.SEEK_END) == 0:
+                    return
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    f.write(b"\n")
+        except FileNotFoundError:
+            pass
+
+    def completed(self) -> Set[str]:
+        """Images whose latest record is "ok" with the current settings."""
+        latest: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    latest[rec.get("image")] = rec
+        return {
+            image for image, rec in latest.items()
+            if rec.get("status") == "ok" and rec.get("settings") == self.settings
+        }
+
+    def record(self, **fields: Any) -> None:
+        line = json.dumps({**fields, "settings": self.settings}, ensure_ascii=False)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+
+def _decode(path: str, with_hash: bool, load: Callable[[str], Any]) -> Tuple[Any, Optional[str]]:
+    image = load(path)  # load_image's convert() forces the decode in this thread
+    return image, hash_file(path) if with_hash else None
+
+
+def prefetch_images(
+    paths: Iterable[str],
+    workers: int = 2,
+    depth: int = 4,
+    with_hash: bool = False,
+    load: Callable[[str], Any] = load_image,
+) -> Iterator[Tuple[str, Optional[Any], Optional[str], Optional[Exception]]]:
+    """
+    Yield (path, image, cache_key, error) in input order while up to `depth` images are
+    read with `load` ahead in `workers` threads. Decoding errors are yielded, not raised.
+    """
+    paths = iter(paths)
+    with ThreadPoolExecutor(max(1, workers), thread_name_prefix="prefetch") as pool:
+        pending: "deque[Tuple[str, Future]]" = deque(
+            (p, pool.submit(_decode, p, with_hash, load)) for p in islice(paths, max(1, depth))
+        )
+        while pending:
+            path, future = pending.popleft()
+            for nxt in islice(paths, 1):
+                pending.append((nxt, pool.submit(_decode, nxt, with_hash, load)))
+            try:
+                image, key = future.result()
+            except Exception as e:
+                yield path, None, None, e
+                continue
+            yield path, image, key, None
+
+
+def run_batch(
+    pipeline: DetectAndSegmentPipeline,
+    image_paths: List[str],
+    classes: List[str],
+    classes_json_path: str,
+    output_root: str,
+    tile_size: Optional[int] = None,
+    tile_overlap: int = 128,
+    save_mask_overlays: bool = False,
+    pixel_size_m: Optional[float] = None,
+    headless: bool = False,
+    prefetch_workers: int = 2,
+    prefetch_depth: int = 4,
+    writers: int = 2,
+    manifest_path: Optional[str] = None,
+    settings: Optional[Dict[str, Any]] = None,
+    resume: bool = True,
+) -> Dict[str, Any]:
+    """
+    Process `image_paths` with one loaded pipeline; per-image outputs are the same as
+    `pipeline.run` writes. `settings` (model names, thresholds...) join classes and tiling
+    in the fingerprint that decides whether a manifest entry still counts as done.
+    Without `pixel_size_m`, each image's Geoportal.wms sidecar (if any) supplies it.
+    Returns a summary: total / skipped / ok / failed counts, seconds and images_per_s.
+    """
+    manifest_path = manifest_path or os.path.join(output_root, MANIFEST_NAME)
+    fingerprint = settings_fingerprint({
+        **(settings or {}),
+        "classes": classes,
+        "tile_size": tile_size,
+        "tile_overlap": tile_overlap,
+        "save_mask_overlays": save_mask_overlays,
+        "pixel_size_m": pixel_size_m,
+        "headless": headless,
+    })
+    manifest = RunManifest(manifest_path, fingerprint)
+    done = manifest.completed() if resume else set()
+    todo = [p for p in image_paths if os.path.abspath(p) not in done]
+    dirs = output_dirs(image_paths, output_root)
+    summary = {"total": len(image_paths), "skipped": len(image_paths) - len(todo), "ok": 0, "failed": 0}
+    if summary["skipped"]:
+        logger.info("resuming: %d of %d images already done (%s)", summary["skipped"], len(image_paths), manifest_path)
+
+    counts_lock = threading.Lock()
+    in_flight = threading.BoundedSemaphore(2 * max(1, writers))
+    with_hash = pipeline.segmenter.embedding_cache is not None
+    load = partial(pipeline.load_input, tile_size=tile_size)
+
+    def finish(path: str, status: str, seconds: float, detections: int = 0, error: str = "") -> None:
+        manifest.record(image=os.path.abspath(path), output_dir=dirs[path], status=status,
+                        detections=detections, seconds=round(seconds, 3), error=error or None)
+        with counts_lock:
+            summary[status if status == "ok" else "failed"] += 1
+        if error:
+            logger.error("%s: %s", path, error)
+        else:
+            logger.info("%s: %d detections in %.2fs", path, detections, seconds)
+
+    def write(path: str, image: Any, processed: Dict[str, Any], t0: float) -> None:
+        try:
+            pipeline.save(image, processed, dirs[path], path, classes_json_path, save_mask_overlays, headless)
+            finish(path, "ok", time.perf_counter() - t0, len(processed["detections"]))
+        except Exception as e:
+            finish(path, "error", time.perf_counter() - t0, error=f"save: {e!r}")
+        finally:
+            in_flight.release()
+
+    t_start = time.perf_counter()
+    with ThreadPoolExecutor(max(1, writers), thread_name_prefix="writer") as pool:
+        for path, image, cache_key, error in prefetch_images(todo, prefetch_workers, prefetch_depth, with_hash, load):
+            t0 = time.perf_counter()
+            if error is not None:
+                finish(path, "error", 0.0, error=f"read: {error!r}")
+                continue
+            try:
+                gsd = pixel_size_m or sidecar_pixel_size(path)
+                processed = pipeline.process(image, classes, tile_size, tile_overlap, cache_key, gsd)
+            except Exception as e:
+                finish(path, "error", time.perf_counter() - t0, error=f"process: {e!r}")
+                continue
+            in_flight.acquire()  # back-pressure: wait for a writer before holding more results
+            pool.submit(write, path, image, processed, t0)
+
+    summary["seconds"] = round(time.perf_counter() - t_start, 3)
+    processed_count = summary["ok"] + summary["failed"]
+    summary["images_per_s"] = round(processed_count / summary["seconds"], 3) if summary["seconds"] else 0.0
+    summary["manifest"] = manifest_path
+    return summary
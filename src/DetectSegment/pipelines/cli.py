@@ -1,32 +1,170 @@
 import argparse
-from DetectSegment.pipelines.detect_and_segment import DetectAndSegmentPipeline
+import json
+import logging
+import sys
+
+from DetectSegment.models.onnx_backend import DEFAULT_OPSET, export_detector, export_sam_checkpoint
+from DetectSegment.pipelines.batch import collect_inputs, run_batch
+from DetectSegment.pipelines.detect_and_segment import DetectAndSegmentPipeline, load_classes
+from DetectSegment.utils.device_utils import add_runtime_args, apply_runtime, format_runtime, runtime_config_from_args
+from DetectSegment.utils.precision import PRECISIONS
+
+
+def _add_model_args(p: argparse.ArgumentParser) -> None:
+    p.add_argument("--detector_model", default="google/owlvit-base-patch32")
+    p.add_argument("--sam_checkpoint", default=None, help="Path to SAM checkpoint .pth (required unless --runtime onnx)")
+    p.add_argument("--sam_model_type", default="vit_h", choices=["vit_h", "vit_l", "vit_b"])
+    p.add_argument("--confidence_threshold", type=float, default=0.25)
+    p.add_argument("--detector_precision", default="fp32", choices=PRECISIONS,
+                   help="OWL-ViT inference precision: bf16 autocast or int8 dynamic quantization (CPU only)")
+    p.add_argument("--sam_precision", default="fp32", choices=PRECISIONS,
+                   help="SAM inference precision: bf16 autocast or int8 dynamic quantization (CPU only)")
+    p.add_argument("--runtime", default="torch", choices=["torch", "onnx"],
+                   help="onnx: ONNX Runtime on CPU with the graphs of `cli export_onnx` (needs --onnx_dir)")
+    p.add_argument("--onnx_dir", default=None, help="Directory written by `cli export_onnx`")
+    p.add_argument("--ort_threads", type=int, default=None, help="ONNX Runtime intra-op threads (default: all cores)")
+    p.add_argument("--tile_size", type=int, default=None,
+                   help="Enable sliding-window inference with tiles of this size (pixels)")
+    p.add_argument("--tile_overlap", type=int, default=128, help="Overlap between tiles (pixels)")
+    p.add_argument("--save_mask_overlays", action="store_true",
+                   help="Also write one mask_overlay_{idx}.png per detection (masks are always in results.json as RLE)")
+    p.add_argument("--pixel_size_m", type=float, default=None,
+                   help="Ground sample distance (metres per pixel) for areas in m²; "
+                        "default: 'pixel_size' from a Geoportal .json sidecar next to the image")
+    p.add_argument("--headless", action="store_true",
+                   help="Only write results.json (counts, areas, masks); skip PNG visualizations")
 
 
 def build_parser():
-    p = argparse.ArgumentParser("DetectSegment CLI")
+    p = argparse.ArgumentParser(
+        "DetectSegment CLI",
+        epilog="Many images with one model load: `cli batch --help`; ONNX Runtime graphs: `cli export_onnx --help`",
+    )
     p.add_argument("image", help="Path to input image")
     p.add_argument("classes_json", help="Path to JSON with 'classes' list")
     p.add_argument("output_dir", help="Directory to write results")
+    _add_model_args(p)
+    add_runtime_args(p)
+    return p
+
+
+def build_batch_parser():
+    p = argparse.ArgumentParser("DetectSegment CLI batch")
+    p.add_argument("source", help="Image directory, glob pattern (quote it) or manifest (.txt / .json / .jsonl)")
+    p.add_argument("classes_json", help="Path to JSON with 'classes' list")
+    p.add_argument("output_dir", help="Root directory; one subdirectory per image")
+    _add_model_args(p)
+    p.add_argument("--recursive", action="store_true", help="Descend into subdirectories / allow ** in globs")
+    p.add_argument("--prefetch", type=int, default=2, help="Image read/decode threads")
+    p.add_argument("--prefetch_depth", type=int, default=4, help="Images decoded ahead of the models")
+    p.add_argument("--writers", type=int, default=2, help="PNG/JSON encoding threads")
+    p.add_argument("--manifest", default=None, help="Run manifest (default: <output_dir>/batch_manifest.jsonl)")
+    p.add_argument("--no_resume", action="store_true", help="Reprocess images already recorded as done")
+    add_runtime_args(p)
+    return p
+
+
+def build_export_parser():
+    p = argparse.ArgumentParser("DetectSegment CLI export_onnx")
+    p.add_argument("output_dir", help="Directory for the ONNX graphs (the --onnx_dir of later runs)")
     p.add_argument("--detector_model", default="google/owlvit-base-patch32")
     p.add_argument("--sam_checkpoint", required=True, help="Path to SAM checkpoint .pth")
     p.add_argument("--sam_model_type", default="vit_h", choices=["vit_h", "vit_l", "vit_b"])
-    p.add_argument("--confidence_threshold", type=float, default=0.25)
+    p.add_argument("--opset", type=int, default=DEFAULT_OPSET)
+    add_runtime_args(p)
     return p
 
 
-def main():
-    args = build_parser().parse_args()
-    pipeline = DetectAndSegmentPipeline(
+def _build_pipeline(args) -> DetectAndSegmentPipeline:
+    if args.runtime == "torch" and not args.sam_checkpoint:
+        raise SystemExit("--sam_checkpoint is required with --runtime torch")
+    return DetectAndSegmentPipeline(
         detector_model=args.detector_model,
         sam_checkpoint=args.sam_checkpoint,
         sam_model_type=args.sam_model_type,
         confidence_threshold=args.confidence_threshold,
+        detector_precision=args.detector_precision,
+        sam_precision=args.sam_precision,
+        runtime=args.runtime,
+        onnx_dir=args.onnx_dir,
+        ort_threads=args.ort_threads,
+    )
+
+
+def batch_main(argv):
+    args = build_batch_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    logging.getLogger(__name__).info("Runtime: %s", format_runtime(apply_runtime(runtime_config_from_args(args))))
+    images = collect_inputs(args.source, recursive=args.recursive)
+    if not images:
+        raise SystemExit(f"No images found for {args.source!r}")
+    classes = load_classes(args.classes_json)
+    pipeline = _build_pipeline(args)
+    summary = run_batch(
+        pipeline,
+        images,
+        classes,
+        args.classes_json,
+        args.output_dir,
+        tile_size=args.tile_size,
+        tile_overlap=args.tile_overlap,
+        save_mask_overlays=args.save_mask_overlays,
+        pixel_size_m=args.pixel_size_m,
+        headless=args.headless,
+        prefetch_workers=args.prefetch,
+        prefetch_depth=args.prefetch_depth,
+        writers=args.writers,
+        manifest_path=args.manifest,
+        settings={
+            "detector_model": args.detector_model,
+            "sam_checkpoint": args.sam_checkpoint,
+            "sam_model_type": args.sam_model_type,
+            "confidence_threshold": args.confidence_threshold,
+            # only non-default precisions, so manifests of earlier fp32 runs still resume
+            **{k: v for k, v in (("detector_precision", args.detector_precision),
+                                 ("sam_precision", args.sam_precision)) if v != "fp32"},
+            **({"runtime": "onnx", "onnx_dir": args.onnx_dir} if args.runtime == "onnx" else {}),
+        },
+        resume=not args.no_resume,
+    )
+    print(json.dumps(summary, indent=2))
+    if summary["failed"]:
+        sys.exit(1)
+
+
+def export_main(argv):
+    args = build_export_parser().parse_args(argv)
+    apply_runtime(runtime_config_from_args(args))
+    paths = export_detector(args.detector_model, args.output_dir, opset=args.opset)
+    paths += export_sam_checkpoint(args.sam_checkpoint, args.sam_model_type, args.output_dir, opset=args.opset)
+    print("\n".join(paths))
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] == "batch":
+        return batch_main(argv[1:])
+    if argv and argv[0] == "export_onnx":
+        return export_main(argv[1:])
+    args = build_parser().parse_args(argv)
+    print(f"Runtime: {format_runtime(apply_runtime(runtime_config_from_args(args)))}")
+    pipeline = _build_pipeline(args)
+    result = pipeline.run(
+        args.image,
+        args.classes_json,
+        args.output_dir,
+        tile_size=args.tile_size,
+        tile_overlap=args.tile_overlap,
+        save_mask_overlays=args.save_mask_overlays,
+        pixel_size_m=args.pixel_size_m,
+        headless=args.headless,
     )
-    result = pipeline.run(args.image, args.classes_json, args.output_dir)
     print("Results JSON:")
     print(result["input"])  # brief confirmation
     print("Detections:")
     print(len(result["detections"]))
+    print("Counts:")
+    print(json.dumps(result["stats"], indent=2, ensure_ascii=False))
 
 
 if __name__ == "__main__":
@@ -1,13 +1,28 @@
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
+from itertools import islice
 from pathlib import Path
 
+import numpy as np
 from PIL import Image
 
 from ..models.detector import ZeroShotDetector
 from ..models.sam_segmenter import SAMSegmenter
-from ..utils.io_utils import load_json, save_json, load_image, save_image
-from ..utils.viz_utils import draw_boxes, overlay_mask
+from ..models.onnx_backend import OrtSAMSegmenter, OrtZeroShotDetector
+from ..utils.io_utils import ImageReader, image_size, load_json, open_image, save_json, load_image, save_image, sidecar_pixel_size
+from ..utils.viz_utils import draw_boxes, overlay_mask, render_masks, render_instances
 from ..utils.device_utils import get_default_device
+from ..utils.embedding_cache import EmbeddingCache, hash_file
+from ..utils.tiling import InstanceMerger, iter_tiles, paste_mask, subsample_instances
+from ..utils.mask_utils import encode_rle, encode_rle_cropped
+from ..utils.mask_stats import instance_areas_centroids, instance_records, mask_areas_centroids, summarize
+
+
+def load_classes(classes_json_path: str) -> List[str]:
+    classes_data = load_json(classes_json_path)
+    classes = classes_data.get("classes", [])
+    if not isinstance(classes, list) or len(classes) == 0:
+        raise ValueError("JSON must include a non-empty 'classes' list.")
+    return classes
 
 
 class DetectAndSegmentPipeline:
@@ -17,6 +32,21 @@ class DetectAndSegmentPipeline:
     - Runs zero-shot object detection (OWL-ViT)
     - Uses boxes to prompt SAM to generate masks
     - Saves visualizations and returns structured results
+
+    `run` = `load_input` + `process` (models, in memory) + `save` (visualizations, results.json).
+
+    With tiling, images larger than one tile are opened as an io_utils.ImageReader
+    (memory-mapped, tiles read on demand; compressed formats are decoded once into
+    `raster_cache_dir`). Their visualizations are rendered on a subsampled preview no
+    larger than `vis_max_side`; results.json masks stay at full resolution.
+
+    results.json carries per-instance area / centroid and per-class counts and areas
+    ("stats", see utils.mask_stats); areas in m² need the ground sample distance.
+
+    `detector_precision` / `sam_precision` select fp32, bf16 or int8 inference per model
+    (see utils.precision). `runtime="onnx"` runs both models with ONNX Runtime on CPU from
+    the graphs `cli export_onnx` wrote to `onnx_dir` (`ort_threads` intra-op threads);
+    `sam_checkpoint` is not loaded then.
     """
 
     def __init__(
@@ -26,51 +56,207 @@ class DetectAndSegmentPipeline:
         sam_model_type: str = "vit_h",
         confidence_threshold: float = 0.25,
         device: str = None,
+        embedding_cache: Optional[EmbeddingCache] = None,
+        raster_cache_dir: Optional[str] = None,
+        vis_max_side: int = 8192,
+        detector_precision: Optional[str] = None,
+        sam_precision: Optional[str] = None,
+        runtime: str = "torch",
+        onnx_dir: Optional[str] = None,
+        ort_threads: Optional[int] = None,
     ) -> None:
         device = device or get_default_device()
+        self.raster_cache_dir = raster_cache_dir
+        self.vis_max_side = vis_max_side
+        if runtime == "onnx":
+            if not onnx_dir:
+                raise ValueError("runtime='onnx' needs onnx_dir (see `cli export_onnx`)")
+            self.detector = OrtZeroShotDetector(
+                onnx_dir,
+                confidence_threshold=confidence_threshold,
+                num_threads=ort_threads,
+            )
+            self.segmenter = OrtSAMSegmenter(
+                onnx_dir,
+                model_type=sam_model_type,
+                embedding_cache=embedding_cache,
+                num_threads=ort_threads,
+            )
+            return
+        if runtime != "torch":
+            raise ValueError(f"Unknown runtime {runtime!r}; expected 'torch' or 'onnx'")
         self.detector = ZeroShotDetector(
             model_name=detector_model,
             device=device,
             confidence_threshold=confidence_threshold,
+            precision=detector_precision,
         )
         self.segmenter = SAMSegmenter(
             sam_checkpoint=sam_checkpoint,
             model_type=sam_model_type,
             device=device,
+            embedding_cache=embedding_cache,
+            precision=sam_precision,
         )
 
-    def run(
+    def _detect_and_segment_tiled(
+        self,
+        image: Image.Image,
+        classes: List[str],
+        tile_size: int,
+        tile_overlap: int,
+        cache_key: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Run detection + SAM tile by tile and merge instances that cross tile borders.
+        Returns merged instances (see InstanceMerger.merge) in whole-image coordinates.
+        """
+        merger = InstanceMerger()
+        tiles = iter_tiles(image, tile_size, tile_overlap)
+        while True:
+            # Up to `detector.batch_size` tiles share one detector forward pass
+            group = list(islice(tiles, self.detector.batch_size))
+            if not group:
+                break
+            group_dets = self.detector.predict_batch([tile for _, tile in group], classes)
+            for (box, tile), tile_dets in zip(group, group_dets):
+                if not tile_dets:
+                    continue
+                x0, y0 = box[0], box[1]
+                tile_key = f"{cache_key}:tile{box}" if cache_key else None
+                for seg in self.segmenter.segment_with_boxes(tile, tile_dets, cache_key=tile_key):
+                    merger.add(seg["mask"], seg.get("label"), seg.get("score"), (x0, y0))
+        return merger.merge()
+
+    def load_input(self, image_path: str, tile_size: Optional[int] = None) -> Any:
+        """PIL image, or an ImageReader when tiled inference will apply (never fully decoded in memory)."""
+        if tile_size and max(image_size(image_path)) > tile_size:
+            return open_image(image_path, cache_dir=self.raster_cache_dir)
+        if str(image_path).lower().endswith(".npy"):
+            return open_image(image_path).to_pil()
+        return load_image(image_path)
+
+    def process(
         self,
+        image: Any,
+        classes: List[str],
+        tile_size: Optional[int] = None,
+        tile_overlap: int = 128,
+        cache_key: Optional[str] = None,
+        pixel_size_m: Optional[float] = None,
+    ) -> Dict[str, Any]:
+        """
+        Detection + segmentation in memory; nothing is written (see `save`).
+        `image` is a PIL image or, for tiled inference, an ImageReader.
+        Returns {"classes", "detections", "stats", "instance_stats"} plus either
+        "segmentations" (full-size masks) or, for tiled inference, "instances"
+        (cropped masks, see InstanceMerger.merge) with "tile_size" / "tile_overlap".
+        `pixel_size_m` (metres per pixel) adds areas in m² to the stats.
+        """
+        if tile_size and max(image.size) > tile_size:
+            instances = self._detect_and_segment_tiled(image, classes, tile_size, tile_overlap, cache_key)
+            # Merged instances replace raw per-tile detections (which contain duplicates)
+            detections = [
+                {
+                    "label": inst["label"],
+                    "score": inst["score"],
+                    "box": {
+                        "xmin": inst["box"][0],
+                        "ymin": inst["box"][1],
+                        "xmax": inst["box"][2] - 1,
+                        "ymax": inst["box"][3] - 1,
+                    },
+                }
+                for inst in instances
+            ]
+            areas, centroids = instance_areas_centroids(instances)
+            return {
+                "classes": classes,
+                "detections": detections,
+                "instances": instances,
+                "tile_size": tile_size,
+                "tile_overlap": tile_overlap,
+                **self._stats(classes, [i["label"] for i in instances], areas, centroids, pixel_size_m),
+            }
+
+        if isinstance(image, ImageReader):
+            image = image.to_pil()
+        detections: List[Dict[str, Any]] = self.detector.predict(image, classes)
+        # Segment with SAM using boxes
+        seg_results = self.segmenter.segment_with_boxes(image, detections, cache_key=cache_key)
+        if seg_results:
+            areas, centroids = mask_areas_centroids(np.stack([seg["mask"] for seg in seg_results]))
+        else:
+            areas, centroids = mask_areas_centroids(np.zeros((0, image.height, image.width), dtype=bool))
+        labels = [seg.get("label") or "object" for seg in seg_results]
+        return {
+            "classes": classes,
+            "detections": detections,
+            "segmentations": seg_results,
+            **self._stats(classes, labels, areas, centroids, pixel_size_m),
+        }
+
+    @staticmethod
+    def _stats(classes, labels, areas, centroids, pixel_size_m) -> Dict[str, Any]:
+        return {
+            "stats": summarize(labels, areas, pixel_size_m, classes),
+            "instance_stats": instance_records(areas, centroids, pixel_size_m),
+        }
+
+    def save(
+        self,
+        image: Any,
+        processed: Dict[str, Any],
+        output_dir: str,
         image_path: str,
         classes_json_path: str,
-        output_dir: str,
+        save_mask_overlays: bool = False,
+        headless: bool = False,
     ) -> Dict[str, Any]:
+        """
+        Write visualizations and results.json for the output of `process`; returns the results dict.
+        Touches no model state, so it can run in a writer thread while the next image is processed.
+        `headless` writes results.json only (no overlay rendering or PNG encoding).
+        """
         Path(output_dir).mkdir(parents=True, exist_ok=True)
+        if "instances" in processed:
+            return self._save_tiled(
+                image, processed, output_dir, image_path, classes_json_path, save_mask_overlays, headless
+            )
+        if isinstance(image, ImageReader):
+            image = image.to_pil()
 
-        classes_data = load_json(classes_json_path)
-        classes = classes_data.get("classes", [])
-        if not isinstance(classes, list) or len(classes) == 0:
-            raise ValueError("JSON must include a non-empty 'classes' list.")
-
-        image = load_image(image_path)
+        classes = processed["classes"]
+        detections = processed["detections"]
+        seg_results = processed["segmentations"]
 
-        detections: List[Dict[str, Any]] = self.detector.predict(image, classes)
+        boxes_vis_path = masks_vis_path = None
+        if not headless:
+            # Save boxes visualization
+            boxes_vis = draw_boxes(image, detections)
+            boxes_vis_path = str(Path(output_dir) / "boxes_visualized.png")
+            save_image(boxes_vis_path, boxes_vis)
 
-        # Save boxes visualization
-        boxes_vis = draw_boxes(image, detections)
-        boxes_vis_path = str(Path(output_dir) / "boxes_visualized.png")
-        save_image(boxes_vis_path, boxes_vis)
+            # All masks in one overlay (single compositing pass)
+            masks_vis_path = str(Path(output_dir) / "masks_visualized.png")
+            if seg_results:
+                masks_vis = render_masks(
+                    image,
+                    np.stack([seg["mask"] for seg in seg_results]),
+                    [seg.get("label") or "object" for seg in seg_results],
+                )
+            else:
+                masks_vis = image
+            save_image(masks_vis_path, masks_vis)
 
-        # Segment with SAM using boxes
-        seg_results = self.segmenter.segment_with_boxes(image, detections)
-
-        # Save mask overlays per detection
-        mask_paths = []
-        for idx, seg in enumerate(seg_results):
-            mask_img = overlay_mask(image, seg["mask"])  # default green overlay
-            mask_path = str(Path(output_dir) / f"mask_overlay_{idx}.png")
-            save_image(mask_path, mask_img)
-            mask_paths.append(mask_path)
+        # Save mask overlays per detection (opt-in)
+        mask_paths = [None] * len(seg_results)
+        if save_mask_overlays and not headless:
+            for idx, seg in enumerate(seg_results):
+                mask_img = overlay_mask(image, seg["mask"])  # default green overlay
+                mask_path = str(Path(output_dir) / f"mask_overlay_{idx}.png")
+                save_image(mask_path, mask_img)
+                mask_paths[idx] = mask_path
 
         # Package results JSON
         result = {
@@ -81,16 +267,123 @@ class DetectAndSegmentPipeline:
             },
             "detections": detections,
             "boxes_visualization": boxes_vis_path,
+            "masks_visualization": masks_vis_path,
             "segmentations": [
                 {
                     "label": seg.get("label"),
                     "score": seg.get("score"),
                     "box": seg.get("box"),
                     "mask_shape": list(seg["mask"].shape),
+                    "rle": encode_rle(seg["mask"]),
+                    **processed["instance_stats"][i],
                     "mask_overlay_path": mask_paths[i],
                 }
                 for i, seg in enumerate(seg_results)
             ],
+            "stats": processed["stats"],
+        }
+        out_json = str(Path(output_dir) / "results.json")
+        save_json(out_json, result)
+        return result
+
+    def run(
+        self,
+        image_path: str,
+        classes_json_path: str,
+        output_dir: str,
+        tile_size: Optional[int] = None,
+        tile_overlap: int = 128,
+        save_mask_overlays: bool = False,
+        pixel_size_m: Optional[float] = None,
+        headless: bool = False,
+    ) -> Dict[str, Any]:
+        """
+        Args:
+            tile_size: if set and the image is larger than one tile, run sliding-window
+                inference with `tile_overlap` pixels shared between neighbouring tiles.
+            save_mask_overlays: also write one full-size `mask_overlay_{idx}.png` per
+                detection. Masks are always stored inline in results.json as COCO RLE.
+            pixel_size_m: ground sample distance (metres per pixel) for areas in m²;
+                defaults to the `pixel_size` of a Geoportal.wms `.json` sidecar, if present.
+            headless: only write results.json (counts, areas, RLE masks), no PNGs.
+        """
+        classes = load_classes(classes_json_path)
+        image = self.load_input(image_path, tile_size)
+        cache_key = hash_file(image_path) if self.segmenter.embedding_cache is not None else None
+        pixel_size_m = pixel_size_m or sidecar_pixel_size(image_path)
+
+        processed = self.process(image, classes, tile_size, tile_overlap, cache_key, pixel_size_m)
+        return self.save(image, processed, output_dir, image_path, classes_json_path, save_mask_overlays, headless)
+
+    def _save_tiled(
+        self,
+        image: Any,
+        processed: Dict[str, Any],
+        output_dir: str,
+        image_path: str,
+        classes_json_path: str,
+        save_mask_overlays: bool = False,
+        headless: bool = False,
+    ) -> Dict[str, Any]:
+        instances = processed["instances"]
+        detections = processed["detections"]
+        width, height = image.size
+
+        # Huge rasters: draw on every `stride`-th pixel, with masks and boxes mapped onto that grid
+        stride = 1
+        vis_image, vis_instances, vis_detections = image, instances, detections
+        if isinstance(image, ImageReader):
+            stride = image.stride_for(self.vis_max_side)
+            vis_image = image.thumbnail(self.vis_max_side)
+            if stride > 1:
+                vis_instances = subsample_instances(instances, stride)
+                vis_detections = [{**d, "box": {k: v / stride for k, v in d["box"].items()}} for d in detections]
+        vis_width, vis_height = vis_image.size
+
+        boxes_vis_path = masks_vis_path = None
+        if not headless:
+            boxes_vis = draw_boxes(vis_image, vis_detections)
+            boxes_vis_path = str(Path(output_dir) / "boxes_visualized.png")
+            save_image(boxes_vis_path, boxes_vis)
+
+            masks_vis_path = str(Path(output_dir) / "masks_visualized.png")
+            save_image(masks_vis_path, render_instances(vis_image, vis_instances))
+
+        # RLE is built from the cropped masks; full-size masks only for opt-in overlays
+        segmentations = []
+        for idx, (inst, det) in enumerate(zip(instances, detections)):
+            mask_path = None
+            if save_mask_overlays and not headless:
+                vis_inst = subsample_instances([inst], stride)
+                mask = paste_mask(vis_inst[0], vis_width, vis_height) if vis_inst else np.zeros((vis_height, vis_width), bool)
+                mask_img = overlay_mask(vis_image, mask)
+                mask_path = str(Path(output_dir) / f"mask_overlay_{idx}.png")
+                save_image(mask_path, mask_img)
+            segmentations.append(
+                {
+                    "label": det["label"],
+                    "score": det["score"],
+                    "box": det["box"],
+                    "mask_shape": [height, width],
+                    "rle": encode_rle_cropped(inst["mask"], inst["box"], (height, width)),
+                    **processed["instance_stats"][idx],
+                    "mask_overlay_path": mask_path,
+                }
+            )
+
+        result = {
+            "input": {
+                "image_path": image_path,
+                "classes_json_path": classes_json_path,
+                "classes": processed["classes"],
+                "tile_size": processed["tile_size"],
+                "tile_overlap": processed["tile_overlap"],
+            },
+            "detections": detections,
+            "boxes_visualization": boxes_vis_path,
+            "masks_visualization": masks_vis_path,
+            "segmentations": segmentations,
+            "stats": processed["stats"],
         }
         out_json = str(Path(output_dir) / "results.json")
         save_json(out_json, result)
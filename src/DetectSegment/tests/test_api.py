@@ -0,0 +1,120 @@
+from io import BytesIO
+from types import SimpleNamespace
+import json
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+
+from DetectSegment.models.sam3_segmenter import Sam3Segmenter
+from UserPromptProcess.image_prep import ImagePrepConfig
+
+
+class ColorSam3(Sam3Segmenter):
+    """Model-free SAM3: "truck" is every red pixel, "car" every green one."""
+
+    channels = {"truck": 0, "car": 1}
+
+    def __init__(self) -> None:
+        self.batch_size = 4
+
+    def encode_images(self, images, cache_keys=None):
+        return [{"pixels": np.asarray(image)} for image in images]
+
+    def _predict_prompts(self, image_embeds, class_names, score_threshold, mask_threshold):
+        results = []
+        for name in class_names:
+            mask = torch.from_numpy(image_embeds["pixels"][..., self.channels[name]] > 128)
+            masks = mask[None] if mask.any() else torch.zeros((0, *mask.shape), dtype=torch.bool)
+            results.append({"scores": torch.full((len(masks),), 0.9), "boxes": torch.zeros((len(masks), 4)),
+                            "masks": masks})
+        return results
+
+
+def _png(width: int = 80, height: int = 60) -> bytes:
+    pixels = np.zeros((height, width, 3), dtype=np.uint8)
+    pixels[10:30, 5:45, 0] = 255  # truck
+    pixels[40:50, 60:70, 1] = 255  # car
+    buf = BytesIO()
+    Image.fromarray(pixels).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+@pytest.fixture
+def api(monkeypatch, tmp_path):
+    """API.app with SAM3 and Gemini stubbed out; `api.answers` records what the chat answer saw."""
+    app = pytest.importorskip("API.app")
+    testclient = pytest.importorskip("fastapi.testclient")
+    answers = []
+
+    async def suggest_classes(image, chat_history, fresh=False):
+        return ["truck", "car"]
+
+    async def chat_answer(chat_history, classes, image, answer_json=None, fresh=False):
+        answers.append({"image": image, "answer_json": answer_json})
+        return "1 truck, 1 car"
+
+    monkeypatch.setattr(app, "OUTPUTS_DIR", tmp_path)
+    monkeypatch.setattr(app, "ASSETS_DIR", tmp_path / "assets")
+    monkeypatch.setattr(app.registry, "get", lambda name: ColorSam3())
+    monkeypatch.setattr(app, "get_model", lambda: SimpleNamespace(image_config=ImagePrepConfig(format="PNG")))
+    monkeypatch.setattr(app, "asuggest_classes", suggest_classes)
+    monkeypatch.setattr(app, "achat_answer", chat_answer)
+    return SimpleNamespace(app=app, client=testclient.TestClient(app.app), answers=answers)
+
+
+def test_segment_image_stream_event_order(api):
+    response = api.client.post(
+        "/segment_image_stream",
+        data={"chat_history": json.dumps([{"role": "user", "content": "how many vehicles?"}])},
+        files={"image": ("scene.png", _png(), "image/png")},
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    events = [json.loads(line) for line in response.text.splitlines()]
+    assert [e["event"] for e in events] == ["classes", "class_result", "class_result", "stats", "overlay", "answer"]
+    assert events[0]["classes"] == ["truck", "car"]
+    assert [(e["class"], e["count"], e["segmentations"][0]["area_px"]) for e in events[1:3]] == [
+        ("truck", 1, 800), ("car", 1, 100)]
+    assert events[3]["stats"]["total_count"] == 2
+    assert Image.open(events[4]["masked_image_path"]).size == (80, 60)
+    assert events[5]["chat_response"] == "1 truck, 1 car"
+    assert api.answers[0]["answer_json"]["stats"] == events[3]["stats"]
+
+    headless = api.client.post(
+        "/segment_image_stream",
+        data={"chat_history": "[]", "headless": "true"},
+        files={"image": ("scene.png", _png(), "image/png")},
+    )
+    assert [json.loads(line)["event"] for line in headless.text.splitlines()] == [
+        "classes", "class_result", "class_result", "stats", "answer"]
+
+
+def test_class_results_are_stored_only_with_an_image_key(api, monkeypatch):
+    stored = []
+    monkeypatch.setattr(api.app.class_result_store, "put", lambda image_key, *args, **kwargs: stored.append(image_key))
+    image = Image.open(BytesIO(_png())).convert("RGB")
+    api.app.process_image_with_class_list(image, ["truck", "car"], render=False)
+    assert stored == []
+    api.app.process_image_with_class_list(image, ["truck"], image_key="scene", render=False)
+    assert stored == ["scene"]
+
+
+@pytest.mark.parametrize("endpoint", ["/segment_image", "/segment_image_stream"])
+def test_cropped_raster_request(api, monkeypatch, tmp_path, endpoint):
+    # uploads above one tile become ImageReaders; their overlay is a stride-2 preview (40x30)
+    monkeypatch.setattr(api.app, "SAM3_TILE_SIZE", 32)
+    monkeypatch.setattr(api.app, "SAM3_TILE_OVERLAP", 8)
+    monkeypatch.setattr(api.app, "RASTER_PREVIEW_MAX_SIDE", 40)
+    monkeypatch.setattr(api.app, "RASTER_CACHE_DIR", str(tmp_path / "raster_cache"))
+    response = api.client.post(
+        endpoint,
+        data={"chat_history": "[]", "crop": "56,36,74,54"},  # the car, in upload pixels
+        files={"image": ("scene.png", _png(), "image/png")},
+    )
+    assert response.status_code == 200 and "error" not in response.text
+    overlay = np.asarray(api.answers[-1]["image"].to_pil())
+    assert overlay.shape == (9, 9, 3)  # (28, 18, 37, 27) of the preview
+    # the car's mask colour in the middle (its label above it), black background below
+    assert overlay[4:7, 2:7].max(axis=2).min() > 0 and overlay[7:].max() == 0
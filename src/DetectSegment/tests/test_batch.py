@@ -0,0 +1,74 @@
+from types import SimpleNamespace
+import json
+import os
+
+import pytest
+
+from DetectSegment.pipelines import batch
+from DetectSegment.pipelines.batch import RunManifest, run_batch
+
+
+class StubPipeline:
+    """Stands in for DetectAndSegmentPipeline; raises KeyboardInterrupt (Ctrl-C) on `interrupt_at`."""
+
+    def __init__(self, interrupt_at=None):
+        self.segmenter = SimpleNamespace(embedding_cache=None)
+        self.interrupt_at = interrupt_at
+        self.processed = []
+        self.saved = []
+
+    def load_input(self, path, tile_size=None):
+        return path
+
+    def process(self, image, classes, tile_size, tile_overlap, cache_key, gsd):
+        if os.path.basename(image) == self.interrupt_at:
+            raise KeyboardInterrupt
+        self.processed.append(os.path.basename(image))
+        return {"detections": [{"label": classes[0]}]}
+
+    def save(self, image, processed, out_dir, path, classes_json_path, save_mask_overlays, headless):
+        self.saved.append(os.path.basename(path))
+
+
+def _run(pipeline, paths, tmp_path, classes=("car",)):
+    return run_batch(pipeline, paths, list(classes), "classes.json", str(tmp_path / "out"),
+                     prefetch_workers=1, prefetch_depth=1, writers=1)
+
+
+def test_interrupted_run_resumes_with_remaining_images(tmp_path, monkeypatch):
+    paths = [str(tmp_path / f"img{i}.png") for i in range(5)]
+    fsyncs = []
+    real_fsync = os.fsync
+    monkeypatch.setattr(os, "fsync", lambda fd: fsyncs.append(fd) or real_fsync(fd))
+
+    first = StubPipeline(interrupt_at="img3.png")
+    with pytest.raises(KeyboardInterrupt):
+        _run(first, paths, tmp_path)
+    assert first.saved == ["img0.png", "img1.png", "img2.png"]
+    manifest = tmp_path / "out" / batch.MANIFEST_NAME
+    assert len(fsyncs) == 3  # every finished image is on disk before the next one is recorded
+    # killed while appending img3's record: a torn last line
+    with open(manifest, "a", encoding="utf-8") as f:
+        f.write('{"image": "' + os.path.abspath(paths[3]) + '", "sta')
+
+    second = StubPipeline()
+    summary = _run(second, paths, tmp_path)
+    assert second.processed == ["img3.png", "img4.png"]
+    assert (summary["total"], summary["skipped"], summary["ok"], summary["failed"]) == (5, 3, 2, 0)
+    records = [json.loads(line) for line in manifest.read_text().splitlines()[-2:]]
+    assert [os.path.basename(r["image"]) for r in records] == ["img3.png", "img4.png"]
+
+    # nothing left with the same settings; other classes change the fingerprint and redo everything
+    assert _run(StubPipeline(), paths, tmp_path)["skipped"] == 5
+    third = StubPipeline()
+    assert _run(third, paths, tmp_path, classes=("truck",))["skipped"] == 0
+    assert len(third.processed) == 5
+
+
+def test_manifest_latest_record_wins(tmp_path):
+    manifest = RunManifest(str(tmp_path / "m.jsonl"), "settings-a")
+    manifest.record(image="/a.png", status="ok")
+    manifest.record(image="/b.png", status="ok")
+    manifest.record(image="/b.png", status="error", error="save failed")
+    RunManifest(str(tmp_path / "m.jsonl"), "settings-b").record(image="/c.png", status="ok")
+    assert manifest.completed() == {"/a.png"}
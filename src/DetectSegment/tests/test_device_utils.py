@@ -0,0 +1,43 @@
+import argparse
+
+import pytest
+
+from DetectSegment.utils.device_utils import (
+    RuntimeConfig,
+    add_runtime_args,
+    format_cpu_list,
+    parse_cpu_list,
+    runtime_config_from_args,
+)
+
+
+def test_cpu_list_roundtrip():
+    assert parse_cpu_list("0-3, 8,10-11") == [0, 1, 2, 3, 8, 10, 11]
+    assert format_cpu_list([11, 0, 1, 2, 3, 8, 10]) == "0-3,8,10-11"
+    assert format_cpu_list([5]) == "5"
+    with pytest.raises(ValueError):
+        parse_cpu_list(" , ")
+
+
+def test_worker_cpus_split():
+    cpus = list(range(8))
+    assert RuntimeConfig().worker_cpus(cpus) is None
+    slices = [RuntimeConfig(workers=3, worker_index=i).worker_cpus(cpus) for i in range(3)]
+    assert slices == [[0, 1], [2, 3, 4], [5, 6, 7]]
+    assert RuntimeConfig(workers=4, worker_index=3).worker_cpus([0, 1]) == [1]
+    assert RuntimeConfig(cpu_affinity="2-3", workers=4).worker_cpus(cpus) == [2, 3]
+    with pytest.raises(ValueError):
+        RuntimeConfig(workers=2, worker_index=2).worker_cpus(cpus)
+
+
+def test_env_and_cli_overrides():
+    env = {"DEVICE": "cpu", "TORCH_THREADS": "4", "WORKERS": "2", "WORKER_INDEX": "1", "NO_GRAD": "0"}
+    config = RuntimeConfig.from_env(env)
+    assert (config.device, config.threads, config.workers, config.worker_index, config.no_grad) == ("cpu", 4, 2, 1, False)
+    assert config.channels_last == "auto" and config.interop_threads is None
+
+    p = argparse.ArgumentParser()
+    add_runtime_args(p)
+    args = p.parse_args(["--threads", "2", "--channels_last", "off"])
+    config = runtime_config_from_args(args, env)
+    assert (config.threads, config.channels_last, config.device, config.workers) == (2, "off", "cpu", 2)
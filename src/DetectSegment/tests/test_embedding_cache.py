@@ -0,0 +1,50 @@
+from concurrent.futures import ThreadPoolExecutor
+import time
+
+import torch
+
+from DetectSegment.utils.embedding_cache import EmbeddingCache
+
+
+def test_memory_tier_lru_hits_and_evictions():
+    value = {"embed": torch.zeros(100)}  # 400 bytes
+    cache = EmbeddingCache(max_bytes=1000)
+    cache.put("a", value)
+    cache.put("b", value)
+    assert cache.get("a") is value  # "a" is now the most recently used
+    cache.put("c", value)
+    assert cache.get("b") is None and cache.get("a") is value and cache.get("c") is value
+    cache.put("huge", {"embed": torch.zeros(1000)})  # larger than the whole budget: not kept
+    assert cache.get("huge") is None
+    stats = cache.stats()
+    assert (stats["entries"], stats["bytes"]) == (2, 800)
+    assert (stats["hits"], stats["misses"], stats["evictions"]) == (3, 2, 1)
+
+
+def test_embedding_cache_disk_budget_and_concurrent_writers(tmp_path):
+    value = {"embed": torch.zeros(1000)}
+    probe = EmbeddingCache(max_bytes=0, disk_dir=str(tmp_path / "probe"))
+    probe.put("x", value)
+    size = probe.stats()["disk_bytes"]
+    for _ in range(3):
+        probe.put("x", value)
+    assert probe.stats()["disk_bytes"] == size  # a rewrite replaces the file, not adds to it
+
+    # 3 entries fit (eviction shrinks to 90% of the budget)
+    cache = EmbeddingCache(max_bytes=0, disk_dir=str(tmp_path / "tier"), max_disk_bytes=int(size * 3.5))
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(lambda i: cache.put(f"k{i % 3}", value), range(48)))
+    stats = cache.stats()
+    assert stats["disk_writes"] == 48
+    # rewriting a key replaces its file: no growth, nothing evicted
+    assert (stats["disk_bytes"], stats["disk_evictions"]) == (3 * size, 0)
+    assert sorted(p.suffix for p in (tmp_path / "tier").iterdir()) == [".pt"] * 3  # no temp files left
+
+    for i in range(10):
+        cache.put(f"img{i}", value)
+        time.sleep(0.01)
+    assert cache.get("img7") is not None  # oldest of the 3 left, but read: kept as recently used
+    cache.put("img10", value)
+    stats = cache.stats()
+    assert stats["disk_evictions"] > 0 and stats["disk_bytes"] == 3 * size
+    assert [cache.contains(f"img{i}") for i in (7, 8, 9, 10)] == [True, False, True, True]
@@ -0,0 +1,45 @@
+import pytest
+import torch
+from PIL import Image
+
+from API.inference_worker import InferenceWorker
+
+
+def test_failed_slot_fails_only_its_request():
+    def handler(payloads):
+        return [ValueError(p) if p == "bad" else p.upper() for p in payloads]
+
+    worker = InferenceWorker(handler, max_batch_size=3, batch_window_s=0.5)
+    futures = [worker.submit(p) for p in ("a", "bad", "c")]
+    assert [f.exception(timeout=5) is None for f in futures] == [True, False, True]
+    assert futures[0].result() == "A" and futures[2].result() == "C"
+    assert worker.stats()["max_batch_size_seen"] == 3
+    worker.stop()
+
+
+def test_segment_batch_isolates_a_failing_job(monkeypatch):
+    app = pytest.importorskip("API.app")
+
+    class FakeSam3:
+        def encode_images(self, images, keys):
+            raise ValueError("cannot encode")
+
+    def process(image, class_names, on_class_result=None, **kwargs):
+        if image.width == 3:
+            raise ValueError("odd image")
+        masks = torch.ones((1, image.height, image.width), dtype=torch.bool)
+        on_class_result(class_names[0], {"scores": torch.tensor([0.9]), "boxes": torch.tensor([[0.0, 0, 1, 1]]),
+                                         "masks": masks})
+        return None
+
+    monkeypatch.setattr(app.registry, "get", lambda name: FakeSam3())
+    monkeypatch.setattr(app, "process_image_with_class_list", process)
+    worker = InferenceWorker(app._segment_batch, max_batch_size=3, batch_window_s=0.5)
+    jobs = [{"image": Image.new("RGB", (w, 4)), "class_names": ["car"], "headless": True} for w in (4, 3, 5)]
+    futures = [worker.submit(job) for job in jobs]
+    with pytest.raises(ValueError, match="odd image"):
+        futures[1].result(timeout=5)
+    for fut, width in ((futures[0], 4), (futures[2], 5)):
+        segmentations = fut.result(timeout=5)["segmentations"]
+        assert [(s["label"], s["area_px"]) for s in segmentations] == [("car", 4 * width)]
+    worker.stop()
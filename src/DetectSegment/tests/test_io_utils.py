@@ -0,0 +1,84 @@
+import os
+
+import numpy as np
+import pytest
+from PIL import Image, ImageFile
+
+from DetectSegment.utils import io_utils
+from DetectSegment.utils.io_utils import RasterTooLargeError, image_size, open_image
+
+_RASTER = np.random.default_rng(0).integers(0, 256, (70, 110, 3), dtype=np.uint8)
+
+
+@pytest.mark.parametrize("name, backend", [
+    ("r.npy", "npy"), ("r.tif", "tiff"), ("r.png", "cache"), ("r_lzw.tif", "cache"),
+])
+def test_reader_matches_pil(tmp_path, name, backend):
+    path = str(tmp_path / name)
+    if name.endswith(".npy"):
+        np.save(path, _RASTER)
+    else:
+        Image.fromarray(_RASTER).save(path, **({"compression": "tiff_lzw"} if "lzw" in name else {}))
+    reader = open_image(path, cache_dir=str(tmp_path / "cache"))
+    assert reader.backend == backend
+    assert reader.size == image_size(path) == (110, 70)
+    pil = Image.fromarray(_RASTER)
+    for box in [(0, 0, 110, 70), (5, 7, 40, 30), (-10, -5, 20, 20), (100, 60, 130, 90), (200, 200, 210, 210)]:
+        assert np.array_equal(np.asarray(reader.crop(box)), np.asarray(pil.crop(box)))
+    stride = reader.stride_for(32)
+    assert np.array_equal(np.asarray(reader.thumbnail(32)), _RASTER[::stride, ::stride])
+
+
+@pytest.mark.parametrize("name, mode", [
+    ("big.png", "RGB"), ("big_lzw.tif", "RGB"), ("big.jpg", "RGB"), ("big_rgba.png", "RGBA"),
+    ("big_l.png", "L"), ("big_p.png", "P"), ("big_16.png", "I;16"), ("big_idat.png", "RGB"),
+    ("big_cmyk.jpg", "CMYK"),
+])
+def test_rasters_above_pil_pixel_limit(tmp_path, monkeypatch, name, mode):
+    path = str(tmp_path / name)
+    with monkeypatch.context() as m:
+        if "idat" in name:
+            m.setattr(ImageFile, "MAXBLOCK", 1)  # one IDAT chunk per 440 bytes
+        Image.fromarray(_RASTER).convert(mode).save(path, **({"compression": "tiff_lzw"} if "lzw" in name else {}))
+    expected = np.asarray(Image.open(path).convert("RGB"))
+    # stand-in for a multi-gigapixel raster: Pillow refuses anything above 2 * MAX_IMAGE_PIXELS;
+    # CMYK is decoded in memory and converted in 8-row bands, which stay under the limit
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 1000)
+    monkeypatch.setattr(io_utils, "_DECODE_BAND_ROWS", 8)
+    with pytest.raises(Image.DecompressionBombError):
+        Image.open(path)
+
+    reader = open_image(path, cache_dir=str(tmp_path / "cache"))
+    assert reader.size == image_size(path) == (110, 70)
+    assert np.array_equal(np.asarray(reader.crop((0, 0, 110, 70))), expected)
+    assert Image.MAX_IMAGE_PIXELS == 1000
+    assert len(os.listdir(tmp_path / "cache")) == 1  # no decode buffers left behind
+
+    monkeypatch.setattr(io_utils, "MAX_RASTER_PIXELS", 110 * 70 - 1)
+    with pytest.raises(RasterTooLargeError, match="RASTER_MAX_PIXELS"):
+        image_size(path)
+    with pytest.raises(RasterTooLargeError):
+        open_image(path, cache_dir=str(tmp_path / "cache2"))
+
+
+def test_raster_cache_evicts_least_recently_opened(tmp_path):
+    cache = tmp_path / "cache"
+    paths = []
+    for i in range(4):
+        paths.append(str(tmp_path / f"r{i}.png"))
+        Image.fromarray(np.roll(_RASTER, i, axis=0)).save(paths[-1])
+    entry_bytes = 110 * 70 * 4 + 128  # RGBX + .npy header
+    budget = int(entry_bytes * 2.5)
+    readers, files = [], []
+    for p in paths[:2]:
+        readers.append(open_image(p, cache_dir=str(cache), cache_bytes=budget))
+        files.append((set(cache.iterdir()) - set(files)).pop())
+    os.utime(files[0], (0, 0))  # r0 decoded long ago...
+    os.utime(files[1], (1000, 1000))
+    open_image(paths[0], cache_dir=str(cache), cache_bytes=budget)  # ...but reopened now
+    open_image(paths[2], cache_dir=str(cache), cache_bytes=budget)
+    assert files[0].exists() and not files[1].exists() and len(list(cache.iterdir())) == 2
+    # r1's decode was evicted, but its open reader still maps the data
+    assert np.array_equal(np.asarray(readers[1].crop((0, 0, 110, 70))), np.roll(_RASTER, 1, axis=0))
+    open_image(paths[3], cache_dir=str(cache), cache_bytes=1)  # a decode larger than the budget stays
+    assert len(list(cache.iterdir())) == 1
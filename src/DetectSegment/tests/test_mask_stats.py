@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+import torch
+
+from DetectSegment.utils.mask_stats import (
+    instance_areas_centroids, instance_records, mask_areas_centroids, summarize, summarize_segmentations,
+)
+
+
+def _masks(seed: int = 0, n: int = 6, h: int = 40, w: int = 50) -> np.ndarray:
+    masks = np.random.default_rng(seed).random((n, h, w)) < 0.3
+    masks[-1] = False  # empty instance
+    return masks
+
+
+def test_areas_centroids_match_loop():
+    masks = _masks()
+    areas, centroids = mask_areas_centroids(masks)
+    for mask, area, (cx, cy) in zip(masks, areas, centroids):
+        ys, xs = np.nonzero(mask)
+        assert area == mask.sum()
+        if area:
+            assert cx == pytest.approx(xs.mean()) and cy == pytest.approx(ys.mean())
+        else:
+            assert np.isnan(cx) and np.isnan(cy)
+    t_areas, t_centroids = mask_areas_centroids(torch.from_numpy(masks))
+    assert np.array_equal(t_areas, areas)
+    assert np.allclose(t_centroids, centroids, equal_nan=True)
+    assert mask_areas_centroids(torch.zeros((0, 4, 4), dtype=torch.bool))[0].shape == (0,)
+
+
+def test_cropped_instances_match_full_masks():
+    masks = _masks(1)
+    instances = []
+    for mask in masks[:-1]:
+        ys, xs = np.nonzero(mask)
+        x0, y0, x1, y1 = xs.min(), ys.min(), xs.max() + 1, ys.max() + 1
+        instances.append({"box": (x0, y0, x1, y1), "mask": mask[y0:y1, x0:x1]})
+    areas, centroids = instance_areas_centroids(instances)
+    full_areas, full_centroids = mask_areas_centroids(masks[:-1])
+    assert np.array_equal(areas, full_areas) and np.allclose(centroids, full_centroids)
+
+
+def test_summarize_counts_and_m2():
+    stats = summarize(["car", "person", "car"], [100, 50, 300], pixel_size_m=0.1, classes=["person", "car", "crane"])
+    assert list(stats["classes"]) == ["person", "car", "crane"]
+    assert stats["total_count"] == 3
+    assert stats["classes"]["car"] == {"count": 2, "area_px": 400, "area_m2": 4.0, "mean_area_m2": 2.0}
+    assert stats["classes"]["crane"]["count"] == 0 and stats["classes"]["crane"]["mean_area_m2"] is None
+    assert summarize(["car"], [10])["classes"]["car"]["area_m2"] is None
+
+    records = instance_records(*mask_areas_centroids(_masks()), pixel_size_m=0.5)
+    assert records[-1] == {"area_px": 0, "area_m2": 0.0, "centroid": None}
+    segs = [{"label": "x", **r} for r in records]
+    assert summarize_segmentations(segs)["classes"]["x"]["area_px"] == int(_masks().sum())
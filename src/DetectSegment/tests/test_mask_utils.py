@@ -0,0 +1,41 @@
+import numpy as np
+
+from DetectSegment.utils.mask_utils import decode_rle, encode_rle, encode_rle_cropped, rle_area
+
+
+def _random_masks(seed: int = 0, n: int = 50):
+    rng = np.random.default_rng(seed)
+    for _ in range(n):
+        h, w = rng.integers(1, 64, 2)
+        yield rng.random((h, w)) < rng.random()
+    yield np.zeros((8, 5), dtype=bool)
+    yield np.ones((8, 5), dtype=bool)
+
+
+def test_rle_roundtrip():
+    for mask in _random_masks():
+        for compress in (True, False):
+            rle = encode_rle(mask, compress=compress)
+            assert np.array_equal(decode_rle(rle), mask)
+            assert rle_area(rle) == int(mask.sum())
+
+
+def test_rle_matches_coco_layout():
+    # column-major runs starting with zeros, as in pycocotools
+    mask = np.array([[0, 1], [1, 1]], dtype=bool)
+    assert encode_rle(mask, compress=False)["counts"] == [1, 3]
+    assert encode_rle(np.ones((2, 2), dtype=bool), compress=False)["counts"] == [0, 4]
+
+
+def test_rle_cropped_equals_full():
+    full = np.zeros((30, 40), dtype=bool)
+    full[5:12, 10:25] = np.random.default_rng(1).random((7, 15)) < 0.5
+    crop = full[5:12, 10:25]
+    assert encode_rle_cropped(crop, (10, 5, 25, 12), (30, 40)) == encode_rle(full)
+
+
+if __name__ == "__main__":
+    test_rle_roundtrip()
+    test_rle_matches_coco_layout()
+    test_rle_cropped_equals_full()
+    print("OK")
@@ -0,0 +1,76 @@
+import threading
+
+import pytest
+
+from API.model_registry import ModelRegistry
+
+
+def _registry(release: threading.Event):
+    """Stub loaders: "fast" loads and warms up at once, "slow" blocks in its loader until `release`, "broken" raises."""
+    registry = ModelRegistry()
+    warmed = []
+    registry.register("fast", lambda: "fast-model", warmup=warmed.append)
+
+    def slow():
+        release.wait(5)
+        return "slow-model"
+
+    def broken():
+        raise RuntimeError("checkpoint missing")
+
+    registry.register("slow", slow)
+    registry.register("broken", broken)
+    return registry, warmed
+
+
+def test_lazy_load_warmup_and_errors():
+    release = threading.Event()
+    registry, warmed = _registry(release)
+    assert {name: st["state"] for name, st in registry.status().items()} == {
+        "fast": "pending", "slow": "pending", "broken": "pending"}
+
+    assert registry.get("fast") == "fast-model" and registry.get("fast") == "fast-model"
+    assert warmed == ["fast-model"]  # loaded and warmed up once
+    assert registry.status()["fast"]["load_time_s"] is not None
+    assert registry.status()["fast"]["warmup_time_s"] is not None
+
+    with pytest.raises(RuntimeError, match="checkpoint missing"):
+        registry.get("broken")
+    assert registry.status()["broken"]["state"] == "error"
+    assert registry.status()["broken"]["error"] == "RuntimeError: checkpoint missing"
+
+    thread = registry.start_warmup(["slow", "broken"])
+    while registry.status()["slow"]["state"] != "loading":
+        thread.join(0.01)
+    assert not registry.is_ready(["fast", "slow"])
+    release.set()
+    thread.join(5)
+    assert registry.is_ready(["fast", "slow"]) and not registry.is_ready()
+    assert registry.get("slow") == "slow-model"
+
+
+def test_readyz_reports_warmup_models(monkeypatch):
+    app = pytest.importorskip("API.app")
+    testclient = pytest.importorskip("fastapi.testclient")
+    release = threading.Event()
+    registry, _ = _registry(release)
+    monkeypatch.setattr(app, "registry", registry)
+    client = testclient.TestClient(app.app)
+
+    monkeypatch.setattr(app, "WARMUP_MODELS", ["fast", "slow"])
+    registry.get("fast")
+    response = client.get("/readyz")
+    assert response.status_code == 503
+    assert response.json()["ready"] is False
+    assert response.json()["models"]["slow"]["state"] == "pending"
+    release.set()
+    registry.get("slow")
+    response = client.get("/readyz")
+    assert response.status_code == 200 and response.json()["ready"] is True
+
+    monkeypatch.setattr(app, "WARMUP_MODELS", ["fast", "broken"])
+    registry.warmup(["broken"])  # failures are recorded, not raised
+    response = client.get("/readyz")
+    assert response.status_code == 503
+    assert response.json()["models"]["broken"] == {
+        "state": "error", "load_time_s": None, "warmup_time_s": None, "error": "RuntimeError: checkpoint missing"}
@@ -0,0 +1,90 @@
+import json
+import warnings
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+
+pytest.importorskip("onnx")
+pytest.importorskip("onnxruntime")
+
+from segment_anything import SamPredictor  # noqa: E402
+from segment_anything.build_sam import _build_sam  # noqa: E402
+from transformers import (  # noqa: E402
+    CLIPTokenizer,
+    OwlViTConfig,
+    OwlViTForObjectDetection,
+    OwlViTImageProcessor,
+    OwlViTProcessor,
+)
+
+from DetectSegment.models.detector import ZeroShotDetector  # noqa: E402
+from DetectSegment.models.onnx_backend import (  # noqa: E402
+    OrtSAMSegmenter,
+    OrtZeroShotDetector,
+    export_detector,
+    export_sam,
+)
+
+
+def _tiny_owlvit(path) -> str:
+    """Random two-layer OWL-ViT with a character-level tokenizer, saved like a hub checkpoint."""
+    path.mkdir()
+    chars = [chr(c) for c in range(ord("a"), ord("z") + 1)]
+    vocab = {t: i for i, t in enumerate(chars + [c + "</w>" for c in chars] + ["<|startoftext|>", "<|endoftext|>"])}
+    (path / "vocab.json").write_text(json.dumps(vocab))
+    (path / "merges.txt").write_text("#version: 0.2\n")
+    tokenizer = CLIPTokenizer(str(path / "vocab.json"), str(path / "merges.txt"), pad_token="<|endoftext|>")
+    image_processor = OwlViTImageProcessor(size={"height": 96, "width": 96}, crop_size={"height": 96, "width": 96})
+    OwlViTProcessor(image_processor=image_processor, tokenizer=tokenizer).save_pretrained(str(path))
+    layers = dict(hidden_size=32, intermediate_size=64, num_hidden_layers=2, num_attention_heads=2)
+    config = OwlViTConfig(
+        text_config=dict(vocab_size=len(vocab), max_position_embeddings=16, eos_token_id=vocab["<|endoftext|>"],
+                         bos_token_id=vocab["<|startoftext|>"], **layers),
+        vision_config=dict(image_size=96, patch_size=16, **layers),
+        projection_dim=32,
+    )
+    torch.manual_seed(0)
+    OwlViTForObjectDetection(config).save_pretrained(str(path))
+    return str(path)
+
+
+def _image(seed: int, size=(160, 120)) -> Image.Image:
+    return Image.fromarray((np.random.default_rng(seed).random((size[1], size[0], 3)) * 255).astype(np.uint8))
+
+
+def test_detector_parity(tmp_path):
+    model_dir = _tiny_owlvit(tmp_path / "owlvit")
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        export_detector(model_dir, str(tmp_path / "onnx"))
+    classes = ["truck", "crane", "worker"]
+    images = [_image(0), _image(1)]
+    ref = ZeroShotDetector(model_dir, device="cpu", confidence_threshold=0.1).predict_batch(images, classes)
+    out = OrtZeroShotDetector(str(tmp_path / "onnx"), confidence_threshold=0.1).predict_batch(images, classes)
+    assert [len(d) for d in out] == [len(d) for d in ref] and sum(len(d) for d in ref) > 0
+    for ref_dets, dets in zip(ref, out):
+        for r, d in zip(ref_dets, dets):
+            assert d["label"] == r["label"] and d["score"] == pytest.approx(r["score"], abs=1e-4)
+            assert all(abs(d["box"][k] - r["box"][k]) <= 1 for k in r["box"])
+
+
+def test_sam_parity(tmp_path):
+    torch.manual_seed(0)
+    sam = _build_sam(encoder_embed_dim=32, encoder_depth=1, encoder_num_heads=1, encoder_global_attn_indexes=[0])
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        export_sam(sam, "tiny", str(tmp_path))
+    image = np.array(_image(2, size=(200, 150)))
+    boxes = np.array([[10, 20, 120, 140], [0, 0, 199, 149], [50, 40, 90, 60]])
+
+    predictor = SamPredictor(sam)
+    predictor.set_image(image)
+    ort_sam = OrtSAMSegmenter(str(tmp_path), model_type="tiny", box_batch_size=2)
+    ort_sam.set_image(image)
+    assert torch.allclose(ort_sam._entry["features"], predictor.features, atol=1e-4)
+    for box, mask in zip(boxes, ort_sam._predict_boxes(boxes)):
+        ref, _, _ = predictor.predict(box=box, multimask_output=False)
+        # pixels sitting on the threshold may flip
+        assert (mask != ref[0]).mean() < 1e-3
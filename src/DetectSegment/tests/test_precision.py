@@ -0,0 +1,36 @@
+import warnings
+
+import pytest
+import torch
+from torch import nn
+
+from DetectSegment.utils.precision import autocast, prepare_model, resolve_precision
+
+
+def test_resolve_precision():
+    assert resolve_precision(None, "cpu") == "fp32"
+    assert resolve_precision("BF16", "cuda") == "bf16"
+    assert resolve_precision("int8", "cpu") == "int8"
+    with pytest.raises(ValueError):
+        resolve_precision("fp16", "cpu")
+    with pytest.raises(ValueError):
+        resolve_precision("int8", "cuda:0")
+
+
+def test_modes_stay_close_to_fp32():
+    torch.manual_seed(0)
+    model = nn.Sequential(nn.Linear(64, 128), nn.ReLU(), nn.Linear(128, 16)).eval()
+    x = torch.randn(8, 64)
+    with torch.no_grad():
+        ref = model(x)
+        with autocast("bf16", "cpu"):
+            bf16 = model(x)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            int8 = prepare_model(model, "int8")
+        quantized = int8(x)
+    assert bf16.dtype == torch.bfloat16
+    assert isinstance(int8[0], nn.Module) and not isinstance(int8[0], nn.Linear)
+    assert torch.allclose(bf16.float(), ref, atol=0.05)
+    assert torch.allclose(quantized, ref, atol=0.05)
+    assert prepare_model(model, "bf16") is model
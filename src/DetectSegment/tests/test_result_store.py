@@ -0,0 +1,43 @@
+import numpy as np
+import torch
+
+from DetectSegment.utils.embedding_cache import EmbeddingCache
+from DetectSegment.utils.result_store import ClassResultStore, compact_result, expand_result
+
+
+def _result(seed: int, n: int = 3):
+    masks = torch.from_numpy(np.random.default_rng(seed).random((n, 30, 40)) < 0.05)
+    masks[-1] = False
+    return {"scores": torch.rand(n), "boxes": torch.rand(n, 4), "masks": masks}
+
+
+def test_compact_roundtrip():
+    res = _result(0)
+    compact = compact_result(res, "car")
+    assert compact["size"] == (40, 30) and [i["label"] for i in compact["instances"]] == ["car"] * 3
+    back = expand_result(compact)
+    assert torch.equal(back["masks"], res["masks"]) and torch.equal(back["scores"], res["scores"])
+    empty = expand_result(compact_result({**res, "masks": res["masks"][:0]}, "car"))
+    assert empty["masks"].shape == (0, 30, 40)
+
+
+def test_store_only_misses_new_classes(tmp_path):
+    store = ClassResultStore(EmbeddingCache(disk_dir=str(tmp_path)))
+    params = {"score_threshold": 0.6, "mask_threshold": 0.5}
+    for i, name in enumerate(["car", "crane"]):
+        store.put("img", name, _result(i), **params)
+
+    cached, missing = store.lookup("img", ["truck", "car", "crane"], **params)
+    assert sorted(cached) == ["car", "crane"] and missing == ["truck"]
+    assert store.missing("img", ["car", "truck"], **params) == ["truck"]
+    assert store.lookup("img", ["car"], score_threshold=0.7, mask_threshold=0.5)[1] == ["car"]
+    assert store.lookup(None, ["car"], **params)[1] == ["car"]
+
+    merged = list(store.merge(["truck", "car", "crane"], cached, [("truck", _result(5))]))
+    assert [(name, from_cache) for name, _, from_cache in merged] == [("truck", False), ("car", True), ("crane", True)]
+    assert torch.equal(expand_result(merged[1][1])["masks"], _result(0)["masks"])
+
+    # disk tier: a fresh process finds the same entries
+    restarted = ClassResultStore(EmbeddingCache(disk_dir=str(tmp_path)))
+    assert restarted.lookup("img", ["car", "crane"], **params)[1] == []
+
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+import torch
+
+pytest.importorskip("segment_anything")
+from segment_anything import SamPredictor  # noqa: E402
+from segment_anything.build_sam import _build_sam  # noqa: E402
+
+from DetectSegment.models import sam_segmenter  # noqa: E402
+from DetectSegment.models.sam_segmenter import SAMSegmenter  # noqa: E402
+
+
+def _segmenter(monkeypatch, precision: str) -> SAMSegmenter:
+    torch.manual_seed(0)
+    sam = _build_sam(encoder_embed_dim=32, encoder_depth=1, encoder_num_heads=1, encoder_global_attn_indexes=[0])
+    monkeypatch.setattr(sam_segmenter, "sam_model_registry", {"tiny": lambda checkpoint: sam})
+    return SAMSegmenter(None, model_type="tiny", device="cpu", box_batch_size=2, precision=precision)
+
+
+def test_batched_boxes_match_predictor(monkeypatch):
+    seg = _segmenter(monkeypatch, "fp32")
+    image = (np.random.default_rng(0).random((150, 200, 3)) * 255).astype(np.uint8)
+    boxes = np.array([[10, 20, 120, 140], [0, 0, 199, 149], [50, 40, 90, 60]])
+    seg.set_image(image)
+    predictor = SamPredictor(seg.sam)
+    predictor.set_image(image)
+    for box, mask in zip(boxes, seg._predict_boxes(boxes)):
+        ref, _, _ = predictor.predict(box=box, multimask_output=False)
+        # pixels sitting on the threshold may flip
+        assert (mask != ref[0]).mean() < 1e-3
+
+
+def test_predict_boxes_does_not_leak_grad_or_autocast(monkeypatch):
+    seg = _segmenter(monkeypatch, "bf16")
+    seg.set_image(np.zeros((64, 80, 3), dtype=np.uint8))
+    boxes = np.array([[0, 0, 40, 30], [10, 10, 70, 60], [5, 5, 20, 20]])
+    with torch.enable_grad():
+        masks = seg._predict_boxes(boxes)
+        assert next(masks).shape == (64, 80)
+        # suspended mid-chunk: the caller's grad mode and autocast state are its own
+        assert torch.is_grad_enabled() and not torch.is_autocast_enabled("cpu")
+        masks.close()
+    assert len(list(seg._predict_boxes(boxes))) == 3
@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+
+from DetectSegment.models.sam3_segmenter import Sam3Segmenter
+from DetectSegment.utils.io_utils import ImageReader
+from DetectSegment.utils.tiling import InstanceMerger, paste_mask, subsample_instances, tile_boxes
+
+
+def test_subsample_instances_matches_strided_mask():
+    rng = np.random.default_rng(1)
+    for stride in (1, 2, 3, 5):
+        for _ in range(30):
+            x0, y0 = (int(v) for v in rng.integers(0, 40, 2))
+            w, h = (int(v) for v in rng.integers(1, 20, 2))
+            inst = {"box": (x0, y0, x0 + w, y0 + h), "mask": rng.random((h, w)) < 0.5}
+            expected = paste_mask(inst, 64, 64)[::stride, ::stride]
+            sub = subsample_instances([inst], stride)
+            got = paste_mask(sub[0], *expected.shape[::-1]) if sub else np.zeros_like(expected)
+            assert np.array_equal(got, expected)
+
+
+def test_merger_stitches_objects_longer_than_overlap():
+    width, height, tile, overlap = 2000, 60, 1024, 128
+    full = np.zeros((height, width), dtype=bool)
+    full[0:50, 600:1400] = True  # truck crossing the x=896..1024 band, much longer than it
+    full[5:15, 1700:1720] = True  # separate car
+    merger = InstanceMerger()
+    for x0, y0, x1, y1 in tile_boxes(width, height, tile, overlap):
+        crop = full[y0:y1, x0:x1]
+        for sl in (np.s_[:, :1600 - x0], np.s_[:, max(0, 1600 - x0):]):
+            part = np.zeros_like(crop)
+            part[sl] = crop[sl]
+            merger.add(part, "truck", 0.9, (x0, y0))
+    merged = merger.merge()
+    assert sorted(inst["box"] for inst in merged) == [(600, 0, 1400, 50), (1700, 5, 1720, 15)]
+    assert np.array_equal(np.logical_or.reduce([paste_mask(i, width, height) for i in merged]), full)
+
+
+class ColorSegmenter(Sam3Segmenter):
+    """Model-free stand-in: "truck" is every red pixel of a tile, "car" every green one."""
+
+    channels = {"truck": 0, "car": 1}
+
+    def __init__(self) -> None:
+        self.batch_size = 1
+        self.tiles = []
+
+    def predict_for_classes(self, image, class_names, cache_key=None, **kwargs):
+        self.tiles.append(image.size)
+        pixels = np.asarray(image)
+        results = []
+        for name in class_names:
+            mask = torch.from_numpy(pixels[..., self.channels[name]] > 128)
+            masks = mask[None] if mask.any() else torch.zeros((0, *mask.shape), dtype=torch.bool)
+            results.append({"scores": torch.full((len(masks),), 0.9), "boxes": torch.zeros((len(masks), 4)),
+                            "masks": masks})
+        return results
+
+
+@pytest.mark.parametrize("as_reader", [False, True])
+def test_predict_for_classes_tiled_merges_and_pastes(as_reader):
+    width, height = 2000, 60
+    pixels = np.zeros((height, width, 3), dtype=np.uint8)
+    pixels[0:50, 600:1400, 0] = 255  # truck in all three tiles, clipped by the first one
+    pixels[5:15, 1700:1720, 1] = 255  # car duplicated in the last two tiles
+    image = ImageReader(pixels) if as_reader else Image.fromarray(pixels)
+    model = ColorSegmenter()
+
+    truck, car = model.predict_for_classes_tiled(image, ["truck", "car"], tile_size=1024, overlap=128)
+    assert model.tiles == [(1024, 60)] * 3
+    for res, box, channel in ((truck, [600, 0, 1400, 50], 0), (car, [1700, 5, 1720, 15], 1)):
+        assert res["masks"].shape == (1, height, width)
+        assert res["boxes"].tolist() == [box]
+        assert torch.equal(res["masks"][0], torch.from_numpy(pixels[..., channel] > 128))
+
+    truck, car = model.predict_for_classes_tiled(image, ["truck", "car"], tile_size=1024, overlap=128,
+                                                 paste_masks=False)
+    assert truck["size"] == (width, height) and "masks" not in truck
+    assert [i["box"] for i in truck["instances"] + car["instances"]] == [(600, 0, 1400, 50), (1700, 5, 1720, 15)]
@@ -1,5 +1,238 @@
+"""
+Process-wide inference runtime: device, torch thread pools, CPU affinity, autograd and
+memory format. Configure once at startup, before the models load:
+
+    report = apply_runtime(RuntimeConfig.from_env())  # or runtime_config_from_args(args)
+    logger.info("Runtime: %s", format_runtime(report))
+
+Environment variables (CLI flags of `add_runtime_args` override them):
+
+- DEVICE (--device): "auto" (cuda when available), "cpu", "cuda", "cuda:1"
+- TORCH_THREADS (--threads): intra-op threads; default: the cores this process may use
+- TORCH_INTEROP_THREADS (--interop_threads): inter-op threads; default 1 (the models run
+  one op graph at a time, extra inter-op threads only compete for cores)
+- CPU_AFFINITY (--cpu_affinity): cores this process runs on, e.g. "0-7,16-23"; "auto"
+  gives every one of WORKERS processes an even, disjoint slice (the WORKER_INDEX-th)
+- WORKERS / WORKER_INDEX (--workers / --worker_index): processes sharing the machine;
+  with WORKERS > 1 and no CPU_AFFINITY, "auto" applies
+- NO_GRAD: "1" (default) disables autograd: grad mode off in the configuring thread and
+  frozen parameters in every model (`prepare_module`), so forwards from any thread skip it
+- CHANNELS_LAST (--channels_last): "auto" (CPU models with convolutions), "on", "off"
+"""
+from dataclasses import asdict, dataclass, replace
+from typing import Any, Dict, List, Mapping, Optional, Sequence
+import argparse
+import os
+
 import torch
+from torch import nn
+
+CHANNELS_LAST_MODES = ("auto", "on", "off")
+
+
+def parse_cpu_list(spec: str) -> List[int]:
+    """"0-3,8,10-11" -> [0, 1, 2, 3, 8, 10, 11]."""
+    cpus = set()
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        lo, _, hi = part.partition("-")
+        cpus.update(range(int(lo), int(hi or lo) + 1))
+    if not cpus:
+        raise ValueError(f"Empty CPU list {spec!r}")
+    return sorted(cpus)
+
+
+def format_cpu_list(cpus: Sequence[int]) -> str:
+    """Inverse of `parse_cpu_list` (ranges collapsed)."""
+    parts, cpus = [], sorted(cpus)
+    start = prev = None
+    for cpu in cpus + [None]:
+        if start is not None and cpu != prev + 1:
+            parts.append(str(start) if start == prev else f"{start}-{prev}")
+            start = None
+        if start is None:
+            start = cpu
+        prev = cpu
+    return ",".join(parts)
+
+
+def available_cpus() -> List[int]:
+    """Cores this process may run on (its current affinity mask)."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def _flag(value: str) -> bool:
+    return value.strip().lower() not in ("0", "false", "no", "off", "")
+
+
+@dataclass
+class RuntimeConfig:
+    device: str = "auto"
+    threads: Optional[int] = None
+    interop_threads: Optional[int] = None
+    cpu_affinity: Optional[str] = None
+    workers: int = 1
+    worker_index: int = 0
+    no_grad: bool = True
+    channels_last: str = "auto"
+
+    @classmethod
+    def from_env(cls, environ: Optional[Mapping[str, str]] = None) -> "RuntimeConfig":
+        env = os.environ if environ is None else environ
+        return cls(
+            device=env.get("DEVICE") or "auto",
+            threads=int(env.get("TORCH_THREADS") or 0) or None,
+            interop_threads=int(env.get("TORCH_INTEROP_THREADS") or 0) or None,
+            cpu_affinity=env.get("CPU_AFFINITY") or None,
+            workers=int(env.get("WORKERS") or 1),
+            worker_index=int(env.get("WORKER_INDEX") or 0),
+            no_grad=_flag(env.get("NO_GRAD", "1")),
+            channels_last=(env.get("CHANNELS_LAST") or "auto").lower(),
+        )
+
+    def worker_cpus(self, cpus: Optional[Sequence[int]] = None) -> Optional[List[int]]:
+        """Cores to pin this process to (None: leave the affinity alone)."""
+        cpus = list(cpus) if cpus is not None else available_cpus()
+        spec = self.cpu_affinity or ("auto" if self.workers > 1 else None)
+        if spec is None:
+            return None
+        if spec != "auto":
+            return parse_cpu_list(spec)
+        workers = max(1, self.workers)
+        if not 0 <= self.worker_index < workers:
+            raise ValueError(f"worker_index {self.worker_index} outside 0..{workers - 1}")
+        if workers > len(cpus):
+            # more workers than cores: share cores round-robin rather than leaving some idle
+            return [cpus[self.worker_index % len(cpus)]]
+        return cpus[self.worker_index * len(cpus) // workers:(self.worker_index + 1) * len(cpus) // workers]
+
+
+# Settings of the last `apply_runtime` call; defaults until then
+_active = RuntimeConfig()
+_applied = False
+
+
+def resolve_device(device: Optional[str] = None) -> str:
+    device = device or "auto"
+    if device == "auto":
+        return "cuda" if torch.cuda.is_available() else "cpu"
+    if device.startswith("cuda") and not torch.cuda.is_available():
+        raise ValueError(f"Device {device!r} requested but CUDA is not available")
+    return device
 
 
 def get_default_device() -> str:
-    return "cuda" if torch.cuda.is_available() else "cpu"
+    """Device of the applied runtime config ("auto": cuda when available, else cpu)."""
+    return resolve_device(_active.device)
+
+
+def runtime_threads() -> Optional[int]:
+    """Intra-op thread count set by `apply_runtime` (None before it ran), e.g. for ONNX Runtime sessions."""
+    return _active.threads if _applied else None
+
+
+def apply_runtime(config: RuntimeConfig) -> Dict[str, Any]:
+    """
+    Apply `config` to this process: CPU affinity, torch intra/inter-op threads (and the
+    OMP / MKL variables for libraries initialized later), grad mode. Call before the
+    models load; returns the effective settings.
+    """
+    global _active, _applied
+    if config.channels_last not in CHANNELS_LAST_MODES:
+        raise ValueError(f"channels_last must be one of {', '.join(CHANNELS_LAST_MODES)}")
+    device = resolve_device(config.device)
+    cpus = config.worker_cpus()
+    if cpus is not None and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+    cpus = available_cpus()
+
+    threads = config.threads or len(cpus)
+    torch.set_num_threads(threads)
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ[var] = str(threads)
+    interop = config.interop_threads or 1
+    if torch.get_num_interop_threads() != interop:
+        try:
+            torch.set_num_interop_threads(interop)
+        except RuntimeError:
+            # only settable before the first inter-op parallel work in this process
+            pass
+    torch.set_grad_enabled(not config.no_grad)
+
+    _active = replace(config, device=device, threads=threads, interop_threads=torch.get_num_interop_threads())
+    _applied = True
+    return describe_runtime()
+
+
+def describe_runtime() -> Dict[str, Any]:
+    """Effective runtime settings of this process (for startup logs and status endpoints)."""
+    report = asdict(_active)
+    report.update({
+        "device": get_default_device(),
+        "threads": torch.get_num_threads(),
+        "interop_threads": torch.get_num_interop_threads(),
+        "cpu_affinity": format_cpu_list(available_cpus()),
+        "pid": os.getpid(),
+        "torch": torch.__version__,
+        "mkldnn": torch.backends.mkldnn.is_available(),
+    })
+    if report["device"].startswith("cuda"):
+        report["cuda_device"] = torch.cuda.get_device_name(torch.device(report["device"]))
+    return report
+
+
+def format_runtime(report: Dict[str, Any]) -> str:
+    return ", ".join(f"{k}={v}" for k, v in report.items())
+
+
+def prepare_module(module: nn.Module, device: Optional[str] = None) -> nn.Module:
+    """
+    Per-model part of the runtime config: parameters frozen under `no_grad` (no autograd
+    graph from any thread), channels-last weights where they pay off (see `use_channels_last`).
+    """
+    if _active.no_grad:
+        module.requires_grad_(False)
+    if use_channels_last(module, device or get_default_device()):
+        module.to(memory_format=torch.channels_last)
+    return module
+
+
+def use_channels_last(module: nn.Module, device: str) -> bool:
+    """
+    "on": any model with 2-D convolutions. "auto": only on CPU, where oneDNN convolutions
+    avoid reorders in NHWC; CUDA kernels only gain under reduced precision, so stay NCHW there.
+    """
+    if _active.channels_last == "off":
+        return False
+    if not any(isinstance(m, nn.Conv2d) for m in module.modules()):
+        return False
+    return _active.channels_last == "on" or str(device).startswith("cpu")
+
+
+def add_runtime_args(p: argparse.ArgumentParser) -> None:
+    """CLI flags for `runtime_config_from_args`; unset flags fall back to the environment."""
+    g = p.add_argument_group("runtime")
+    g.add_argument("--device", default=None, help="auto (default), cpu, cuda, cuda:N  [DEVICE]")
+    g.add_argument("--threads", type=int, default=None,
+                   help="Torch intra-op threads (default: cores available to this process)  [TORCH_THREADS]")
+    g.add_argument("--interop_threads", type=int, default=None, help="Torch inter-op threads (default 1)")
+    g.add_argument("--cpu_affinity", default=None,
+                   help='Cores to run on, e.g. "0-7"; "auto": this worker\'s slice of the cores  [CPU_AFFINITY]')
+    g.add_argument("--workers", type=int, default=None, help="Processes sharing this machine  [WORKERS]")
+    g.add_argument("--worker_index", type=int, default=None, help="This process' index among them  [WORKER_INDEX]")
+    g.add_argument("--channels_last", default=None, choices=CHANNELS_LAST_MODES,
+                   help="Channels-last conv weights: auto (CPU), on, off  [CHANNELS_LAST]")
+
+
+def runtime_config_from_args(args: argparse.Namespace, environ: Optional[Mapping[str, str]] = None) -> RuntimeConfig:
+    config = RuntimeConfig.from_env(environ)
+    overrides = {
+        name: getattr(args, name)
+        for name in ("device", "threads", "interop_threads", "cpu_affinity", "workers", "worker_index", "channels_last")
+        if getattr(args, name, None) is not None
+    }
+    return replace(config, **overrides)
@@ -0,0 +1,228 @@
+from typing import Any, Dict, List, Optional, Tuple
+from collections import OrderedDict
+from pathlib import Path
+import dataclasses
+import hashlib
+import logging
+import os
+import threading
+
+import numpy as np
+import torch
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+
+def hash_image_bytes(data: bytes) -> str:
+    """Content address of an encoded image (e.g. the uploaded file bytes)."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(path: str, chunk_size: int = 1 << 20) -> str:
+    """`hash_image_bytes` of a file's contents, read in chunks (for rasters too large to load)."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def hash_image(image: Image.Image) -> str:
+    """Content address of a decoded PIL image (mode + size + pixels)."""
+    h = hashlib.sha256()
+    h.update(f"{image.mode}:{image.size}".encode())
+    h.update(image.tobytes())
+    return h.hexdigest()
+
+
+def estimate_nbytes(value: Any) -> int:
+    """Approximate memory held by tensors/arrays inside a (nested) cache value."""
+    if isinstance(value, torch.Tensor):
+        return value.element_size() * value.nelement()
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(estimate_nbytes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(estimate_nbytes(v) for v in value)
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return sum(estimate_nbytes(getattr(value, f.name)) for f in dataclasses.fields(value))
+    return 0
+
+
+class EmbeddingCache:
+    """
+    Two-tier cache for image embeddings keyed by image content hash.
+
+    - memory tier: LRU bounded by `max_bytes` (sum of tensor/array sizes)
+    - disk tier (optional): one `torch.save` file per key under `disk_dir`,
+      written on `put` and read back on a memory miss, so entries survive restarts;
+      bounded by `max_disk_bytes` (file sizes), least recently written / read files first out
+
+    Several processes may share `disk_dir`: writes are atomic (unique temp file + rename)
+    and each process rescans the directory before evicting, so the budget holds up to the
+    writes other processes made since their last scan.
+    Values are returned as stored; callers move tensors to their device.
+    """
+
+    def __init__(self, max_bytes: int = 1 << 30, disk_dir: Optional[str] = None,
+                 max_disk_bytes: int = 10 << 30) -> None:
+        self.max_bytes = max_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self._disk_bytes = 0
+        if self.disk_dir is not None:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+            self._disk_bytes = sum(size for _, _, size in self._disk_files())
+        self._entries: "OrderedDict[str, Any]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_hits = 0
+        self.disk_writes = 0
+        self.disk_evictions = 0
+
+    def _disk_path(self, key: str) -> Path:
+        return self.disk_dir / f"{hashlib.sha256(key.encode()).hexdigest()}.pt"
+
+    def _disk_files(self) -> List[Tuple[float, str, int]]:
+        """(mtime, path, size) of the disk tier's entries."""
+        files = []
+        with os.scandir(self.disk_dir) as it:
+            for entry in it:
+                if not entry.name.endswith(".pt"):
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue  # evicted by another process
+                files.append((st.st_mtime, entry.path, st.st_size))
+        return files
+
+    def _evict_disk(self) -> None:
+        # caller holds the lock; shrink to 90% of the budget so eviction scans stay rare
+        files = sorted(self._disk_files())
+        total = sum(size for _, _, size in files)
+        target = int(self.max_disk_bytes * 0.9)
+        for _, path, size in files:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                self.disk_evictions += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._disk_bytes = total
+
+    def _write_disk(self, key: str, value: Any) -> None:
+        path = self._disk_path(key)
+        tmp = path.with_suffix(f".tmp{os.getpid()}.{threading.get_ident()}")
+        try:
+            torch.save(value, str(tmp))
+            size = tmp.stat().st_size
+            with self._lock:
+                # a rewritten key replaces its old file: count only the difference
+                try:
+                    size -= path.stat().st_size
+                except FileNotFoundError:
+                    pass
+                os.replace(tmp, path)
+                self.disk_writes += 1
+                self._disk_bytes += size
+        except OSError:
+            # e.g. disk full: the entry stays memory-only
+            logger.warning("embedding cache disk write failed", exc_info=True)
+            tmp.unlink(missing_ok=True)
+            return
+        with self._lock:
+            if self._disk_bytes > self.max_disk_bytes:
+                self._evict_disk()
+
+    def _insert(self, key: str, value: Any) -> None:
+        # caller holds the lock
+        size = estimate_nbytes(value)
+        if key in self._entries:
+            self._bytes -= self._sizes.pop(key)
+            del self._entries[key]
+        if size > self.max_bytes:
+            return
+        self._entries[key] = value
+        self._sizes[key] = size
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            old_key, _ = self._entries.popitem(last=False)
+            self._bytes -= self._sizes.pop(old_key)
+            self.evictions += 1
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+
+        if self.disk_dir is not None:
+            path = self._disk_path(key)
+            if path.exists():
+                try:
+                    # Trusted local cache written by `put`; values are model output dataclasses
+                    value = torch.load(str(path), map_location="cpu", weights_only=False)
+                except Exception:
+                    value = None
+                if value is not None:
+                    try:
+                        os.utime(path)  # recently used: evicted last
+                    except OSError:
+                        pass
+                    with self._lock:
+                        self.hits += 1
+                        self.disk_hits += 1
+                        self._insert(key, value)
+                    return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def contains(self, key: str) -> bool:
+        """Whether `get` would hit (memory or disk), without touching LRU order or counters."""
+        with self._lock:
+            if key in self._entries:
+                return True
+        return self.disk_dir is not None and self._disk_path(key).exists()
+
+    def put(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._insert(key, value)
+        if self.disk_dir is not None:
+            self._write_disk(key, value)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "disk_hits": self.disk_hits,
+                "disk_writes": self.disk_writes,
+                "disk_evictions": self.disk_evictions,
+                "disk_bytes": self._disk_bytes,
+                "max_disk_bytes": self.max_disk_bytes,
+                "disk_dir": str(self.disk_dir) if self.disk_dir else None,
+            }
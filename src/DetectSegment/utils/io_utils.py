@@ -1,7 +1,46 @@
-from typing import Any, Dict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import hashlib
 import json
+import math
+import mmap
+import os
+import struct
+import tempfile
 from pathlib import Path
-from PIL import Image
+
+import numpy as np
+from PIL import ExifTags, Image
+
+# Decoded copies of compressed rasters (see ImageReader); RASTER_CACHE_DIR overrides
+DEFAULT_RASTER_CACHE_DIR = os.environ.get("RASTER_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "raster_cache")
+
+# Byte budget of a raster cache directory, least recently opened decodes out first;
+# RASTER_CACHE_BYTES overrides
+DEFAULT_RASTER_CACHE_BYTES = int(os.environ.get("RASTER_CACHE_BYTES") or 20 << 30)
+
+# Rows converted per step when decoding into the raster cache
+_DECODE_BAND_ROWS = 256
+
+# Largest raster (width * height) `image_size` / `open_image` accept. These calls read local
+# files the pipeline or the API chose to treat as rasters, so a file Pillow's own
+# decompression-bomb guard refuses (above 2 * Image.MAX_IMAGE_PIXELS, ~179 MP) is opened past
+# it and checked against this limit instead. RASTER_MAX_PIXELS overrides
+MAX_RASTER_PIXELS = int(float(os.environ.get("RASTER_MAX_PIXELS") or 20e9))
+
+# Pillow modes decoded straight into a disk-backed buffer: mode -> (buffer mode, channels,
+# dtype). RGB images are stored 4 bytes per pixel by Pillow, so they decode into RGBX
+_MAPPED_DECODE_MODES = {
+    "RGB": ("RGBX", 4, np.uint8),
+    "RGBA": ("RGBA", 4, np.uint8),
+    "L": ("L", 1, np.uint8),
+    "P": ("P", 1, np.uint8),
+    "I;16": ("I;16", 1, np.uint16),
+}
+
+
+class RasterTooLargeError(ValueError):
+    """The raster exceeds MAX_RASTER_PIXELS."""
 
 
 def load_json(path: str) -> Dict[str, Any]:
@@ -22,3 +61,314 @@ def load_image(path: str) -> Image.Image:
 def save_image(path: str, image: Image.Image) -> None:
     Path(path).parent.mkdir(parents=True, exist_ok=True)
     image.save(path)
+
+
+def image_size(path: str) -> Tuple[int, int]:
+    """(width, height) from the file header, without decoding pixels."""
+    if str(path).lower().endswith(".npy"):
+        shape = np.load(path, mmap_mode="r").shape
+        return shape[1], shape[0]
+    with open_raster(path) as im:
+        return im.size
+
+
+def _open_past_pixel_limit(path: str) -> Image.Image:
+    """`Image.open` for this one file without Pillow's decompression-bomb check."""
+    with open(path, "rb") as f:
+        prefix = f.read(16)
+    for fmt in Image.ID:
+        factory, accept = Image.OPEN[fmt]
+        accepted = accept is None or accept(prefix)
+        if accepted and not isinstance(accepted, str):
+            try:
+                return factory(path)
+            except (SyntaxError, IndexError, TypeError, struct.error):
+                continue
+    raise Image.UnidentifiedImageError(f"cannot identify image file {path!r}")
+
+
+@contextmanager
+def open_raster(path: str, max_pixels: Optional[int] = None) -> Iterator[Image.Image]:
+    """
+    `Image.open` (header only, nothing decoded) limited by `max_pixels` (default
+    MAX_RASTER_PIXELS) instead of Image.MAX_IMAGE_PIXELS: larger rasters raise
+    RasterTooLargeError.
+    """
+    try:
+        im = Image.open(path)
+    except Image.DecompressionBombError:
+        im = _open_past_pixel_limit(path)
+    with im:
+        limit = MAX_RASTER_PIXELS if max_pixels is None else max_pixels
+        width, height = im.size
+        if width * height > limit:
+            raise RasterTooLargeError(
+                f"{path}: {width}x{height} = {width * height / 1e6:.0f} MP exceeds the "
+                f"{limit / 1e6:.0f} MP raster limit (RASTER_MAX_PIXELS)")
+        yield im
+
+
+def sidecar_pixel_size(path: str) -> Optional[float]:
+    """Ground sample distance (m/px) from a Geoportal.wms `.json` sidecar next to `path`, if any."""
+    sidecar = Path(path).with_suffix(".json")
+    if not sidecar.is_file():
+        return None
+    try:
+        meta = load_json(str(sidecar))
+    except (OSError, ValueError):
+        return None
+    pixel_size = meta.get("pixel_size") if isinstance(meta, dict) else None
+    return float(pixel_size) if pixel_size else None
+
+
+class ImageReader:
+    """
+    Lazily opened RGB raster backed by an (H, W, 3) uint8 array, usually a read-only memmap,
+    so only the regions that are read are paged in.
+
+    Supports the subset of PIL.Image used by tiled inference (`size`, `width`, `height`,
+    `crop`), so it can be passed to tiling.iter_tiles and the tiled segmenters as is.
+    `thumbnail` subsamples with an integer stride; masks subsampled with the same
+    stride (`mask[::s, ::s]`, tiling.subsample_instances) line up with it exactly.
+    """
+
+    mode = "RGB"
+
+    def __init__(self, array: np.ndarray, path: Optional[str] = None, backend: str = "memory") -> None:
+        if array.ndim != 3 or array.shape[2] != 3 or array.dtype != np.uint8:
+            raise ValueError(f"Expected an (H, W, 3) uint8 raster, got {array.shape} {array.dtype}")
+        self.array = array
+        self.path = path
+        self.backend = backend
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        return self.array.shape[1], self.array.shape[0]
+
+    @property
+    def width(self) -> int:
+        return self.array.shape[1]
+
+    @property
+    def height(self) -> int:
+        return self.array.shape[0]
+
+    def read_region(self, box: Tuple[int, int, int, int]) -> np.ndarray:
+        """(y1 - y0, x1 - x0, 3) copy of `box` = (x0, y0, x1, y1); like PIL.crop, area outside the image is black."""
+        x0, y0, x1, y1 = (int(v) for v in box)
+        sx0, sy0 = max(x0, 0), max(y0, 0)
+        sx1, sy1 = min(x1, self.width), min(y1, self.height)
+        if (sx0, sy0, sx1, sy1) == (x0, y0, x1, y1):
+            return np.array(self.array[y0:y1, x0:x1])
+        out = np.zeros((max(0, y1 - y0), max(0, x1 - x0), 3), dtype=np.uint8)
+        if sx1 > sx0 and sy1 > sy0:
+            out[sy0 - y0:sy1 - y0, sx0 - x0:sx1 - x0] = self.array[sy0:sy1, sx0:sx1]
+        return out
+
+    def crop(self, box: Tuple[int, int, int, int]) -> Image.Image:
+        return Image.fromarray(self.read_region(box))
+
+    def stride_for(self, max_side: int, box: Optional[Tuple[int, int, int, int]] = None) -> int:
+        """Smallest integer stride that brings `box` (default: whole image) within `max_side`."""
+        x0, y0, x1, y1 = box or (0, 0, self.width, self.height)
+        return max(1, math.ceil(max(x1 - x0, y1 - y0) / max(1, max_side)))
+
+    def thumbnail(self, max_side: int, box: Optional[Tuple[int, int, int, int]] = None) -> Image.Image:
+        """Nearest-neighbour preview of `box` (default: whole image), every `stride_for(max_side)`-th pixel."""
+        x0, y0, x1, y1 = box or (0, 0, self.width, self.height)
+        x0, y0 = max(0, int(x0)), max(0, int(y0))
+        x1, y1 = min(self.width, int(x1)), min(self.height, int(y1))
+        s = self.stride_for(max_side, (x0, y0, x1, y1))
+        return Image.fromarray(np.ascontiguousarray(self.array[y0:y1:s, x0:x1:s]))
+
+    def to_pil(self) -> Image.Image:
+        """The whole raster as a PIL image (materializes it)."""
+        return Image.fromarray(np.array(self.array))
+
+
+def _raw_tiff_memmap(path: str) -> Optional[np.ndarray]:
+    """Direct memmap of an uncompressed RGB TIFF whose strips are full-width and contiguous."""
+    with open_raster(path) as im:
+        if im.format != "TIFF" or im.mode != "RGB" or not im.tile:
+            return None
+        width, height = im.size
+        row_bytes = width * 3
+        tiles = sorted(im.tile, key=lambda t: t.extents[1])
+        expected_offset, expected_row = tiles[0].offset, 0
+        for t in tiles:
+            ex0, ey0, ex1, ey1 = t.extents
+            rawmode, stride = t.args[0], t.args[1] if len(t.args) > 1 else 0
+            if (t.codec_name != "raw" or rawmode != "RGB" or stride not in (0, row_bytes)
+                    or (ex0, ex1) != (0, width) or ey0 != expected_row or t.offset != expected_offset):
+                return None
+            expected_row = ey1
+            expected_offset += (ey1 - ey0) * row_bytes
+        if expected_row != height:
+            return None
+        offset = tiles[0].offset
+    return np.memmap(path, dtype=np.uint8, mode="r", offset=offset, shape=(height, width, 3))
+
+
+def _png_idat_spans(data: memoryview) -> List[Tuple[int, int]]:
+    """(offset, length) of each IDAT chunk of a PNG: its zlib stream, split across chunks."""
+    spans, pos = [], 8
+    while pos + 8 <= len(data):
+        length, kind = struct.unpack(">I4s", data[pos:pos + 8])
+        if kind == b"IDAT":
+            spans.append((pos + 8, length))
+        elif kind == b"IEND" or spans:
+            break  # IDAT chunks are consecutive
+        pos += 12 + length
+    return spans
+
+
+def _decode_mapped(im: Image.Image, path: str, buffer_path: str) -> Optional[np.ndarray]:
+    """
+    Decode `im` into a new (H, W[, C]) `.npy` at `buffer_path` instead of process memory:
+    each tile's decoder writes into a Pillow image wrapping the memory-mapped file
+    (`Image.frombuffer`) and reads the memory-mapped source, so decoded pixels are page
+    cache (written back to disk under pressure), not anonymous memory. Returns the writable
+    memmap, or None for modes and layouts this does not cover (partial-width tiles,
+    interlaced PNGs, rotated TIFFs).
+    """
+    if im.mode not in _MAPPED_DECODE_MODES or len(im.tile) == 0 or im.info.get("interlace"):
+        return None
+    if im.format == "TIFF" and im.getexif().get(ExifTags.Base.Orientation, 1) != 1:
+        return None  # Pillow applies the TIFF orientation while loading
+    width, height = im.size
+    if any((t.extents[0], t.extents[2]) != (0, width) for t in im.tile):
+        return None
+    if im.format == "PNG" and len(im.tile) != 1:
+        return None
+    mode, channels, dtype = _MAPPED_DECODE_MODES[im.mode]
+    shape = (height, width, channels) if channels > 1 else (height, width)
+    with open(path, "rb") as f:
+        data = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+    tiles = [(t.offset, t) for t in im.tile]
+    if im.format == "PNG":
+        # the "zip" decoder reads the bare zlib stream, which PNG splits across IDAT chunks
+        spans = _png_idat_spans(data)
+        if len(spans) > 1:
+            idat_path = f"{buffer_path}.idat"
+            try:
+                with open(idat_path, "w+b") as idat:
+                    for offset, length in spans:
+                        idat.write(data[offset:offset + length])
+                    idat.flush()
+                    data = memoryview(mmap.mmap(idat.fileno(), 0, access=mmap.ACCESS_READ))
+            finally:
+                os.remove(idat_path)  # stays mapped until decoded (POSIX)
+            tiles = [(0, im.tile[0])]
+    buffer = np.lib.format.open_memmap(buffer_path, mode="w+", dtype=dtype, shape=shape)
+    rows = buffer.reshape(height, -1)
+    for offset, t in tiles:
+        y0, y1 = t.extents[1], t.extents[3]
+        # the decoders unpack their raw mode into the target ("RGB" -> "RGBX" included)
+        target = Image.frombuffer(mode, (width, y1 - y0), rows[y0:y1], "raw", mode, 0, 1)
+        target.frombytes(data[offset:], t.codec_name, t.args)
+    return buffer
+
+
+def _evict_decoded(cache_dir: str, max_bytes: int, keep: str) -> None:
+    """Delete the least recently used decodes in `cache_dir` (never `keep`) until it fits `max_bytes`."""
+    files, total = [], 0
+    with os.scandir(cache_dir) as it:
+        for entry in it:
+            # finished decodes only ("<key>.npy"), not other processes' temp files
+            if not entry.name.endswith(".npy") or entry.name.count(".") != 1:
+                continue
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue  # evicted by another process
+            total += st.st_size
+            if entry.path != keep:
+                files.append((st.st_mtime, entry.path, st.st_size))
+    for _, cache_path, size in sorted(files):
+        if total <= max_bytes:
+            break
+        try:
+            # open ImageReaders keep their mapping (POSIX)
+            os.remove(cache_path)
+        except OSError:
+            continue
+        total -= size
+
+
+def _decode_to_cache(path: str, cache_dir: str, max_bytes: Optional[int] = None) -> str:
+    """
+    Decode `path` once into an uncompressed `.npy` under `cache_dir`; returns the cache file.
+    `cache_dir` is kept within `max_bytes` (default DEFAULT_RASTER_CACHE_BYTES).
+    """
+    st = os.stat(path)
+    key = hashlib.sha256(f"{os.path.abspath(path)}:{st.st_size}:{st.st_mtime_ns}".encode()).hexdigest()[:32]
+    cache_path = os.path.join(cache_dir, f"{key}.npy")
+    if os.path.exists(cache_path):
+        try:
+            os.utime(cache_path)  # recently used: evicted last
+        except OSError:
+            pass
+        return cache_path
+    Path(cache_dir).mkdir(parents=True, exist_ok=True)
+    tmp_path = f"{cache_path}.tmp{os.getpid()}.npy"
+    buffer_path = f"{cache_path}.decode{os.getpid()}.npy"
+    try:
+        with open_raster(path) as im:
+            width, height = im.size
+            rgb = im.mode == "RGB"
+            decoded = _decode_mapped(im, path, buffer_path)
+            if decoded is not None and rgb:
+                # the RGBX buffer is the cache (open_image drops the pad byte)
+                decoded.flush()
+                del decoded
+                os.replace(buffer_path, cache_path)
+            else:
+                out = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.uint8, shape=(height, width, 3))
+                # Row bands: only one converted band is in memory at a time. Other modes
+                # and layouts (CMYK, interlaced...) are decoded in memory first
+                for y in range(0, height, _DECODE_BAND_ROWS):
+                    y1 = min(height, y + _DECODE_BAND_ROWS)
+                    if decoded is not None:
+                        band = Image.fromarray(np.asarray(decoded[y:y1]))
+                        if im.mode == "P":
+                            band.putpalette(im.palette)
+                    else:
+                        band = im.crop((0, y, width, y1))
+                    out[y:y1] = np.asarray(band if band.mode == "RGB" else band.convert("RGB"))
+                out.flush()
+                del out, decoded
+                os.replace(tmp_path, cache_path)
+    finally:
+        for leftover in (tmp_path, buffer_path):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+    _evict_decoded(cache_dir, DEFAULT_RASTER_CACHE_BYTES if max_bytes is None else max_bytes, keep=cache_path)
+    return cache_path
+
+
+def _load_cached(cache_path: str) -> np.ndarray:
+    array = np.load(cache_path, mmap_mode="r")
+    return array[..., :3] if array.shape[2] == 4 else array
+
+
+def open_image(path: str, cache_dir: Optional[str] = None, cache_bytes: Optional[int] = None) -> ImageReader:
+    """
+    Open a raster lazily:
+    - `.npy` (H, W, 3) uint8, e.g. Geoportal.wms mosaics: memory-mapped directly
+    - uncompressed RGB TIFF with contiguous strips: memory-mapped directly
+    - anything else PIL can read (PNG, JPEG, compressed TIFF...): decoded once into an
+      uncompressed `.npy` under `cache_dir` (default RASTER_CACHE_DIR), then mapped; RGB, RGBA,
+      L, palette and 16-bit images decode straight into a memory-mapped file, so the decoded
+      raster never has to fit in RAM (RGB ones are cached as RGBX, 4 bytes per pixel). The cache is keyed
+      by path, size and mtime, so later opens skip decoding; it is kept within `cache_bytes`
+      (default RASTER_CACHE_BYTES) by deleting the least recently opened decodes
+    Rasters above MAX_RASTER_PIXELS raise RasterTooLargeError.
+    """
+    path = str(path)
+    if path.lower().endswith(".npy"):
+        return ImageReader(np.load(path, mmap_mode="r"), path, backend="npy")
+    array = _raw_tiff_memmap(path)
+    if array is not None:
+        return ImageReader(array, path, backend="tiff")
+    cache_path = _decode_to_cache(path, cache_dir or DEFAULT_RASTER_CACHE_DIR, cache_bytes)
+    return ImageReader(_load_cached(cache_path), path, backend="cache")
@@ -0,0 +1,115 @@
+"""
+Object counts and areas from segmentation masks.
+
+Per instance: pixel area and centroid (x, y in pixel indices). Per class: count and
+total / mean area. Areas are also reported in m² when the ground sample distance
+(`pixel_size_m`, metres per pixel, e.g. the `--pixel_size` of webscraping.py) is known.
+"""
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+
+
+def _from_projections(rows: np.ndarray, cols: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Areas and centroids from per-instance row sums (N, H) and column sums (N, W)."""
+    areas = rows.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cy = rows @ np.arange(rows.shape[1], dtype=np.float64) / areas
+        cx = cols @ np.arange(cols.shape[1], dtype=np.float64) / areas
+    return areas.astype(np.int64), np.stack([cx, cy], axis=1)
+
+
+def mask_areas_centroids(masks: Any) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (N,) pixel areas and (N, 2) centroids (x, y) of a (N, H, W) binary mask stack
+    (numpy or torch; torch masks are reduced on their device, only (N, H + W) sums are copied).
+    Empty masks get area 0 and a NaN centroid.
+    """
+    if isinstance(masks, torch.Tensor):
+        m = masks.bool()
+        if m.shape[0] == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, 2))
+        rows = m.sum(dim=2, dtype=torch.int64).cpu().numpy()
+        cols = m.sum(dim=1, dtype=torch.int64).cpu().numpy()
+    else:
+        m = np.asarray(masks, dtype=bool)
+        if m.shape[0] == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, 2))
+        rows = m.sum(axis=2, dtype=np.int64)
+        cols = m.sum(axis=1, dtype=np.int64)
+    return _from_projections(rows.astype(np.float64), cols.astype(np.float64))
+
+
+def instance_areas_centroids(instances: Sequence[Dict[str, Any]]) -> Tuple[np.ndarray, np.ndarray]:
+    """`mask_areas_centroids` for cropped instances ('box' = (x0, y0, x1, y1), 'mask' cropped to it)."""
+    areas = np.zeros(len(instances), dtype=np.int64)
+    centroids = np.full((len(instances), 2), np.nan)
+    for i, inst in enumerate(instances):
+        x0, y0 = inst["box"][0], inst["box"][1]
+        a, c = mask_areas_centroids(np.asarray(inst["mask"], dtype=bool)[None])
+        areas[i] = a[0]
+        centroids[i] = c[0] + (x0, y0)
+    return areas, centroids
+
+
+def instance_records(
+    areas: np.ndarray, centroids: np.ndarray, pixel_size_m: Optional[float] = None
+) -> List[Dict[str, Any]]:
+    """JSON-ready {"area_px", "area_m2", "centroid": [x, y]} per instance."""
+    m2 = pixel_size_m ** 2 if pixel_size_m else None
+    return [
+        {
+            "area_px": int(a),
+            "area_m2": round(float(a) * m2, 3) if m2 else None,
+            "centroid": None if np.isnan(c).any() else [round(float(c[0]), 1), round(float(c[1]), 1)],
+        }
+        for a, c in zip(areas, centroids)
+    ]
+
+
+def summarize(
+    labels: Sequence[str],
+    areas_px: Sequence[float],
+    pixel_size_m: Optional[float] = None,
+    classes: Optional[Sequence[str]] = None,
+) -> Dict[str, Any]:
+    """
+    Per-class counts and areas of the instances given by `labels` / `areas_px`.
+    `classes` fixes the order and keeps requested classes with no instances (count 0).
+    Returns {"pixel_size_m", "total_count", "classes": {name: {"count", "area_px",
+    "area_m2", "mean_area_m2"}}}; the m² fields are None without `pixel_size_m`.
+    """
+    names = list(dict.fromkeys([*(classes or []), *labels]))
+    index = {name: i for i, name in enumerate(names)}
+    idx = np.fromiter((index[label] for label in labels), dtype=np.int64, count=len(labels))
+    counts = np.bincount(idx, minlength=len(names))
+    areas = np.bincount(idx, weights=np.asarray(areas_px, dtype=np.float64), minlength=len(names))
+    m2 = pixel_size_m ** 2 if pixel_size_m else None
+    return {
+        "pixel_size_m": pixel_size_m,
+        "total_count": int(counts.sum()),
+        "classes": {
+            name: {
+                "count": int(counts[i]),
+                "area_px": int(areas[i]),
+                "area_m2": round(float(areas[i]) * m2, 3) if m2 else None,
+                "mean_area_m2": round(float(areas[i]) * m2 / int(counts[i]), 3) if m2 and counts[i] else None,
+            }
+            for i, name in enumerate(names)
+        },
+    }
+
+
+def summarize_segmentations(
+    segmentations: Sequence[Dict[str, Any]],
+    pixel_size_m: Optional[float] = None,
+    classes: Optional[Sequence[str]] = None,
+) -> Dict[str, Any]:
+    """`summarize` over segmentation records carrying "label" and "area_px" (see `instance_records`)."""
+    return summarize(
+        [seg.get("label") or "object" for seg in segmentations],
+        [seg["area_px"] for seg in segmentations],
+        pixel_size_m,
+        classes,
+    )
@@ -0,0 +1,117 @@
+from typing import Any, Dict, List, Union
+
+import numpy as np
+
+RLE = Dict[str, Any]  # {"size": [h, w], "counts": List[int] | str}
+
+
+def _rle_counts(mask: np.ndarray) -> np.ndarray:
+    """Run lengths of a binary mask in column-major order, starting with a run of zeros."""
+    flat = np.asarray(mask, dtype=bool).ravel(order="F")
+    if flat.size == 0:
+        return np.zeros(0, dtype=np.int64)
+    change = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    bounds = np.concatenate(([0], change, [flat.size]))
+    counts = np.diff(bounds)
+    if flat[0]:
+        counts = np.concatenate(([0], counts))
+    return counts
+
+
+def _counts_to_string(counts: List[int]) -> str:
+    """COCO compressed RLE string (LEB128-like, delta-coded against counts[i-2])."""
+    out = []
+    for i, x in enumerate(counts):
+        if i > 2:
+            x -= counts[i - 2]
+        more = True
+        while more:
+            c = x & 0x1F
+            x >>= 5
+            more = (x != -1) if (c & 0x10) else (x != 0)
+            if more:
+                c |= 0x20
+            out.append(chr(c + 48))
+    return "".join(out)
+
+
+def _string_to_counts(s: str) -> List[int]:
+    counts: List[int] = []
+    p = 0
+    while p < len(s):
+        x = 0
+        k = 0
+        more = True
+        while more:
+            c = ord(s[p]) - 48
+            x |= (c & 0x1F) << (5 * k)
+            more = bool(c & 0x20)
+            p += 1
+            k += 1
+            if not more and (c & 0x10):
+                x |= -1 << (5 * k)
+        if len(counts) > 2:
+            x += counts[-2]
+        counts.append(x)
+    return counts
+
+
+def encode_rle(mask: np.ndarray, compress: bool = True) -> RLE:
+    """
+    COCO-style run-length encoding of a (H, W) binary mask.
+    Args:
+        compress: emit the compact COCO string form (pycocotools compatible);
+            otherwise `counts` is a plain list of ints.
+    """
+    mask = np.asarray(mask)
+    h, w = mask.shape
+    counts = _rle_counts(mask).tolist()
+    return {"size": [int(h), int(w)], "counts": _counts_to_string(counts) if compress else counts}
+
+
+def encode_rle_cropped(crop: np.ndarray, box, size, compress: bool = True) -> RLE:
+    """
+    Whole-image RLE of a mask stored cropped to `box` = (x0, y0, x1, y1) (x1/y1 exclusive)
+    inside an image of `size` = (H, W), without materializing the full mask.
+    """
+    h, w = size
+    x0, y0, x1, y1 = box
+    column_band = np.zeros((h, x1 - x0), dtype=bool)
+    column_band[y0:y1] = crop
+    counts = _rle_counts(column_band).tolist()
+    # columns left of the crop are one leading run of zeros
+    counts[0] += x0 * h
+    # columns right of the crop extend (or start) a trailing run of zeros
+    tail = (w - x1) * h
+    if tail:
+        if len(counts) % 2 == 1:
+            counts[-1] += tail
+        else:
+            counts.append(tail)
+    return {"size": [int(h), int(w)], "counts": _counts_to_string(counts) if compress else counts}
+
+
+def encode_rles(masks: np.ndarray, compress: bool = True) -> List[RLE]:
+    """`encode_rle` for each mask of an [N, H, W] stack."""
+    return [encode_rle(m, compress=compress) for m in masks]
+
+
+def decode_rle(rle: RLE) -> np.ndarray:
+    """Decode a COCO RLE (string or list counts) back to a (H, W) boolean mask."""
+    h, w = rle["size"]
+    counts: Union[str, List[int]] = rle["counts"]
+    if isinstance(counts, (str, bytes)):
+        counts = _string_to_counts(counts.decode("ascii") if isinstance(counts, bytes) else counts)
+    counts = np.asarray(counts, dtype=np.int64)
+    if counts.sum() != h * w:
+        raise ValueError(f"RLE counts sum to {counts.sum()}, expected {h * w}")
+    values = (np.arange(counts.size) % 2).astype(bool)
+    return np.repeat(values, counts).reshape((w, h)).T
+
+
+def rle_area(rle: RLE) -> int:
+    """Foreground pixel count without decoding the mask."""
+    counts = rle["counts"]
+    if isinstance(counts, (str, bytes)):
+        counts = _string_to_counts(counts.decode("ascii") if isinstance(counts, bytes) else counts)
+    return int(sum(counts[1::2]))
@@ -0,0 +1,110 @@
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+import json
+
+import numpy as np
+import torch
+
+from .embedding_cache import EmbeddingCache
+from .tiling import crop_instances, paste_mask
+
+
+def compact_result(res: Dict[str, Any], label: str) -> Dict[str, Any]:
+    """
+    Storage form of one class result: 'scores' / 'boxes' as CPU tensors, masks as cropped
+    'instances' plus the image 'size' (width, height) - the same layout
+    Sam3Segmenter.predict_for_classes_tiled returns with `paste_masks=False`.
+    """
+    if "instances" in res:
+        return {
+            "scores": res["scores"].cpu(),
+            "boxes": res["boxes"].cpu(),
+            "instances": res["instances"],
+            "size": tuple(res["size"]),
+        }
+    masks = res["masks"].bool().cpu().numpy()
+    height, width = masks.shape[1:]
+    return {
+        "scores": res["scores"].cpu(),
+        "boxes": res["boxes"].cpu(),
+        "instances": crop_instances(masks, label, res["scores"].tolist()),
+        "size": (width, height),
+    }
+
+
+def expand_result(compact: Dict[str, Any]) -> Dict[str, Any]:
+    """`compact_result` back to {'scores', 'boxes', 'masks'} with bool [N, H, W] masks on the CPU."""
+    width, height = compact["size"]
+    instances = compact["instances"]
+    if instances:
+        masks = torch.from_numpy(np.stack([paste_mask(inst, width, height) for inst in instances]))
+    else:
+        masks = torch.zeros((0, height, width), dtype=torch.bool)
+    return {"scores": compact["scores"], "boxes": compact["boxes"], "masks": masks}
+
+
+class ClassResultStore:
+    """
+    Finished per-class segmentation results, keyed by image content hash, class name and
+    everything else that changes the masks (thresholds, tiling, model), so a follow-up
+    turn on the same image only segments the classes it has not seen yet.
+
+    Entries are kept in `compact_result` form (cropped masks: memory scales with object
+    area, not image size) in an EmbeddingCache, which bounds memory and can add a disk tier.
+    """
+
+    def __init__(self, cache: Optional[EmbeddingCache] = None) -> None:
+        self.cache = cache or EmbeddingCache()
+
+    @staticmethod
+    def key(image_key: str, class_name: str, **params: Any) -> str:
+        return f"{image_key}:{json.dumps(params, sort_keys=True, default=str)}:{class_name}"
+
+    def lookup(
+        self, image_key: Optional[str], class_names: Iterable[str], **params: Any
+    ) -> Tuple[Dict[str, Dict[str, Any]], List[str]]:
+        """(cached compact results by class, classes still to compute, in request order)."""
+        cached: Dict[str, Dict[str, Any]] = {}
+        missing: List[str] = []
+        for name in dict.fromkeys(class_names):
+            value = self.cache.get(self.key(image_key, name, **params)) if image_key else None
+            if value is None:
+                missing.append(name)
+            else:
+                cached[name] = value
+        return cached, missing
+
+    def missing(self, image_key: Optional[str], class_names: Iterable[str], **params: Any) -> List[str]:
+        """Classes `lookup` would have to compute; does not count as a lookup."""
+        names = list(dict.fromkeys(class_names))
+        if not image_key:
+            return names
+        return [name for name in names if not self.cache.contains(self.key(image_key, name, **params))]
+
+    def put(self, image_key: Optional[str], class_name: str, res: Dict[str, Any], **params: Any) -> Dict[str, Any]:
+        """Store `res` (full-size masks or cropped instances); returns its compact form."""
+        compact = compact_result(res, class_name)
+        if image_key:
+            self.cache.put(self.key(image_key, class_name, **params), compact)
+        return compact
+
+    def merge(
+        self,
+        class_names: List[str],
+        cached: Dict[str, Dict[str, Any]],
+        fresh: Iterable[Tuple[str, Dict[str, Any]]],
+    ) -> Iterator[Tuple[str, Dict[str, Any], bool]]:
+        """
+        Yield (class_name, result, from_cache) in `class_names` order: cached classes as
+        stored (compact form), the rest from `fresh`, which yields (class_name, result)
+        for the missing classes in that same order.
+        """
+        fresh = iter(fresh)
+        for name in dict.fromkeys(class_names):
+            if name in cached:
+                yield name, cached[name], True
+            else:
+                fresh_name, res = next(fresh)
+                yield fresh_name, res, False
+
+    def stats(self) -> Dict[str, Any]:
+        return self.cache.stats()
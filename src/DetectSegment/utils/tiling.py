@@ -0,0 +1,223 @@
+from typing import Any, Dict, Iterator, List, Tuple
+
+import numpy as np
+from PIL import Image
+
+
+Box = Tuple[int, int, int, int]  # (x0, y0, x1, y1), x1/y1 exclusive
+
+
+def _axis_starts(length: int, tile: int, stride: int) -> List[int]:
+    if length <= tile:
+        return [0]
+    starts = list(range(0, length - tile, stride))
+    # Last tile is aligned to the image edge so every tile has the full size
+    starts.append(length - tile)
+    return starts
+
+
+def tile_boxes(width: int, height: int, tile_size: int, overlap: int = 0) -> List[Box]:
+    """
+    Sliding-window tile boxes covering a (width, height) image.
+    Neighbouring tiles share `overlap` pixels; tiles never extend past the image.
+    """
+    if tile_size <= 0:
+        raise ValueError("tile_size must be positive")
+    if not 0 <= overlap < tile_size:
+        raise ValueError("overlap must be in [0, tile_size)")
+    stride = tile_size - overlap
+    boxes = []
+    for y0 in _axis_starts(height, tile_size, stride):
+        for x0 in _axis_starts(width, tile_size, stride):
+            boxes.append((x0, y0, min(x0 + tile_size, width), min(y0 + tile_size, height)))
+    return boxes
+
+
+def iter_tiles(image: Image.Image, tile_size: int, overlap: int = 0) -> Iterator[Tuple[Box, Image.Image]]:
+    """
+    Yield (box, tile image) one tile at a time, so only one crop is alive at once.
+    `image` may also be an io_utils.ImageReader: tiles are then read from disk on demand.
+    """
+    for box in tile_boxes(image.width, image.height, tile_size, overlap):
+        yield box, image.crop(box)
+
+
+def _crop_to_content(mask: np.ndarray) -> Tuple[Box, np.ndarray]:
+    rows = np.flatnonzero(mask.any(axis=1))
+    cols = np.flatnonzero(mask.any(axis=0))
+    y0, y1 = int(rows[0]), int(rows[-1]) + 1
+    x0, x1 = int(cols[0]), int(cols[-1]) + 1
+    return (x0, y0, x1, y1), mask[y0:y1, x0:x1]
+
+
+class InstanceMerger:
+    """
+    Collects per-tile instance masks in whole-image coordinates and merges instances
+    of the same label that were split across (or duplicated in) overlapping tiles.
+
+    Masks are stored cropped to their bounding box, so memory scales with object
+    area rather than with image size.
+    Two instances are merged when their masks overlap by at least `merge_threshold`
+    of the smaller mask's area, or when, restricted to the band their two tiles share,
+    their IoU is at least `merge_threshold`. The latter stitches objects much longer than
+    the overlap, whose fragments only coincide inside the band.
+    """
+
+    def __init__(self, merge_threshold: float = 0.5) -> None:
+        self.merge_threshold = merge_threshold
+        self.instances: List[Dict[str, Any]] = []
+        self._tiles: List[Box] = []
+
+    def add(self, mask: np.ndarray, label: str, score: float, offset: Tuple[int, int]) -> None:
+        """
+        Args:
+            mask: tile-local (h, w) boolean mask covering the whole tile
+            label: class name
+            score: confidence
+            offset: (x0, y0) of the tile in the whole image
+        """
+        mask = np.asarray(mask).astype(bool, copy=False)
+        if not mask.any():
+            return
+        (x0, y0, x1, y1), crop = _crop_to_content(mask)
+        ox, oy = offset
+        self._tiles.append((ox, oy, ox + mask.shape[1], oy + mask.shape[0]))
+        self.instances.append(
+            {
+                "label": label,
+                "score": float(score) if score is not None else None,
+                "box": (x0 + ox, y0 + oy, x1 + ox, y1 + oy),
+                "mask": crop.copy(),
+                "area": int(crop.sum()),
+            }
+        )
+
+    @staticmethod
+    def _overlap(a: Dict[str, Any], b: Dict[str, Any]) -> int:
+        ax0, ay0, ax1, ay1 = a["box"]
+        bx0, by0, bx1, by1 = b["box"]
+        x0, y0 = max(ax0, bx0), max(ay0, by0)
+        x1, y1 = min(ax1, bx1), min(ay1, by1)
+        if x0 >= x1 or y0 >= y1:
+            return 0
+        ma = a["mask"][y0 - ay0:y1 - ay0, x0 - ax0:x1 - ax0]
+        mb = b["mask"][y0 - by0:y1 - by0, x0 - bx0:x1 - bx0]
+        return int(np.count_nonzero(ma & mb))
+
+    @staticmethod
+    def _area_in(inst: Dict[str, Any], box: Box) -> int:
+        ix0, iy0, ix1, iy1 = inst["box"]
+        x0, y0 = max(ix0, box[0]), max(iy0, box[1])
+        x1, y1 = min(ix1, box[2]), min(iy1, box[3])
+        if x0 >= x1 or y0 >= y1:
+            return 0
+        return int(np.count_nonzero(inst["mask"][y0 - iy0:y1 - iy0, x0 - ix0:x1 - ix0]))
+
+    def _same_object(self, i: int, j: int) -> bool:
+        a, b = self.instances[i], self.instances[j]
+        inter = self._overlap(a, b)
+        if not inter:
+            return False
+        if inter >= self.merge_threshold * min(a["area"], b["area"]):
+            return True
+        # Both masks lie inside their own tile, so `inter` is inside the shared band
+        ta, tb = self._tiles[i], self._tiles[j]
+        band = (max(ta[0], tb[0]), max(ta[1], tb[1]), min(ta[2], tb[2]), min(ta[3], tb[3]))
+        union = self._area_in(a, band) + self._area_in(b, band) - inter
+        return inter >= self.merge_threshold * union
+
+    @staticmethod
+    def _union(group: List[Dict[str, Any]]) -> Dict[str, Any]:
+        x0 = min(i["box"][0] for i in group)
+        y0 = min(i["box"][1] for i in group)
+        x1 = max(i["box"][2] for i in group)
+        y1 = max(i["box"][3] for i in group)
+        mask = np.zeros((y1 - y0, x1 - x0), dtype=bool)
+        for inst in group:
+            bx0, by0, bx1, by1 = inst["box"]
+            mask[by0 - y0:by1 - y0, bx0 - x0:bx1 - x0] |= inst["mask"]
+        scores = [i["score"] for i in group if i["score"] is not None]
+        return {
+            "label": group[0]["label"],
+            "score": max(scores) if scores else None,
+            "box": (x0, y0, x1, y1),
+            "mask": mask,
+            "area": int(mask.sum()),
+        }
+
+    def merge(self) -> List[Dict[str, Any]]:
+        """
+        Returns:
+            List of dicts {'label', 'score', 'box': (x0, y0, x1, y1), 'mask': cropped bool array, 'area'}
+            ordered by descending score.
+        """
+        parent = list(range(len(self.instances)))
+
+        def find(i: int) -> int:
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        # Sweep along x so only boxes that can intersect are compared
+        order = sorted(range(len(self.instances)), key=lambda i: self.instances[i]["box"][0])
+        for pos, i in enumerate(order):
+            a = self.instances[i]
+            for j in order[pos + 1:]:
+                b = self.instances[j]
+                if b["box"][0] >= a["box"][2]:
+                    break
+                if a["label"] != b["label"] or find(i) == find(j):
+                    continue
+                if self._same_object(i, j):
+                    parent[find(j)] = find(i)
+
+        groups: Dict[int, List[Dict[str, Any]]] = {}
+        for i, inst in enumerate(self.instances):
+            groups.setdefault(find(i), []).append(inst)
+        merged = [g[0] if len(g) == 1 else self._union(g) for g in groups.values()]
+        merged.sort(key=lambda inst: -(inst["score"] or 0.0))
+        return merged
+
+
+def paste_mask(instance: Dict[str, Any], width: int, height: int) -> np.ndarray:
+    """Expand a merged instance's cropped mask to a full (height, width) boolean mask."""
+    full = np.zeros((height, width), dtype=bool)
+    x0, y0, x1, y1 = instance["box"]
+    full[y0:y1, x0:x1] = instance["mask"]
+    return full
+
+
+def crop_instances(masks: np.ndarray, label: str, scores: List[float]) -> List[Dict[str, Any]]:
+    """
+    Full-size (N, H, W) masks as cropped instances, the inverse of `paste_mask`.
+    Empty masks become a zero-size box at the origin.
+    """
+    instances = []
+    for mask, score in zip(masks, scores):
+        if mask.any():
+            box, crop = _crop_to_content(mask)
+        else:
+            box, crop = (0, 0, 0, 0), np.zeros((0, 0), dtype=bool)
+        instances.append({"box": box, "mask": np.ascontiguousarray(crop), "label": label, "score": float(score)})
+    return instances
+
+
+def subsample_instances(instances: List[Dict[str, Any]], stride: int) -> List[Dict[str, Any]]:
+    """
+    Instances on the `mask[::stride, ::stride]` grid, e.g. to render them onto
+    `ImageReader.thumbnail` of a raster too large to visualize at full size.
+    Whole-image pixel (x, y) with x % stride == y % stride == 0 maps to (x // stride, y // stride);
+    instances that cover no such pixel are dropped.
+    """
+    if stride <= 1:
+        return list(instances)
+    out = []
+    for inst in instances:
+        x0, y0, x1, y1 = inst["box"]
+        mask = inst["mask"][(-y0) % stride::stride, (-x0) % stride::stride]
+        if mask.size == 0 or not mask.any():
+            continue
+        nx0, ny0 = -(-x0 // stride), -(-y0 // stride)
+        out.append({**inst, "box": (nx0, ny0, nx0 + mask.shape[1], ny0 + mask.shape[0]), "mask": mask})
+    return out
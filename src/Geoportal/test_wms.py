@@ -0,0 +1,169 @@
+"""WMSFetcher / fetch_mosaic against a local stand-in WMS server.
+
+Run from `src/`:  python -m pytest -q Geoportal/test_wms.py
+"""
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from Geoportal.wms import NORTHING_FIRST_CRS, TileCache, WMSError, WMSFetcher, WMSLayer, fetch_mosaic, open_raster
+
+BBOX = (1000.0, 2000.0, 1100.0, 2070.0)  # 100 x 70 map units, x = easting
+
+
+class FakeWMS:
+    """
+    GetMap stand-in: pixel colour encodes its map position (R = easting, G = northing, mod 256),
+    honouring the WMS 1.3.0 axis order. `steps` scripts the first responses: an HTTP status,
+    or "xml" for a ServiceException served with status 200.
+    """
+
+    def __init__(self, delay_s=0.0):
+        self.steps = []
+        self.delay_s = delay_s
+        self.requests = []
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                params = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+                with fake.lock:
+                    fake.requests.append(params)
+                    fake.active += 1
+                    fake.max_active = max(fake.max_active, fake.active)
+                    step = fake.steps.pop(0) if fake.steps else 200
+                try:
+                    time.sleep(fake.delay_s)
+                    if step == "xml":
+                        self._send(200, "text/xml", b"<ServiceExceptionReport>bad layer</ServiceExceptionReport>")
+                    elif step != 200:
+                        self._send(step, "text/plain", b"busy")
+                    else:
+                        self._send(200, "image/png", fake.render(params))
+                finally:
+                    with fake.lock:
+                        fake.active -= 1
+
+            def _send(self, status, content_type, data):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/wms"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @staticmethod
+    def render(params):
+        a, b, c, d = (float(v) for v in params["BBOX"].split(","))
+        crs = params.get("CRS") or params.get("SRS")
+        if params["VERSION"] == "1.3.0" and crs in NORTHING_FIRST_CRS:
+            miny, minx, maxy, maxx = a, b, c, d
+        else:
+            minx, miny, maxx, maxy = a, b, c, d
+        w, h = int(params["WIDTH"]), int(params["HEIGHT"])
+        east = minx + (np.arange(w) + 0.5) * (maxx - minx) / w
+        north = maxy - (np.arange(h) + 0.5) * (maxy - miny) / h
+        img = np.zeros((h, w, 3), dtype=np.uint8)
+        img[..., 0] = (np.floor(east) % 256)[None, :]
+        img[..., 1] = (np.floor(north) % 256)[:, None]
+        buf = BytesIO()
+        Image.fromarray(img).save(buf, format="PNG")
+        return buf.getvalue()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def server():
+    fake = FakeWMS()
+    yield fake
+    fake.close()
+
+
+def make_fetcher(server, **kwargs):
+    fetcher = WMSFetcher(WMSLayer(base_url=server.url), **kwargs)
+    fetcher.backoff_s = 0.01
+    return fetcher
+
+
+def expected_mosaic():
+    east = np.arange(1000, 1100) % 256
+    north = np.arange(2069, 1999, -1) % 256
+    img = np.zeros((70, 100, 3), dtype=np.uint8)
+    img[..., 0] = east[None, :]
+    img[..., 1] = north[:, None]
+    return img
+
+
+def test_getmap_axis_order():
+    params = WMSLayer(crs="EPSG:2180", version="1.3.0").getmap_params(BBOX, 100, 70)
+    assert params["BBOX"].split(",")[0] == "2000.000000"  # northing first
+    assert (params["WIDTH"], params["HEIGHT"]) == ("100", "70")
+    params = WMSLayer(crs="EPSG:2180", version="1.1.1").getmap_params(BBOX, 100, 70)
+    assert params["BBOX"].split(",")[0] == "1000.000000" and params["SRS"] == "EPSG:2180"
+
+
+def test_mosaic_streamed_in_tiles(server, tmp_path):
+    out = tmp_path / "ortho.npy"
+    meta = fetch_mosaic(BBOX, 1.0, str(out), make_fetcher(server), tile_px=32)
+    mosaic, saved = open_raster(str(out))
+    assert isinstance(mosaic, np.memmap)
+    assert np.array_equal(mosaic, expected_mosaic())
+    assert meta == saved and meta["tiles"] == 12 and len(server.requests) == 12
+    assert meta["geotransform"] == [1000.0, 1.0, 0.0, 2070.0, 0.0, -1.0]
+
+
+def test_retries_transient_errors(server, tmp_path):
+    server.steps = [503, 429]
+    fetcher = make_fetcher(server, max_retries=2)
+    fetch_mosaic(BBOX, 1.0, str(tmp_path / "m.npy"), fetcher)
+    assert fetcher.stats["retries"] == 2 and len(server.requests) == 3
+
+
+def test_service_exception_is_not_retried(server):
+    server.steps = ["xml"]
+    with pytest.raises(WMSError, match="ServiceException"):
+        make_fetcher(server).fetch(BBOX, 100, 70)
+    assert len(server.requests) == 1
+
+
+def test_gives_up_after_max_retries(server):
+    server.steps = [503] * 5
+    with pytest.raises(WMSError, match="HTTP 503"):
+        make_fetcher(server, max_retries=1).fetch(BBOX, 100, 70)
+    assert len(server.requests) == 2
+
+
+def test_tile_cache(server, tmp_path):
+    cache = TileCache(str(tmp_path / "tiles"))
+    fetch_mosaic(BBOX, 1.0, str(tmp_path / "a.npy"), make_fetcher(server, cache=cache), tile_px=50)
+    fetcher = make_fetcher(server, cache=cache)
+    fetch_mosaic(BBOX, 1.0, str(tmp_path / "b.npy"), fetcher, tile_px=50)
+    assert len(server.requests) == 4 and fetcher.stats["cache_hits"] == 4
+    assert np.array_equal(open_raster(str(tmp_path / "b.npy"))[0], expected_mosaic())
+
+
+def test_concurrent_fetches_are_bounded(tmp_path):
+    server = FakeWMS(delay_s=0.1)
+    try:
+        fetch_mosaic(BBOX, 1.0, str(tmp_path / "m.npy"), make_fetcher(server, max_workers=3), tile_px=16)
+        assert 1 < server.max_active <= 3
+    finally:
+        server.close()
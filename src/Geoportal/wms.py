@@ -0,0 +1,311 @@
+"""
+WMS GetMap mosaic fetcher (e.g. the geoportal.gov.pl orthophoto service).
+
+The bbox is split into fixed-size pixel tiles at a constant ground resolution.
+Tiles are fetched concurrently over one pooled HTTP session, with retries and
+exponential backoff. Each tile is written straight into a windowed raster on disk:
+a `.npy` (H, W, 3) uint8 array opened as a memmap, plus a `.json` sidecar with
+the georeference. The full mosaic is never held in memory.
+
+Coordinates are always given as (minx, miny, maxx, maxy) with x = easting and
+y = northing. Image width runs along x and height along y, with north up. For WMS
+1.3.0 and a CRS whose official axis order is northing first (EPSG:2180, EPSG:4326),
+the BBOX parameter is sent in that order.
+"""
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, asdict
+from io import BytesIO
+from pathlib import Path
+import hashlib
+import json
+import logging
+import math
+import os
+import random
+import threading
+import time
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+GEOPORTAL_ORTO_URL = "https://mapy.geoportal.gov.pl/wss/service/PZGIK/ORTO/WMS/HighResolution"
+
+# CRSs whose EPSG axis order is (northing, easting) / (lat, lon); WMS 1.3.0 follows it
+NORTHING_FIRST_CRS = {"EPSG:2180", "EPSG:4326", "EPSG:2176", "EPSG:2177", "EPSG:2178", "EPSG:2179"}
+
+_RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+BBox = Tuple[float, float, float, float]  # (minx, miny, maxx, maxy), x = easting
+
+
+class WMSError(RuntimeError):
+    """Non-retryable WMS failure (HTTP 4xx, ServiceException, wrong image size) or retries exhausted."""
+
+
+@dataclass(frozen=True)
+class WMSLayer:
+    base_url: str = GEOPORTAL_ORTO_URL
+    layer: str = "Raster"
+    crs: str = "EPSG:2180"
+    version: str = "1.3.0"
+    style: str = "default"
+    format: str = "image/png"
+
+    @property
+    def northing_first(self) -> bool:
+        return self.version == "1.3.0" and self.crs.upper() in NORTHING_FIRST_CRS
+
+    def getmap_params(self, bbox: BBox, width: int, height: int) -> Dict[str, str]:
+        minx, miny, maxx, maxy = bbox
+        order = (miny, minx, maxy, maxx) if self.northing_first else (minx, miny, maxx, maxy)
+        return {
+            "SERVICE": "WMS",
+            "REQUEST": "GetMap",
+            "VERSION": self.version,
+            "LAYERS": self.layer,
+            "STYLES": self.style,
+            "FORMAT": self.format,
+            "CRS" if self.version == "1.3.0" else "SRS": self.crs,
+            "BBOX": ",".join(f"{v:.6f}" for v in order),
+            "WIDTH": str(width),
+            "HEIGHT": str(height),
+        }
+
+
+@dataclass(frozen=True)
+class Tile:
+    row: int
+    col: int
+    x0: int  # pixel window in the mosaic, x1/y1 exclusive
+    y0: int
+    x1: int
+    y1: int
+    bbox: BBox
+
+    @property
+    def width(self) -> int:
+        return self.x1 - self.x0
+
+    @property
+    def height(self) -> int:
+        return self.y1 - self.y0
+
+
+def mosaic_size(bbox: BBox, pixel_size: float) -> Tuple[int, int]:
+    minx, miny, maxx, maxy = bbox
+    if maxx <= minx or maxy <= miny:
+        raise ValueError(f"Empty bbox: {bbox}")
+    return math.ceil((maxx - minx) / pixel_size), math.ceil((maxy - miny) / pixel_size)
+
+
+def plan_tiles(bbox: BBox, pixel_size: float, tile_px: int = 2048) -> Tuple[Tuple[int, int], List[Tile]]:
+    """
+    (width, height) of the mosaic and its tiles, row 0 at the top (north).
+    Tile bboxes are derived from pixel edges, so every tile has exactly `pixel_size` resolution
+    (the last row/column may extend up to one pixel past the requested bbox).
+    """
+    width, height = mosaic_size(bbox, pixel_size)
+    minx, _, _, maxy = bbox
+    tiles = []
+    for row, y0 in enumerate(range(0, height, tile_px)):
+        y1 = min(y0 + tile_px, height)
+        for col, x0 in enumerate(range(0, width, tile_px)):
+            x1 = min(x0 + tile_px, width)
+            tile_bbox = (minx + x0 * pixel_size, maxy - y1 * pixel_size, minx + x1 * pixel_size, maxy - y0 * pixel_size)
+            tiles.append(Tile(row, col, x0, y0, x1, y1, tile_bbox))
+    return (width, height), tiles
+
+
+class TileCache:
+    """Raw GetMap responses on disk, one file per (layer, bbox, size) key; writes are atomic."""
+
+    def __init__(self, directory: str) -> None:
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(layer: WMSLayer, bbox: BBox, width: int, height: int) -> str:
+        payload = json.dumps(
+            {"layer": asdict(layer), "bbox": [round(v, 6) for v in bbox], "size": [width, height]},
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.bin"
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            return path.read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, data: bytes) -> None:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".tmp{os.getpid()}.{threading.get_ident()}")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+
+
+class WMSFetcher:
+    """
+    Concurrent GetMap client: pooled `requests.Session`, `max_workers` requests in flight,
+    `max_retries` retries with exponential backoff and full jitter on timeouts, connection
+    errors and 408/429/5xx; optional `TileCache`.
+    """
+
+    def __init__(
+        self,
+        layer: Optional[WMSLayer] = None,
+        cache: Optional[TileCache] = None,
+        max_workers: int = 4,
+        max_retries: int = 4,
+        backoff_s: float = 0.5,
+        backoff_max_s: float = 30.0,
+        timeout_s: float = 120.0,
+        session: Optional[requests.Session] = None,
+    ) -> None:
+        self.layer = layer or WMSLayer()
+        self.cache = cache
+        self.max_workers = max(1, int(max_workers))
+        self.max_retries = max(0, int(max_retries))
+        self.backoff_s = backoff_s
+        self.backoff_max_s = backoff_max_s
+        self.timeout_s = timeout_s
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers["User-Agent"] = "Mozilla/5.0 (Python script)"
+        self.session = session
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "retries": 0, "cache_hits": 0, "bytes": 0}
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self.stats[name] += amount
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_max_s, self.backoff_s * (2 ** attempt)))
+
+    def _get(self, params: Dict[str, str]) -> bytes:
+        for attempt in range(self.max_retries + 1):
+            last = attempt == self.max_retries
+            self._count("requests")
+            try:
+                resp = self.session.get(self.layer.base_url, params=params, timeout=self.timeout_s)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if last:
+                    raise WMSError(f"GetMap failed after {attempt + 1} attempts: {e!r}") from e
+                logger.warning("GetMap %r, retrying", e)
+            else:
+                if resp.status_code == 200:
+                    content_type = resp.headers.get("Content-Type", "")
+                    if not content_type.startswith("image/"):
+                        # WMS reports errors as 200 + XML ServiceException
+                        raise WMSError(f"GetMap returned {content_type or 'no content type'}: {resp.text[:300]}")
+                    return resp.content
+                if resp.status_code not in _RETRYABLE_STATUS or last:
+                    raise WMSError(f"GetMap HTTP {resp.status_code} after {attempt + 1} attempts: {resp.text[:300]}")
+                logger.warning("GetMap HTTP %d, retrying", resp.status_code)
+            self._count("retries")
+            time.sleep(self._backoff(attempt))
+        raise AssertionError("unreachable")
+
+    def fetch(self, bbox: BBox, width: int, height: int) -> np.ndarray:
+        """One GetMap image as an (height, width, 3) uint8 array, from the cache when possible."""
+        key = TileCache.key(self.layer, bbox, width, height) if self.cache is not None else None
+        data = self.cache.get(key) if key else None
+        cached = data is not None
+        if cached:
+            self._count("cache_hits")
+        else:
+            data = self._get(self.layer.getmap_params(bbox, width, height))
+            self._count("bytes", len(data))
+        array = np.asarray(Image.open(BytesIO(data)).convert("RGB"))
+        if array.shape[:2] != (height, width):
+            raise WMSError(f"GetMap returned {array.shape[1]}x{array.shape[0]}, expected {width}x{height}")
+        if key and not cached:
+            # only decodable, correctly sized responses are cached
+            self.cache.put(key, data)
+        return array
+
+    def iter_tiles(self, tiles: List[Tile]) -> Iterator[Tuple[Tile, np.ndarray]]:
+        """Yield (tile, pixels) as they complete; at most `max_workers` tiles are in flight or undelivered."""
+        with ThreadPoolExecutor(self.max_workers, thread_name_prefix="wms") as pool:
+            pending = {}
+            queue = iter(tiles)
+            for tile in queue:
+                pending[pool.submit(self.fetch, tile.bbox, tile.width, tile.height)] = tile
+                if len(pending) >= self.max_workers:
+                    break
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    tile = pending.pop(future)
+                    nxt = next(queue, None)
+                    if nxt is not None:
+                        pending[pool.submit(self.fetch, nxt.bbox, nxt.width, nxt.height)] = nxt
+                    yield tile, future.result()
+
+
+def open_raster(path: str) -> Tuple[np.ndarray, Dict[str, Any]]:
+    """Memory-mapped (read-only) mosaic written by `fetch_mosaic` and its georeference sidecar."""
+    array = np.load(path, mmap_mode="r")
+    with open(Path(path).with_suffix(".json"), "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    return array, meta
+
+
+def fetch_mosaic(
+    bbox: BBox,
+    pixel_size: float,
+    out_path: str,
+    fetcher: Optional[WMSFetcher] = None,
+    tile_px: int = 2048,
+) -> Dict[str, Any]:
+    """
+    Fetch `bbox` at `pixel_size` (map units per pixel) into `out_path` (.npy, (H, W, 3) uint8)
+    and write `<out_path>.json` with the georeference; returns that metadata.
+    Tiles are written into the memmap as they arrive, so memory stays at ~`max_workers` tiles.
+    """
+    fetcher = fetcher or WMSFetcher()
+    (width, height), tiles = plan_tiles(bbox, pixel_size, tile_px)
+    out = Path(out_path)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    t0 = time.perf_counter()
+    mosaic = np.lib.format.open_memmap(str(out), mode="w+", dtype=np.uint8, shape=(height, width, 3))
+    try:
+        for i, (tile, pixels) in enumerate(fetcher.iter_tiles(tiles), 1):
+            mosaic[tile.y0:tile.y1, tile.x0:tile.x1] = pixels
+            logger.info("tile %d/%d r=%d c=%d %dx%d", i, len(tiles), tile.row, tile.col, tile.width, tile.height)
+        mosaic.flush()
+    finally:
+        del mosaic
+
+    minx, _, _, maxy = bbox
+    meta = {
+        "width": width,
+        "height": height,
+        "crs": fetcher.layer.crs,
+        "pixel_size": pixel_size,
+        # GDAL-style affine geotransform: x = gt[0] + col * gt[1], y = gt[3] + row * gt[5]
+        "geotransform": [minx, pixel_size, 0.0, maxy, 0.0, -pixel_size],
+        "bbox": [minx, maxy - height * pixel_size, minx + width * pixel_size, maxy],
+        "layer": asdict(fetcher.layer),
+        "tiles": len(tiles),
+        "tile_px": tile_px,
+        "seconds": round(time.perf_counter() - t0, 3),
+        "stats": dict(fetcher.stats),
+    }
+    with open(out.with_suffix(".json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    return meta
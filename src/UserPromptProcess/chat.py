@@ -1,84 +1,281 @@
 import torch
 from PIL import Image
-from typing import List, Dict, Any, Union
+from typing import List, Dict, Any, Optional, Union
 from pathlib import Path
+import asyncio
 import json
+import logging
+import os
+import random
+import threading
+import time
+
+import httpx
 
 from google import genai
 from google.genai import types 
 from google.genai.errors import APIError
 
+try:
+    from .response_cache import ResponseCache, make_key
+    from .image_prep import ImagePrepConfig, PreparedImage, prepare_image
+except ImportError:  # uruchomienie jako skrypt (test.py importuje `chat` bezpośrednio)
+    from response_cache import ResponseCache, make_key
+    from image_prep import ImagePrepConfig, PreparedImage, prepare_image
+
+logger = logging.getLogger(__name__)
+
 _MODEL = None
+_MODEL_LOCK = threading.Lock()
+_RESPONSE_CACHE: Optional[ResponseCache] = None
+_RESPONSE_CACHE_READY = False
+_RESPONSE_CACHE_LOCK = threading.Lock()
+
+# Ustawienia kreatywności i maksymalnej długości (odpowiednik temperatury i max_new_tokens)
+_GENERATION_CONFIG = {"temperature": 0.2, "max_output_tokens": 30048}  # Wyższa wartość dla bezpieczeństwa
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """Współdzielony cache odpowiedzi Gemini (konfiguracja z env, patrz ResponseCache.from_env); None gdy wyłączony."""
+    global _RESPONSE_CACHE, _RESPONSE_CACHE_READY
+    if not _RESPONSE_CACHE_READY:
+        with _RESPONSE_CACHE_LOCK:
+            if not _RESPONSE_CACHE_READY:
+                _RESPONSE_CACHE = ResponseCache.from_env()
+                _RESPONSE_CACHE_READY = True
+    return _RESPONSE_CACHE
+
+
+# Błędy przejściowe, po których warto ponowić zapytanie
+_RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+def _is_retryable(e: BaseException) -> bool:
+    if isinstance(e, APIError):
+        return getattr(e, "code", None) in _RETRYABLE_STATUS
+    return isinstance(e, (TimeoutError, ConnectionError, httpx.TransportError))
+
 
 class Model:
-    def __init__(self, model_id: str = "gemini-2.5-flash"):
-        print(f"--> Inicjalizacja klienta Google GenAI dla modelu {model_id}...")
+    """
+    Klient Gemini z jednym (współdzielonym) klientem HTTP, limitem czasu na wywołanie,
+    ograniczoną liczbą ponowień z losowym opóźnieniem (full jitter) i limitem równoległych zapytań.
+    Konfiguracja z env: GEMINI_TIMEOUT_S, GEMINI_MAX_RETRIES, GEMINI_BACKOFF_S,
+    GEMINI_BACKOFF_MAX_S, GEMINI_MAX_CONCURRENCY.
+    """
+
+    def __init__(
+        self,
+        model_id: str = "gemini-2.5-flash",
+        cache: Optional[ResponseCache] = None,
+        image_config: Optional[ImagePrepConfig] = None,
+        client: Optional[genai.Client] = None,
+        timeout_s: Optional[float] = None,
+        max_retries: Optional[int] = None,
+        max_concurrency: Optional[int] = None,
+    ):
+        logger.info("Inicjalizacja klienta Google GenAI dla modelu %s...", model_id)
+        self.model_id = model_id
+        self.timeout_s = float(timeout_s if timeout_s is not None else os.environ.get("GEMINI_TIMEOUT_S", "60"))
+        self.max_retries = int(max_retries if max_retries is not None else os.environ.get("GEMINI_MAX_RETRIES", "3"))
+        self.backoff_s = float(os.environ.get("GEMINI_BACKOFF_S", "0.5"))
+        self.backoff_max_s = float(os.environ.get("GEMINI_BACKOFF_MAX_S", "8"))
+        self.max_concurrency = max(1, int(
+            max_concurrency if max_concurrency is not None else os.environ.get("GEMINI_MAX_CONCURRENCY", "8")
+        ))
         try:
             # KLUCZ API: Upewnij się, że zmienna środowiskowa GEMINI_API_KEY jest ustawiona
-            self.client = genai.Client()
-            self.model_id = model_id
-            print("--> Klient Gemini API zainicjalizowany pomyślnie.")
+            # Jeden klient na proces: połączenia HTTP (sync i client.aio) są ponownie używane
+            self.client = client or genai.Client(
+                http_options=types.HttpOptions(timeout=int(self.timeout_s * 1000))
+            )
+            logger.info("Klient Gemini API zainicjalizowany pomyślnie.")
         except Exception as e:
             raise RuntimeError(f"Nie udało się zainicjalizować klienta Gemini: {e}")
+        self.cache = cache if cache is not None else get_response_cache()
+        # Skalowanie/kodowanie obrazów przed wysłaniem (GEMINI_IMAGE_MAX_SIDE itd.)
+        self.image_config = image_config or ImagePrepConfig.from_env()
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        # asyncio.Semaphore jest związany z pętlą zdarzeń; tworzony przy pierwszym użyciu w danej pętli
+        self._aslots: Optional[asyncio.Semaphore] = None
+        self._aslots_loop: Optional[asyncio.AbstractEventLoop] = None
 
-    def predict(self, images_list: List[Image.Image], prompt: str) -> str:
+    def _lookup(self, images_list: List[PreparedImage], prompt: str, use_cache: bool):
+        """(klucz cache, odpowiedź z cache albo None)."""
+        if self.cache is None:
+            return None, None
+        key = make_key(images_list, prompt, self.model_id, _GENERATION_CONFIG)
+        if use_cache:
+            return key, self.cache.get(key)
+        self.cache.record_bypass()
+        return key, None
+
+    def predict(self, images_list: List[Union[Image.Image, PreparedImage]], prompt: str, use_cache: bool = True) -> str:
         """
         Metoda inferencji. Wysyła prompt i obrazy do Gemini API.
         Zachowuje interfejs predict(images_list, prompt).
+        Obrazy PIL są skalowane i kodowane wg `self.image_config`; PreparedImage
+        (z prepare_image) idą bez ponownego kodowania.
+        Odpowiedzi są cache'owane po (obrazy, prompt, model); use_cache=False wymusza nowe zapytanie
+        (wynik i tak trafia do cache).
+        """
+        if not self.client:
+            raise RuntimeError("Klient Gemini nie został poprawnie zainicjalizowany.")
+
+        images_list = [prepare_image(img, self.image_config) for img in images_list]
+        key, cached = self._lookup(images_list, prompt, use_cache)
+        if cached is not None:
+            return cached
+
+        text = self._generate(images_list, prompt)
+        if key is not None:
+            self.cache.put(key, text)
+        return text
+
+    async def apredict(
+        self, images_list: List[Union[Image.Image, PreparedImage]], prompt: str, use_cache: bool = True
+    ) -> str:
+        """
+        Asynchroniczny odpowiednik `predict` (client.aio): nie blokuje pętli zdarzeń.
+        Kodowanie obrazów PIL odbywa się w wątku.
         """
         if not self.client:
             raise RuntimeError("Klient Gemini nie został poprawnie zainicjalizowany.")
 
-        # 1. Przygotowanie wejścia (List[Image.Image] + str)
+        if not all(isinstance(img, PreparedImage) for img in images_list):
+            images_list = await asyncio.to_thread(
+                lambda: [prepare_image(img, self.image_config) for img in images_list]
+            )
+        key, cached = self._lookup(images_list, prompt, use_cache)
+        if cached is not None:
+            return cached
+
+        text = await self._agenerate(images_list, prompt)
+        if key is not None:
+            self.cache.put(key, text)
+        return text
+
+    def _contents(self, images_list: List[PreparedImage], prompt: str) -> List[Any]:
+
+        # 1. Przygotowanie wejścia (List[PreparedImage] + str)
         # Gemini API oczekuje listy obiektów (TextPart, ImagePart)
         
         contents = []
         
-        # Dodawanie obrazów
+        # Dodawanie obrazów (już zakodowanych, bez ponownej konwersji)
         for img in images_list:
-             # Upewniamy się, że obraz ma poprawny format (RGB)
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
-            contents.append(img)
+            logger.debug(
+                "Obraz do Gemini: %sx%s -> %sx%s, %d B (oszczędność %d B)",
+                *img.original_size, *img.size, img.nbytes, img.bytes_saved,
+            )
+            contents.append(types.Part.from_bytes(data=img.data, mime_type=img.mime_type))
             
         # Dodawanie tekstu promptu
         contents.append(prompt)
+        return contents
 
-        # 2. Wywołanie API
-        try:
-            response = self.client.models.generate_content(
-                model=self.model_id,
-                contents=contents,
-                config=types.GenerateContentConfig(
-                    # Ustawienia kreatywności i maksymalnej długości (odpowiednik temperatury i max_new_tokens)
-                    temperature=0.2,
-                    max_output_tokens=30048, # Wyższa wartość dla bezpieczeństwa
-                )
-            )
+    @staticmethod
+    def _text(response: Any) -> str:
+        # 3. Zwracanie wyniku
+        if response.text is None:
+            raise ValueError("Pusta odpowiedź modelu")
+        return response.text.strip()
 
-            # print(f"[DEBUG] Gemini API response: {response}")
-            # 3. Zwracanie wyniku
-            return response.text.strip()
-        
-        except APIError as e:
-            raise RuntimeError(f"Błąd Gemini API: {e}")
-        except Exception as e:
-            print("[ERROR]", response)
-            raise RuntimeError(f"Nieoczekiwany błąd podczas predykcji: {e}")
+    def _backoff(self, attempt: int) -> float:
+        """Full jitter: losowo z [0, min(max, base * 2^attempt)]."""
+        return random.uniform(0.0, min(self.backoff_max_s, self.backoff_s * (2 ** attempt)))
+
+    def _on_failure(self, e: Exception, attempt: int) -> None:
+        """Rzuca RuntimeError, gdy błąd nie jest przejściowy albo skończyły się próby."""
+        if _is_retryable(e) and attempt < self.max_retries:
+            logger.warning("Gemini: próba %d/%d nieudana (%s: %s), ponawiam",
+                           attempt + 1, self.max_retries + 1, type(e).__name__, e)
+            return
+        if isinstance(e, APIError):
+            raise RuntimeError(f"Błąd Gemini API: {e}") from e
+        if isinstance(e, TimeoutError):
+            raise RuntimeError(f"Przekroczono limit czasu Gemini ({self.timeout_s:.0f}s)") from e
+        logger.error("Nieoczekiwany błąd podczas predykcji: %s: %s", type(e).__name__, e)
+        raise RuntimeError(f"Nieoczekiwany błąd podczas predykcji: {e}") from e
+
+    def _generate(self, images_list: List[PreparedImage], prompt: str) -> str:
+        contents = self._contents(images_list, prompt)
+        # 2. Wywołanie API (limit czasu przez HttpOptions.timeout klienta)
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self._slots:
+                    response = self.client.models.generate_content(
+                        model=self.model_id,
+                        contents=contents,
+                        config=types.GenerateContentConfig(**_GENERATION_CONFIG)
+                    )
+                return self._text(response)
+            except Exception as e:
+                self._on_failure(e, attempt)
+            time.sleep(self._backoff(attempt))
+
+    def _async_slots(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._aslots_loop is not loop:
+            self._aslots = asyncio.Semaphore(self.max_concurrency)
+            self._aslots_loop = loop
+        return self._aslots
+
+    async def _agenerate(self, images_list: List[PreparedImage], prompt: str) -> str:
+        contents = self._contents(images_list, prompt)
+        slots = self._async_slots()
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with slots:
+                    response = await asyncio.wait_for(
+                        self.client.aio.models.generate_content(
+                            model=self.model_id,
+                            contents=contents,
+                            config=types.GenerateContentConfig(**_GENERATION_CONFIG)
+                        ),
+                        timeout=self.timeout_s,
+                    )
+                return self._text(response)
+            except Exception as e:
+                self._on_failure(e, attempt)
+            await asyncio.sleep(self._backoff(attempt))
 
-# Inicjalizacja Singletona przy imporcie
-if _MODEL is None:
-    _MODEL = Model()
+def get_model() -> Model:
+    """
+    Leniwa inicjalizacja singletona: klient Gemini powstaje przy pierwszym użyciu,
+    a nie przy imporcie modułu (szybszy start API i `uvicorn --reload`).
+    """
+    global _MODEL
+    if _MODEL is None:
+        with _MODEL_LOCK:
+            if _MODEL is None:
+                _MODEL = Model()
+    return _MODEL
 
 
 # --- Funkcje pomocnicze ---
 
 def _load_image(path_or_obj: Any) -> Image.Image:
+    if isinstance(path_or_obj, PreparedImage):
+        return path_or_obj.to_pil()
     if isinstance(path_or_obj, Image.Image):
         return path_or_obj.convert("RGB")
     return Image.open(str(path_or_obj)).convert("RGB")
 
 
+def _prepare(path_or_obj: Any) -> PreparedImage:
+    """Ścieżka / PIL / PreparedImage -> PreparedImage (dekodowanie i kodowanie tylko raz)."""
+    if isinstance(path_or_obj, PreparedImage):
+        return path_or_obj
+    return prepare_image(path_or_obj, get_model().image_config)
+
+
+async def _aprepare(path_or_obj: Any) -> PreparedImage:
+    if isinstance(path_or_obj, PreparedImage):
+        return path_or_obj
+    return await asyncio.to_thread(_prepare, path_or_obj)
+
+
 def _chat_hist_to_string(chat_history: Any) -> str:
     """
     Konwertuje chat_history (może być JSON-string, dict z kluczem 'messages' lub lista wiadomości)
@@ -117,18 +314,9 @@ def _chat_hist_to_string(chat_history: Any) -> str:
 
 # --- Główne funkcje API ---
 
-def suggest_classes(
-    image_path: Any, 
-    chat_history: List[Dict[str, Any]], 
-    # proposed_classes: List[str]
-) -> List[str]:
-    """
-    Analizuje obraz i zwraca listę max 10 klas obiektów (po polsku).
-    Uwzględnia klasy zaproponowane (proposed_classes).
-    """
-    image = _load_image(image_path)
+def _suggest_prompt(chat_history: Any) -> str:
     user_context = _chat_hist_to_string(chat_history)
-    print(f"[DEBUG] User context for suggest_classes: {user_context}")
+    logger.debug("User context for suggest_classes: %s", user_context)
     # proposed_str = ", ".join(proposed_classes) if proposed_classes else "brak"
 
     # Duży preprompt systemowy
@@ -147,11 +335,12 @@ def suggest_classes(
     )
 
     prompt = f"{system_instruction}\nKontekst rozmowy: '{user_context}"
-    print(f"[DEBUG] Prompt for suggest_classes: {prompt}")
+    logger.debug("Prompt for suggest_classes: %s", prompt)
+    return prompt
 
-    # Wywołanie modelu
-    raw_response = _MODEL.predict([image], prompt)
-    print(f"[DEBUG] Raw response for suggest_classes: {raw_response}")
+
+def _parse_classes(raw_response: str) -> List[str]:
+    logger.debug("Raw response for suggest_classes: %s", raw_response)
     
     # Proste parsowanie wyniku na listę
     # Usuwamy ewentualne kropki na końcu i dzielimy po przecinkach
@@ -164,16 +353,51 @@ def suggest_classes(
     return unique_items
 
 
-def chat_answer(
+def suggest_classes(
+    image_path: Any, 
     chat_history: List[Dict[str, Any]], 
-    classes: List[str], 
-    current_image_path: Any, 
-    answer_json: Any = None
-) -> str:
+    # proposed_classes: List[str]
+    fresh: bool = False,
+) -> List[str]:
     """
-    Generuje odpowiedź dla użytkownika na podstawie obrazu, historii czatu i metadanych detekcji.
+    Analizuje obraz i zwraca listę max 10 klas obiektów (po polsku).
+    Uwzględnia klasy zaproponowane (proposed_classes).
+    image_path: ścieżka, PIL.Image albo PreparedImage (z prepare_image, bez ponownego kodowania).
+    fresh=True pomija cache odpowiedzi.
     """
-    image = _load_image(current_image_path)
+    image = _prepare(image_path)
+    # Wywołanie modelu
+    raw_response = get_model().predict([image], _suggest_prompt(chat_history), use_cache=not fresh)
+    return _parse_classes(raw_response)
+
+
+async def asuggest_classes(
+    image_path: Any,
+    chat_history: List[Dict[str, Any]],
+    fresh: bool = False,
+) -> List[str]:
+    """Asynchroniczna wersja `suggest_classes` (Model.apredict)."""
+    image = await _aprepare(image_path)
+    raw_response = await get_model().apredict([image], _suggest_prompt(chat_history), use_cache=not fresh)
+    return _parse_classes(raw_response)
+
+
+def _stats_summary(stats: Dict[str, Any]) -> str:
+    """Liczności i powierzchnie klas (DetectSegment.utils.mask_stats.summarize) jako tekst do promptu."""
+    lines = []
+    for name, c in stats.get("classes", {}).items():
+        line = f"- {name}: {c.get('count', 0)} szt."
+        if c.get("area_m2") is not None:
+            line += f", łączna powierzchnia {c['area_m2']:.1f} m²"
+            if c.get("mean_area_m2") is not None:
+                line += f" (średnio {c['mean_area_m2']:.1f} m²)"
+        elif c.get("count"):
+            line += f", łączna powierzchnia {c.get('area_px', 0)} px"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def _answer_prompt(chat_history: Any, classes: List[str], answer_json: Any = None) -> str:
     last_user_question = _chat_hist_to_string(chat_history)
     
     # Parsowanie metadanych z detekcji
@@ -181,6 +405,8 @@ def chat_answer(
         data = answer_json if isinstance(answer_json, dict) else json.loads(answer_json)
     except:
         data = {}
+    if not isinstance(data, dict):
+        data = {}
 
     detections = data.get("detections", [])
     det_summary = ", ".join([f"{d.get('label')} (pewność: {d.get('score', 0):.2f})" for d in detections[:10]])
@@ -207,14 +433,53 @@ def chat_answer(
         #f"Segmentacja: wykryto {len(data.get('segmentations', []))} masek obiektów."
     )
 
+    # Policzone z masek segmentacji - dokładniejsze niż liczenie "na oko" ze zdjęcia
+    stats_context = ""
+    if data.get("stats"):
+        stats_context = (
+            "DANE TECHNICZNE (policzone z masek segmentacji; przy pytaniach o liczbę "
+            "lub powierzchnię obiektów podawaj te wartości):\n"
+            f"{_stats_summary(data['stats'])}\n\n"
+        )
+
     prompt = (
         f"{system_instruction}\n\n"
         #f"DANE TECHNICZNE:\n{data_context}\n\n"
+        f"{stats_context}"
         f"PYTANIE UŻYTKOWNIKA: '{last_user_question}'\n"
         "ODPOWIEDŹ:"
     )
 
+    return prompt
+
+
+def chat_answer(
+    chat_history: List[Dict[str, Any]], 
+    classes: List[str], 
+    current_image_path: Any, 
+    answer_json: Any = None,
+    fresh: bool = False,
+) -> str:
+    """
+    Generuje odpowiedź dla użytkownika na podstawie obrazu, historii czatu i metadanych detekcji.
+    current_image_path: ścieżka, PIL.Image albo PreparedImage.
+    fresh=True pomija cache odpowiedzi.
+    """
+    image = _prepare(current_image_path)
     # Wywołanie modelu
-    response = _MODEL.predict([image], prompt)
+    response = get_model().predict([image], _answer_prompt(chat_history, classes, answer_json), use_cache=not fresh)
     
-    return response
\ No newline at end of file
+    return response
+
+
+async def achat_answer(
+    chat_history: List[Dict[str, Any]],
+    classes: List[str],
+    current_image_path: Any,
+    answer_json: Any = None,
+    fresh: bool = False,
+) -> str:
+    """Asynchroniczna wersja `chat_answer` (Model.apredict)."""
+    image = await _aprepare(current_image_path)
+    prompt = _answer_prompt(chat_history, classes, answer_json)
+    return await get_model().apredict([image], prompt, use_cache=not fresh)
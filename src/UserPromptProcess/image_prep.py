@@ -0,0 +1,111 @@
+from typing import Any, Optional, Tuple
+from dataclasses import dataclass
+from io import BytesIO
+import hashlib
+import os
+
+from PIL import Image
+
+_MIME_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
+
+
+@dataclass(frozen=True)
+class PreparedImage:
+    """Obraz przeskalowany i zakodowany raz, gotowy do wysłania do Gemini (types.Part.from_bytes)."""
+    data: bytes
+    mime_type: str
+    size: Tuple[int, int]             # (w, h) po przeskalowaniu
+    original_size: Tuple[int, int]    # (w, h) źródła
+    original_nbytes: int              # rozmiar pliku źródłowego albo surowych pikseli RGB
+    digest: str                       # sha256 zakodowanych bajtów (klucz cache odpowiedzi)
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.data)
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.original_nbytes - self.nbytes
+
+    def to_pil(self) -> Image.Image:
+        return Image.open(BytesIO(self.data)).convert("RGB")
+
+
+@dataclass(frozen=True)
+class ImagePrepConfig:
+    """
+    max_side: dłuższy bok po przeskalowaniu (0 = bez skalowania)
+    format: JPEG / PNG / WEBP
+    quality: jakość JPEG/WEBP
+    """
+    max_side: int = 1536
+    format: str = "JPEG"
+    quality: int = 85
+
+    @classmethod
+    def from_env(cls) -> "ImagePrepConfig":
+        """GEMINI_IMAGE_MAX_SIDE, GEMINI_IMAGE_FORMAT, GEMINI_IMAGE_QUALITY."""
+        return cls(
+            max_side=int(os.environ.get("GEMINI_IMAGE_MAX_SIDE", "1536")),
+            format=os.environ.get("GEMINI_IMAGE_FORMAT", "JPEG").upper(),
+            quality=int(os.environ.get("GEMINI_IMAGE_QUALITY", "85")),
+        )
+
+
+def prepare_image(
+    source: Any,
+    config: Optional[ImagePrepConfig] = None,
+    crop: Optional[Tuple[int, int, int, int]] = None,
+    source_nbytes: Optional[int] = None,
+) -> PreparedImage:
+    """
+    Wycina (opcjonalnie), skaluje do `config.max_side` i koduje obraz jednokrotnie.
+    Args:
+        source: PIL.Image, ścieżka albo już przygotowany PreparedImage (zwracany bez zmian)
+        crop: (x0, y0, x1, y1) w pikselach obrazu źródłowego, przed skalowaniem
+        source_nbytes: rozmiar oryginalnego pliku do raportu oszczędności;
+            domyślnie rozmiar pliku ze ścieżki albo surowe piksele RGB (w*h*3)
+    """
+    if isinstance(source, PreparedImage):
+        return source
+    config = config or ImagePrepConfig.from_env()
+    fmt = config.format.upper()
+    if fmt not in _MIME_TYPES:
+        raise ValueError(f"Nieobsługiwany format obrazu: {config.format}")
+
+    if isinstance(source, Image.Image):
+        image = source
+    else:
+        if source_nbytes is None:
+            source_nbytes = os.path.getsize(str(source))
+        image = Image.open(str(source))
+    original_size = image.size
+    if source_nbytes is None:
+        source_nbytes = original_size[0] * original_size[1] * 3
+
+    if crop is not None:
+        image = image.crop(tuple(int(v) for v in crop))
+    if image.mode not in ("RGB", "L") or (fmt == "JPEG" and image.mode != "RGB"):
+        image = image.convert("RGB")
+
+    w, h = image.size
+    if config.max_side and max(w, h) > config.max_side:
+        scale = config.max_side / max(w, h)
+        new_size = (max(1, round(w * scale)), max(1, round(h * scale)))
+        # reducing_gap: szybkie zmniejszenie całkowitym krokiem, potem LANCZOS
+        image = image.resize(new_size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+    buf = BytesIO()
+    if fmt == "PNG":
+        image.save(buf, format="PNG", optimize=False)
+    else:
+        image.save(buf, format=fmt, quality=config.quality)
+    data = buf.getvalue()
+    return PreparedImage(
+        data=data,
+        mime_type=_MIME_TYPES[fmt],
+        size=image.size,
+        original_size=original_size,
+        original_nbytes=int(source_nbytes),
+        digest=hashlib.sha256(data).hexdigest(),
+    )
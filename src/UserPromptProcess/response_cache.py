@@ -0,0 +1,146 @@
+from typing import Any, Dict, List, Optional
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from PIL import Image
+
+
+def hash_image(image: Image.Image) -> str:
+    """Hash znormalizowanego obrazu (RGB, rozmiar + piksele), niezależny od formatu pliku."""
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    h = hashlib.sha256()
+    h.update(f"{image.size}".encode())
+    h.update(image.tobytes())
+    return h.hexdigest()
+
+
+def make_key(images: List[Any], prompt: str, model_id: str, config: Optional[Dict[str, Any]] = None) -> str:
+    """Klucz odpowiedzi: model + konfiguracja generowania + hashe obrazów + prompt."""
+    h = hashlib.sha256()
+    h.update(model_id.encode())
+    h.update(json.dumps(config or {}, sort_keys=True).encode())
+    for img in images:
+        # PreparedImage niesie już hash zakodowanych bajtów
+        digest = getattr(img, "digest", None)
+        h.update((digest or hash_image(img)).encode())
+    h.update(prompt.encode("utf-8"))
+    return h.hexdigest()
+
+
+class ResponseCache:
+    """
+    Cache odpowiedzi LLM: LRU w pamięci (max `max_entries`) z TTL `ttl_s` sekund
+    oraz opcjonalna trwała warstwa SQLite (`sqlite_path`), czytana przy chybieniu w pamięci.
+    """
+
+    def __init__(self, max_entries: int = 512, ttl_s: float = 24 * 3600, sqlite_path: Optional[str] = None) -> None:
+        self.max_entries = max(1, int(max_entries))
+        self.ttl_s = float(ttl_s)
+        self.sqlite_path = sqlite_path
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (created, value)
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        if sqlite_path:
+            self._db = sqlite3.connect(sqlite_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL)"
+            )
+            self._db.commit()
+        self.hits = 0
+        self.misses = 0
+        self.sqlite_hits = 0
+        self.expired = 0
+        self.evictions = 0
+        self.bypassed = 0
+
+    @classmethod
+    def from_env(cls) -> Optional["ResponseCache"]:
+        """GEMINI_CACHE=0 wyłącza cache; GEMINI_CACHE_MAX_ENTRIES, GEMINI_CACHE_TTL_S, GEMINI_CACHE_DB (ścieżka SQLite)."""
+        if os.environ.get("GEMINI_CACHE", "1") == "0":
+            return None
+        return cls(
+            max_entries=int(os.environ.get("GEMINI_CACHE_MAX_ENTRIES", "512")),
+            ttl_s=float(os.environ.get("GEMINI_CACHE_TTL_S", str(24 * 3600))),
+            sqlite_path=os.environ.get("GEMINI_CACHE_DB") or None,
+        )
+
+    def _fresh(self, created: float) -> bool:
+        return self.ttl_s <= 0 or time.time() - created < self.ttl_s
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            expired = False
+            item = self._entries.get(key)
+            if item is not None:
+                if self._fresh(item[0]):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return item[1]
+                del self._entries[key]
+                expired = True
+            if self._db is not None:
+                row = self._db.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    value, created = row
+                    if self._fresh(created):
+                        self._insert(key, created, value)
+                        self.hits += 1
+                        self.sqlite_hits += 1
+                        return value
+                    self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._db.commit()
+                    expired = True
+            self.expired += int(expired)
+            self.misses += 1
+            return None
+
+    def _insert(self, key: str, created: float, value: str) -> None:
+        self._entries[key] = (created, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def put(self, key: str, value: str) -> None:
+        created = time.time()
+        with self._lock:
+            self._insert(key, created, value)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, created) VALUES (?, ?, ?)", (key, value, created)
+                )
+                self._db.commit()
+
+    def record_bypass(self) -> None:
+        with self._lock:
+            self.bypassed += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_s": self.ttl_s,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "sqlite_hits": self.sqlite_hits,
+                "expired": self.expired,
+                "evictions": self.evictions,
+                "bypassed": self.bypassed,
+                "sqlite_path": self.sqlite_path,
+            }
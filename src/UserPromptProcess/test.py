@@ -24,7 +24,7 @@ def test_suggest_classes():
     
     try:
         # Wywołanie funkcji
-        result = chat.suggest_classes(IMG_PATH, history, proposed)
+        result = chat.suggest_classes(IMG_PATH, history)
         
         print(f"\n[RAW RESULT LIST]: {result}")
         print(f"Liczba klas: {len(result)}")
@@ -53,7 +53,7 @@ def test_chat_answer():
     
     try:
         # Wywołanie funkcji
-        raw_response = chat._MODEL.predict([chat._load_image(IMG_PATH)], "Opisz krótko co jest na zdjęciu (test RAW).")
+        raw_response = chat.get_model().predict([chat._load_image(IMG_PATH)], "Opisz krótko co jest na zdjęciu (test RAW).")
         print(f"\n[PODGLĄD SUROWEJ ODPOWIEDZI MODELU NA PROSTY PROMPT]:\n{raw_response}\n")
 
         print("-" * 20)
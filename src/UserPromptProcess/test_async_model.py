@@ -0,0 +1,137 @@
+"""Model.apredict / predict against a local fake Gemini server (slow and failing responses).
+
+Run from `src/`:  python -m pytest -q UserPromptProcess/test_async_model.py
+"""
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from PIL import Image
+
+pytest.importorskip("google.genai")
+from google import genai
+from google.genai import types
+
+from UserPromptProcess.chat import Model
+from UserPromptProcess.response_cache import ResponseCache
+
+
+class FakeGemini:
+    """Scripted generateContent endpoint: each request pops the next (status, delay_s) step."""
+
+    def __init__(self):
+        self.steps = []
+        self.requests = 0
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                with fake.lock:
+                    fake.requests += 1
+                    fake.active += 1
+                    fake.max_active = max(fake.max_active, fake.active)
+                    status, delay = fake.steps.pop(0) if fake.steps else (200, 0.0)
+                try:
+                    time.sleep(delay)
+                    if status == 200:
+                        body = {"candidates": [{"content": {"role": "model", "parts": [{"text": " ok "}]},
+                                                "finishReason": "STOP"}]}
+                    else:
+                        body = {"error": {"code": status, "message": "fake failure", "status": "UNAVAILABLE"}}
+                    data = json.dumps(body).encode()
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+                finally:
+                    with fake.lock:
+                        fake.active -= 1
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def server():
+    fake = FakeGemini()
+    yield fake
+    fake.close()
+
+
+def make_model(server, timeout_s=2.0, max_retries=2, max_concurrency=8):
+    client = genai.Client(api_key="test", http_options=types.HttpOptions(base_url=server.url))
+    model = Model(client=client, cache=ResponseCache(), timeout_s=timeout_s,
+                  max_retries=max_retries, max_concurrency=max_concurrency)
+    model.backoff_s = 0.01
+    return model
+
+
+IMAGE = Image.new("RGB", (64, 64), (120, 80, 40))
+
+
+def test_apredict_ok_and_cached(server):
+    model = make_model(server)
+    assert asyncio.run(model.apredict([IMAGE], "prompt")) == "ok"
+    assert asyncio.run(model.apredict([IMAGE], "prompt")) == "ok"
+    assert server.requests == 1
+
+
+def test_retries_transient_failures(server):
+    server.steps = [(503, 0.0), (500, 0.0)]
+    model = make_model(server)
+    assert asyncio.run(model.apredict([IMAGE], "prompt", use_cache=False)) == "ok"
+    assert server.requests == 3
+
+
+def test_gives_up_after_max_retries(server):
+    server.steps = [(503, 0.0)] * 5
+    model = make_model(server, max_retries=1)
+    with pytest.raises(RuntimeError, match="Błąd Gemini API"):
+        asyncio.run(model.apredict([IMAGE], "prompt", use_cache=False))
+    assert server.requests == 2
+
+
+def test_client_error_is_not_retried(server):
+    server.steps = [(400, 0.0)]
+    model = make_model(server)
+    with pytest.raises(RuntimeError):
+        model.predict([IMAGE], "prompt", use_cache=False)
+    assert server.requests == 1
+
+
+def test_slow_response_hits_deadline_then_retries(server):
+    server.steps = [(200, 1.0)]
+    model = make_model(server, timeout_s=0.3, max_retries=1)
+    t0 = time.perf_counter()
+    assert asyncio.run(model.apredict([IMAGE], "prompt", use_cache=False)) == "ok"
+    assert time.perf_counter() - t0 < 1.0
+    assert server.requests == 2
+
+
+def test_semaphore_limits_in_flight_calls(server):
+    server.steps = [(200, 0.2)] * 6
+    model = make_model(server, max_concurrency=2)
+
+    async def burst():
+        return await asyncio.gather(*[model.apredict([IMAGE], f"prompt {i}") for i in range(6)])
+
+    assert asyncio.run(burst()) == ["ok"] * 6
+    assert server.max_active <= 2
@@ -0,0 +1,82 @@
+"""ResponseCache / make_key: keys, LRU + TTL and the SQLite tier.
+
+Run from `src/`:  python -m pytest -q UserPromptProcess/test_response_cache.py
+"""
+from types import SimpleNamespace
+
+from PIL import Image
+
+from UserPromptProcess import response_cache
+from UserPromptProcess.image_prep import prepare_image
+from UserPromptProcess.response_cache import ResponseCache, make_key
+
+
+def _clock(monkeypatch, start: float = 1000.0) -> list:
+    """Freeze response_cache's clock; returns a one-item list to move it."""
+    now = [start]
+    monkeypatch.setattr(response_cache, "time", SimpleNamespace(time=lambda: now[0]))
+    return now
+
+
+def test_key_covers_image_prompt_and_model():
+    red, blue = Image.new("RGB", (8, 8), "red"), Image.new("RGB", (8, 8), "blue")
+    key = make_key([red], "what is this?", "gemini-a")
+    # same pixels in another mode / object: same key
+    assert make_key([red.convert("RGBA").convert("RGB")], "what is this?", "gemini-a") == key
+    assert len({
+        key,
+        make_key([blue], "what is this?", "gemini-a"),
+        make_key([red], "what is that?", "gemini-a"),
+        make_key([red], "what is this?", "gemini-b"),
+        make_key([red], "what is this?", "gemini-a", {"temperature": 0.5}),
+    }) == 5
+    # prepared images are keyed by their encoded bytes
+    prepared_key = make_key([prepare_image(red)], "what is this?", "gemini-a")
+    assert make_key([prepare_image(red)], "what is this?", "gemini-a") == prepared_key
+    assert make_key([prepare_image(blue)], "what is this?", "gemini-a") != prepared_key
+
+    cache = ResponseCache()
+    cache.put(key, "a red square")
+    assert cache.get(key) == "a red square"
+    assert cache.get(make_key([blue], "what is this?", "gemini-a")) is None
+    assert (cache.stats()["hits"], cache.stats()["misses"]) == (1, 1)
+
+
+def test_lru_and_ttl(monkeypatch):
+    now = _clock(monkeypatch)
+    cache = ResponseCache(max_entries=2, ttl_s=60)
+    cache.put("a", "A")
+    cache.put("b", "B")
+    assert cache.get("a") == "A"
+    cache.put("c", "C")  # evicts "b", the least recently used
+    assert cache.get("b") is None and cache.get("a") == "A" and cache.get("c") == "C"
+
+    now[0] += 59
+    assert cache.get("a") == "A"
+    now[0] += 1
+    assert cache.get("a") is None and cache.get("c") is None
+    stats = cache.stats()
+    assert (stats["evictions"], stats["expired"], stats["entries"]) == (1, 2, 0)
+
+    forever = ResponseCache(ttl_s=0)
+    forever.put("a", "A")
+    now[0] += 10 ** 9
+    assert forever.get("a") == "A"
+
+
+def test_sqlite_tier_survives_restart_and_expires(tmp_path, monkeypatch):
+    now = _clock(monkeypatch)
+    db = str(tmp_path / "responses.sqlite")
+    first = ResponseCache(ttl_s=60, sqlite_path=db)
+    first.put("a", "A")
+    first.put("b", "B")
+
+    restarted = ResponseCache(ttl_s=60, sqlite_path=db)
+    assert restarted.get("a") == "A"
+    assert restarted.stats()["sqlite_hits"] == 1
+    assert restarted.get("a") == "A" and restarted.stats()["sqlite_hits"] == 1  # now served from memory
+
+    now[0] += 60
+    assert restarted.get("b") is None and restarted.stats()["expired"] == 1
+    assert ResponseCache(ttl_s=0, sqlite_path=db).get("b") is None  # expired rows are deleted
+    assert ResponseCache(ttl_s=0, sqlite_path=db).get("a") == "A"
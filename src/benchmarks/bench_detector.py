@@ -0,0 +1,74 @@
+"""Benchmark: ZeroShotDetector, legacy transformers pipeline (one full forward per image
+and label) vs. cached text embeddings + one vision pass per `--batch_size` tiles.
+
+Run from `src/`:
+    python -m benchmarks.bench_detector --image Images/ortho.png --tile_size 768 --batch_size 8
+"""
+import argparse
+import time
+from typing import Any, Dict, List
+
+from PIL import Image
+from transformers import pipeline
+
+from DetectSegment.models.detector import ZeroShotDetector
+from DetectSegment.utils.tiling import iter_tiles
+
+CLASS_POOL = [
+    "excavator", "helmet", "pipe", "scaffolding", "worker",
+    "crane", "truck", "dirt road", "container", "fence",
+]
+
+
+def same_detections(a: List[Dict[str, Any]], b: List[Dict[str, Any]], tol: float = 1e-4) -> bool:
+    return len(a) == len(b) and all(
+        x["label"] == y["label"] and x["box"] == y["box"] and abs(x["score"] - y["score"]) <= tol
+        for x, y in zip(a, b)
+    )
+
+
+def time_it(fn, repeats: int):
+    """Return (best wall time in seconds, result of the last call)."""
+    best = float("inf")
+    result = None
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+
+def main():
+    p = argparse.ArgumentParser("Zero-shot detector batching benchmark")
+    p.add_argument("--image", default="Images/ortho.png")
+    p.add_argument("--model", default="google/owlvit-base-patch32")
+    p.add_argument("--tile_size", type=int, default=768)
+    p.add_argument("--tile_overlap", type=int, default=128)
+    p.add_argument("--max_classes", type=int, default=len(CLASS_POOL))
+    p.add_argument("--batch_size", type=int, default=8)
+    p.add_argument("--repeats", type=int, default=1)
+    args = p.parse_args()
+
+    image = Image.open(args.image).convert("RGB")
+    tiles = [tile for _, tile in iter_tiles(image, args.tile_size, args.tile_overlap)]
+    classes = CLASS_POOL[:args.max_classes]
+
+    detector = ZeroShotDetector(args.model, confidence_threshold=0.0, batch_size=args.batch_size)
+    legacy = pipeline(task="zero-shot-object-detection", model=args.model,
+                      device=0 if detector.device == "cuda" else -1)
+
+    print(f"{len(tiles)} tiles of {args.tile_size}px, {len(classes)} classes")
+    t_legacy, legacy_res = time_it(lambda: [legacy(t, candidate_labels=classes) for t in tiles], args.repeats)
+    t_single, _ = time_it(lambda: [detector.predict(t, classes) for t in tiles], args.repeats)
+    t_batched, batched_res = time_it(lambda: detector.predict_batch(tiles, classes), args.repeats)
+    same = all(same_detections(a, b) for a, b in zip(legacy_res, batched_res))
+
+    print(f"{'variant':>18} {'seconds':>8} {'speedup':>8}")
+    print(f"{'legacy pipeline':>18} {t_legacy:>8.2f} {1.0:>7.2f}x")
+    print(f"{'cached, per tile':>18} {t_single:>8.2f} {t_legacy / t_single:>7.2f}x")
+    print(f"{'cached, batched':>18} {t_batched:>8.2f} {t_legacy / t_batched:>7.2f}x")
+    print(f"same detections: {same}; text cache: {detector.cache_stats()}")
+
+
+if __name__ == "__main__":
+    main()
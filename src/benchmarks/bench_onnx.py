@@ -0,0 +1,149 @@
+"""Benchmark: eager PyTorch vs. ONNX Runtime (CPU) for OWL-ViT detection and SAM v1
+image encoding + box-prompted mask decoding, with output parity against torch.
+
+Reported per backend: median seconds per image for the detector (`predict`), the SAM
+encoder (`set_image`) and the SAM decoder (`--boxes` box prompts), plus box / mask IoU
+of the ONNX Runtime outputs against torch. `--ort_threads 1,4,0` compares intra-op
+thread counts (0: ONNX Runtime default, all cores).
+
+Run from `src/` (exports the graphs first unless `--onnx_dir` already holds them):
+    python -m benchmarks.bench_onnx --images Images --sam_checkpoint models/sam_vit_b_01ec64.pth \\
+        --sam_model_type vit_b --onnx_dir onnx_models --ort_threads 1,0
+"""
+import argparse
+import statistics
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+import torch
+from PIL import Image
+
+from DetectSegment.models.detector import ZeroShotDetector
+from DetectSegment.models.onnx_backend import (
+    DETECTOR_IMAGE,
+    OrtSAMSegmenter,
+    OrtZeroShotDetector,
+    export_detector,
+    export_sam_checkpoint,
+    sam_encoder_file,
+)
+from DetectSegment.models.sam_segmenter import SAMSegmenter
+from DetectSegment.pipelines.batch import collect_inputs
+
+from benchmarks.bench_precision import box_iou, mask_iou
+
+
+def time_it(fn: Callable[[], Any], repeats: int):
+    best = float("inf")
+    result = None
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+
+def random_boxes(image: Image.Image, n: int, seed: int = 0) -> List[Dict[str, Any]]:
+    rng = np.random.default_rng(seed)
+    w, h = image.size
+    boxes = []
+    for _ in range(n):
+        x0, x1 = sorted(rng.integers(0, w, 2))
+        y0, y1 = sorted(rng.integers(0, h, 2))
+        boxes.append({"box": {"xmin": int(x0), "ymin": int(y0), "xmax": int(x1) + 1, "ymax": int(y1) + 1}})
+    return boxes
+
+
+def run_backend(detector, segmenter, images: List[Image.Image], classes: List[str], n_boxes: int, repeats: int):
+    detector.predict(images[0], classes)
+    segmenter.segment_with_boxes(images[0], random_boxes(images[0], 1))
+    det_s, enc_s, dec_s, dets, masks = [], [], [], [], []
+    for i, image in enumerate(images):
+        t, out = time_it(lambda: detector.predict(image, classes), repeats)
+        det_s.append(t)
+        dets.append(out)
+        image_np = np.array(image)
+        t, _ = time_it(lambda: segmenter.set_image(image_np), repeats)
+        enc_s.append(t)
+        boxes = np.stack([segmenter._box_to_np(b["box"]) for b in random_boxes(image, n_boxes, seed=i)])
+        t, out = time_it(lambda: list(segmenter._predict_boxes(boxes)), repeats)
+        dec_s.append(t)
+        masks.append(out)
+    return {
+        "detector_s": statistics.median(det_s),
+        "encoder_s": statistics.median(enc_s),
+        "decoder_s": statistics.median(dec_s),
+        "dets": dets,
+        "masks": masks,
+    }
+
+
+def main():
+    p = argparse.ArgumentParser("PyTorch vs ONNX Runtime")
+    p.add_argument("--images", default="Images", help="Image directory, glob or manifest")
+    p.add_argument("--classes", nargs="+", default=["excavator", "truck", "worker", "pipe"])
+    p.add_argument("--detector_model", default="google/owlvit-base-patch32")
+    p.add_argument("--sam_checkpoint", required=True)
+    p.add_argument("--sam_model_type", default="vit_b", choices=["vit_h", "vit_l", "vit_b"])
+    p.add_argument("--onnx_dir", default="onnx_models")
+    p.add_argument("--ort_threads", default="0", help="Comma separated intra-op thread counts (0: default)")
+    p.add_argument("--max_images", type=int, default=4)
+    p.add_argument("--max_side", type=int, default=1024)
+    p.add_argument("--boxes", type=int, default=16, help="Box prompts per image for the SAM decoder")
+    p.add_argument("--repeats", type=int, default=3)
+    args = p.parse_args()
+
+    paths = collect_inputs(args.images)[:args.max_images]
+    if not paths:
+        raise SystemExit(f"No images found for {args.images!r}")
+    images = []
+    for path in paths:
+        image = Image.open(path).convert("RGB")
+        if args.max_side:
+            image.thumbnail((args.max_side, args.max_side))
+        images.append(image)
+
+    onnx_dir = Path(args.onnx_dir)
+    if not (onnx_dir / DETECTOR_IMAGE).exists():
+        t0 = time.perf_counter()
+        export_detector(args.detector_model, str(onnx_dir))
+        print(f"exported detector in {time.perf_counter() - t0:.1f}s")
+    if not (onnx_dir / sam_encoder_file(args.sam_model_type)).exists():
+        t0 = time.perf_counter()
+        export_sam_checkpoint(args.sam_checkpoint, args.sam_model_type, str(onnx_dir))
+        print(f"exported SAM {args.sam_model_type} in {time.perf_counter() - t0:.1f}s")
+
+    print(f"{len(images)} images, {args.boxes} boxes, torch threads: {torch.get_num_threads()}")
+    ref = run_backend(
+        ZeroShotDetector(args.detector_model, device="cpu", confidence_threshold=0.1),
+        SAMSegmenter(args.sam_checkpoint, args.sam_model_type, device="cpu"),
+        images, args.classes, args.boxes, args.repeats,
+    )
+    rows = [("torch", ref, {})]
+    for threads in [int(t) for t in args.ort_threads.split(",") if t.strip()]:
+        res = run_backend(
+            OrtZeroShotDetector(str(onnx_dir), confidence_threshold=0.1, num_threads=threads or None),
+            OrtSAMSegmenter(str(onnx_dir), args.sam_model_type, num_threads=threads or None),
+            images, args.classes, args.boxes, args.repeats,
+        )
+        ious = [
+            max((box_iou(r["box"], d["box"]) for d in dets if d["label"] == r["label"]), default=0.0)
+            for ref_dets, dets in zip(ref["dets"], res["dets"]) for r in ref_dets
+        ]
+        m_ious = [mask_iou(a, b) for ra, oa in zip(ref["masks"], res["masks"]) for a, b in zip(ra, oa)]
+        rows.append((f"ort/{threads or 'all'}", res, {
+            "box_iou": float(np.mean(ious)) if ious else 1.0,
+            "mask_iou": float(np.mean(m_ious)) if m_ious else 1.0,
+            "min_mask_iou": float(min(m_ious, default=1.0)),
+        }))
+
+    print(f"{'backend':>9}  {'detector':>9}  {'encoder':>9}  {'decoder':>9}  parity vs torch")
+    for name, res, parity in rows:
+        speed = "  ".join(f"{res[k]:8.3f}s" for k in ("detector_s", "encoder_s", "decoder_s"))
+        print(f"{name:>9}  {speed}  " + "  ".join(f"{k}={v:.4f}" for k, v in parity.items()))
+
+
+if __name__ == "__main__":
+    main()
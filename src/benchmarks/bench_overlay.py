@@ -0,0 +1,89 @@
+"""Benchmark: single-pass mask renderer vs. the previous per-mask overlay code.
+
+Run from `src/`:
+    python -m benchmarks.bench_overlay --size 4000 --masks 10 50 100
+"""
+import argparse
+import time
+from typing import List
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from DetectSegment.utils.viz_utils import load_font, overlay_mask, rainbow_colors, render_masks
+
+
+def legacy_overlay_masks_with_labels(image: Image.Image, masks_np: np.ndarray, labels: List[str]) -> Image.Image:
+    """Previous app.py renderer: one RGBA layer + alpha_composite + np.where per mask."""
+    image = image.convert("RGBA")
+    masks_np = 255 * masks_np.astype(np.uint8)
+    colors = rainbow_colors(masks_np.shape[0])
+    for mask, color in zip(masks_np, colors):
+        mask_img = Image.fromarray(mask)
+        overlay = Image.new("RGBA", image.size, color + (0,))
+        alpha = mask_img.point(lambda v: int(v * 0.5))
+        overlay.putalpha(alpha)
+        image = Image.alpha_composite(image, overlay)
+    draw = ImageDraw.Draw(image)
+    font = load_font(max(4, int(min(image.size) * 0.02)))
+    for idx, (mask, color) in enumerate(zip(masks_np, colors)):
+        ys, xs = np.where(mask > 0)
+        if len(xs) == 0:
+            continue
+        x1, y1, x2, y2 = xs.min(), ys.min(), xs.max(), ys.max()
+        draw.rectangle([(x1, y1), (x2, y2)], outline=color + (255,), width=3)
+        tb = draw.textbbox((0, 0), labels[idx], font=font)
+        draw.rectangle([(x1, y1 - (tb[3] - tb[1]) - 4), (x1 + tb[2] - tb[0] + 4, y1)], fill=(0, 0, 0, 160))
+        draw.text((x1 + 2, y1 - (tb[3] - tb[1]) - 2), labels[idx], fill=(255, 255, 255), font=font)
+    return image
+
+
+def legacy_overlay_mask(image: Image.Image, mask: np.ndarray, color=(0, 255, 0), alpha: float = 0.5) -> Image.Image:
+    """Previous viz_utils.overlay_mask: float32 full-image blend."""
+    base = np.array(image).astype(np.float32)
+    overlay = np.zeros_like(base)
+    overlay[mask.astype(bool)] = color
+    return Image.fromarray((base * (1 - alpha) + overlay * alpha).astype(np.uint8))
+
+
+def synthetic(size: int, n: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    image = Image.fromarray(rng.integers(0, 256, (size, size, 3), dtype=np.uint8))
+    masks = np.zeros((n, size, size), dtype=bool)
+    for i in range(n):
+        h, w = rng.integers(size // 40, size // 8, 2)
+        y, x = rng.integers(0, size - h), rng.integers(0, size - w)
+        masks[i, y:y + h, x:x + w] = True
+    return image, masks
+
+
+def timed(fn) -> float:
+    t0 = time.perf_counter()
+    fn()
+    return time.perf_counter() - t0
+
+
+def main():
+    p = argparse.ArgumentParser("Overlay renderer benchmark")
+    p.add_argument("--size", type=int, default=3000, help="Square image side (pixels)")
+    p.add_argument("--masks", type=int, nargs="+", default=[10, 50, 100])
+    args = p.parse_args()
+
+    print(f"{'masks':>6} {'legacy_s':>9} {'render_s':>9} {'speedup':>8} "
+          f"{'legacy_mask_s':>13} {'overlay_mask_s':>14} {'same_mask':>9}")
+    for n in args.masks:
+        image, masks = synthetic(args.size, n)
+        labels = [f"class_{i % 5}" for i in range(n)]
+        t_old = timed(lambda: legacy_overlay_masks_with_labels(image, masks, labels))
+        t_new = timed(lambda: render_masks(image, masks, labels))
+        t_old_m = timed(lambda: legacy_overlay_mask(image, masks[0]))
+        t_new_m = timed(lambda: overlay_mask(image, masks[0]))
+        same = np.array_equal(
+            np.asarray(legacy_overlay_mask(image, masks[0])), np.asarray(overlay_mask(image, masks[0]))
+        )
+        print(f"{n:>6} {t_old:>9.3f} {t_new:>9.3f} {t_old / t_new:>7.1f}x "
+              f"{t_old_m:>13.3f} {t_new_m:>14.3f} {str(same):>9}")
+
+
+if __name__ == "__main__":
+    main()
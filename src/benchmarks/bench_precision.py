@@ -0,0 +1,209 @@
+"""Benchmark: precision modes (fp32 / bf16 autocast / int8 dynamic quantization) of
+OWL-ViT, SAM v1 and SAM3 on a local image set - latency, model size and agreement with fp32.
+
+Agreement is measured against the fp32 run of the same model on the same inputs:
+- owlvit: for every fp32 box, the best IoU with a same-label box of the mode
+  (`box_iou` = mean, `recall@0.5` = share matched at IoU >= 0.5)
+- sam: mask IoU per box prompt; prompts are the fp32 OWL-ViT boxes when owlvit is
+  benchmarked too, otherwise a fixed grid of boxes (`mask_iou` mean, `min_iou`)
+- sam3: per image and class, IoU of the union of all instance masks (`mask_iou`),
+  plus the mean absolute difference in instance count (`count_diff`)
+
+Run from `src/`:
+    python -m benchmarks.bench_precision --images Images --classes excavator truck worker \\
+        --models owlvit,sam,sam3 --sam_checkpoint models/sam_vit_b_01ec64.pth --sam_model_type vit_b
+"""
+import argparse
+import io
+import json
+import statistics
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+import torch
+from PIL import Image
+
+from DetectSegment.pipelines.batch import collect_inputs
+from DetectSegment.utils.precision import PRECISIONS
+
+
+def mask_iou(a: np.ndarray, b: np.ndarray) -> float:
+    union = np.logical_or(a, b).sum()
+    return float(np.logical_and(a, b).sum() / union) if union else 1.0
+
+
+def box_iou(a: Dict[str, float], b: Dict[str, float]) -> float:
+    iw = max(0.0, min(a["xmax"], b["xmax"]) - max(a["xmin"], b["xmin"]))
+    ih = max(0.0, min(a["ymax"], b["ymax"]) - max(a["ymin"], b["ymin"]))
+    inter = iw * ih
+    area = lambda r: max(0.0, r["xmax"] - r["xmin"]) * max(0.0, r["ymax"] - r["ymin"])  # noqa: E731
+    union = area(a) + area(b) - inter
+    return inter / union if union else 1.0
+
+
+def model_nbytes(model: torch.nn.Module) -> int:
+    """Serialized state_dict size (counts packed int8 weights, which parameters() does not)."""
+    buf = io.BytesIO()
+    torch.save(model.state_dict(), buf)
+    return buf.tell()
+
+
+def grid_boxes(image: Image.Image, n: int = 3) -> List[Dict[str, Any]]:
+    w, h = image.size
+    return [
+        {"box": {"xmin": int(c * w / n), "ymin": int(r * h / n),
+                 "xmax": int((c + 1) * w / n) - 1, "ymax": int((r + 1) * h / n) - 1},
+         "label": "object", "score": 1.0}
+        for r in range(n) for c in range(n)
+    ]
+
+
+def run_mode(load: Callable[[], Any], infer: Callable[[Any, Image.Image], Any],
+             images: List[Image.Image], repeats: int) -> Dict[str, Any]:
+    """Load once, warm up on the first image, then time every image (best of `repeats`)."""
+    t0 = time.perf_counter()
+    model = load()
+    load_s = time.perf_counter() - t0
+    infer(model, images[0])
+    outputs, seconds = [], []
+    for image in images:
+        best = float("inf")
+        for _ in range(repeats):
+            t0 = time.perf_counter()
+            out = infer(model, image)
+            best = min(best, time.perf_counter() - t0)
+        outputs.append(out)
+        seconds.append(best)
+    return {"model": model, "outputs": outputs, "seconds": seconds, "load_s": load_s}
+
+
+def compare_owlvit(ref: List[List[Dict[str, Any]]], out: List[List[Dict[str, Any]]]) -> Dict[str, float]:
+    ious = []
+    for ref_dets, dets in zip(ref, out):
+        for r in ref_dets:
+            same = [box_iou(r["box"], d["box"]) for d in dets if d["label"] == r["label"]]
+            ious.append(max(same, default=0.0))
+    return {
+        "box_iou": float(np.mean(ious)) if ious else 1.0,
+        "recall@0.5": float(np.mean([i >= 0.5 for i in ious])) if ious else 1.0,
+    }
+
+
+def compare_masks(ref: List[List[np.ndarray]], out: List[List[np.ndarray]]) -> Dict[str, float]:
+    ious = [mask_iou(a, b) for ra, oa in zip(ref, out) for a, b in zip(ra, oa)]
+    return {"mask_iou": float(np.mean(ious)) if ious else 1.0, "min_iou": float(min(ious, default=1.0))}
+
+
+def compare_sam3(ref: List[List[Dict[str, Any]]], out: List[List[Dict[str, Any]]]) -> Dict[str, float]:
+    ious, count_diff = [], []
+    for ref_classes, classes in zip(ref, out):
+        for r, o in zip(ref_classes, classes):
+            ious.append(mask_iou(r["union"], o["union"]))
+            count_diff.append(abs(r["count"] - o["count"]))
+    return {"mask_iou": float(np.mean(ious)) if ious else 1.0, "count_diff": float(np.mean(count_diff or [0]))}
+
+
+def sam3_summary(results: List[Dict[str, Any]], size) -> List[Dict[str, Any]]:
+    w, h = size
+    return [
+        {"union": r["masks"].bool().any(dim=0).cpu().numpy() if len(r["masks"]) else np.zeros((h, w), bool),
+         "count": len(r["masks"])}
+        for r in results
+    ]
+
+
+def main():
+    p = argparse.ArgumentParser("Precision mode accuracy vs latency")
+    p.add_argument("--images", default="Images", help="Image directory, glob or manifest")
+    p.add_argument("--classes", nargs="+", default=["excavator", "truck", "worker", "pipe"])
+    p.add_argument("--models", default="owlvit,sam", help="Comma separated: owlvit, sam, sam3")
+    p.add_argument("--precisions", default=",".join(PRECISIONS))
+    p.add_argument("--max_images", type=int, default=8)
+    p.add_argument("--max_side", type=int, default=1024, help="Downscale inputs so runs stay short (0: keep)")
+    p.add_argument("--repeats", type=int, default=1)
+    p.add_argument("--detector_model", default="google/owlvit-base-patch32")
+    p.add_argument("--sam_checkpoint", default=None)
+    p.add_argument("--sam_model_type", default="vit_b")
+    p.add_argument("--sam3_model", default="facebook/sam3")
+    p.add_argument("--device", default="cpu")
+    p.add_argument("--out", default=None, help="Also write the report as JSON")
+    args = p.parse_args()
+
+    paths = collect_inputs(args.images)[:args.max_images]
+    if not paths:
+        raise SystemExit(f"No images found for {args.images!r}")
+    images = []
+    for path in paths:
+        image = Image.open(path).convert("RGB")
+        if args.max_side:
+            image.thumbnail((args.max_side, args.max_side))
+        images.append(image)
+    models = [m.strip() for m in args.models.split(",") if m.strip()]
+    precisions = [m.strip() for m in args.precisions.split(",") if m.strip()]
+    if "fp32" not in precisions:
+        precisions.insert(0, "fp32")
+    print(f"{len(images)} images, {len(args.classes)} classes, torch threads: {torch.get_num_threads()}")
+
+    report: List[Dict[str, Any]] = []
+    prompts: Optional[List[List[Dict[str, Any]]]] = None
+    for name in models:
+        if name == "owlvit":
+            from DetectSegment.models.detector import ZeroShotDetector
+            load = lambda prec: ZeroShotDetector(args.detector_model, device=args.device,  # noqa: E731
+                                                 confidence_threshold=0.1, precision=prec)
+            infer = lambda m, im: m.predict(im, args.classes)  # noqa: E731
+            compare, module = compare_owlvit, lambda m: m.model  # noqa: E731
+        elif name == "sam":
+            if not args.sam_checkpoint:
+                print("sam: skipped (no --sam_checkpoint)")
+                continue
+            from DetectSegment.models.sam_segmenter import SAMSegmenter
+            boxes = prompts or [grid_boxes(im) for im in images]
+            box_of = {id(im): b for im, b in zip(images, boxes)}
+            load = lambda prec: SAMSegmenter(args.sam_checkpoint, args.sam_model_type,  # noqa: E731
+                                             device=args.device, precision=prec)
+            infer = lambda m, im: [s["mask"] for s in m.segment_with_boxes(im, box_of[id(im)])]  # noqa: E731
+            compare, module = compare_masks, lambda m: m.sam  # noqa: E731
+        elif name == "sam3":
+            from DetectSegment.models.sam3_segmenter import Sam3Segmenter
+            load = lambda prec: Sam3Segmenter(args.sam3_model, device=args.device, precision=prec)  # noqa: E731
+            infer = lambda m, im: sam3_summary(m.predict_for_classes(im, args.classes), im.size)  # noqa: E731
+            compare, module = compare_sam3, lambda m: m.model  # noqa: E731
+        else:
+            raise SystemExit(f"Unknown model {name!r}")
+
+        ref = None
+        for prec in precisions:
+            try:
+                res = run_mode(lambda: load(prec), infer, images, args.repeats)
+            except (ValueError, RuntimeError) as e:
+                print(f"{name} {prec}: skipped ({e})")
+                continue
+            if prec == "fp32":
+                ref = res
+                if name == "owlvit":
+                    prompts = [[d for d in dets[:16]] or grid_boxes(im) for dets, im in zip(res["outputs"], images)]
+            row = {
+                "model": name,
+                "precision": prec,
+                "median_s": statistics.median(res["seconds"]),
+                "speedup": statistics.median(ref["seconds"]) / statistics.median(res["seconds"]),
+                "load_s": res["load_s"],
+                "model_mb": model_nbytes(module(res["model"])) / 2 ** 20,
+                **compare(ref["outputs"], res["outputs"]),
+            }
+            report.append(row)
+            del res
+            metrics = "  ".join(f"{k}={v:.3f}" for k, v in row.items() if k not in ("model", "precision", "median_s",
+                                                                                    "speedup", "load_s", "model_mb"))
+            print(f"{name:>7} {prec:>5}  {row['median_s']:7.3f}s/img  {row['speedup']:5.2f}x  "
+                  f"{row['model_mb']:7.1f} MB  {metrics}")
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
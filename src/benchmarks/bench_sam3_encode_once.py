@@ -0,0 +1,84 @@
+"""Benchmark: SAM3 per-class full forward vs. encode-once + per-class decoder
+vs. encode-once + batched decoder (`--batch_size` prompts per forward pass).
+
+Run from `src/`:
+    python -m benchmarks.bench_sam3_encode_once --image Images/ortho.png --max_classes 10
+"""
+import argparse
+import time
+from typing import List
+
+import torch
+from PIL import Image
+
+from DetectSegment.models.sam3_segmenter import Sam3Segmenter
+
+CLASS_POOL = [
+    "excavator", "helmet", "pipe", "scaffolding", "worker",
+    "crane", "truck", "dirt road", "container", "fence",
+]
+
+
+def legacy_predict(seg: Sam3Segmenter, image: Image.Image, class_name: str):
+    """Previous app.py behaviour: full image + text forward for every class."""
+    inputs = seg.processor(images=image, text=class_name, return_tensors="pt").to(seg.device)
+    with torch.no_grad():
+        outputs = seg.model(**inputs)
+    return seg.processor.post_process_instance_segmentation(
+        outputs,
+        threshold=0.60,
+        mask_threshold=0.5,
+        target_sizes=inputs.get("original_sizes").tolist(),
+    )[0]
+
+
+def time_it(fn, repeats: int):
+    """Return (best wall time in seconds, result of the last call)."""
+    best = float("inf")
+    result = None
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+
+def main():
+    p = argparse.ArgumentParser("SAM3 encode-once benchmark")
+    p.add_argument("--image", default="Images/ortho.png")
+    p.add_argument("--model", default="facebook/sam3")
+    p.add_argument("--max_classes", type=int, default=len(CLASS_POOL))
+    p.add_argument("--repeats", type=int, default=1)
+    p.add_argument("--batch_size", type=int, default=4)
+    args = p.parse_args()
+
+    seg = Sam3Segmenter(args.model)
+    image = Image.open(args.image).convert("RGB")
+
+    print(
+        f"{'classes':>7} {'legacy_s':>9} {'encode_once_s':>13} {'batched_s':>9} "
+        f"{'speedup':>8} {'batched_speedup':>15} {'same':>5}"
+    )
+    for n in range(1, min(args.max_classes, len(CLASS_POOL)) + 1):
+        classes: List[str] = CLASS_POOL[:n]
+        t_legacy, legacy_res = time_it(
+            lambda: [legacy_predict(seg, image, c) for c in classes], args.repeats
+        )
+        t_new, new_res = time_it(
+            lambda: seg.predict_for_classes(image, classes, batch_size=1), args.repeats
+        )
+        t_batched, batched_res = time_it(
+            lambda: seg.predict_for_classes(image, classes, batch_size=args.batch_size), args.repeats
+        )
+        same = all(
+            torch.equal(a["masks"], b["masks"]) and torch.equal(a["masks"], c["masks"])
+            for a, b, c in zip(legacy_res, new_res, batched_res)
+        )
+        print(
+            f"{n:>7} {t_legacy:>9.2f} {t_new:>13.2f} {t_batched:>9.2f} "
+            f"{t_legacy / t_new:>7.2f}x {t_legacy / t_batched:>14.2f}x {str(same):>5}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Benchmark: SAMSegmenter box prompts, legacy per-box `SamPredictor.predict` loop
+vs. batched prompt encoder + mask decoder (`--box_batch_size` boxes per forward pass).
+
+The image embedding is computed once up front, so only the prompt/decoder stage is timed.
+`diff_px` counts mask pixels that differ from the legacy loop (threshold ties under a
+different matmul reduction order); `min_iou` is the worst per-box agreement.
+Without `--checkpoint` the model has random weights: timings and the identity check are
+still meaningful, the masks themselves are not.
+
+Run from `src/`:
+    python -m benchmarks.bench_sam_boxes --checkpoint models/sam_vit_b_01ec64.pth --model_type vit_b
+"""
+import argparse
+import os
+import tempfile
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+import torch
+from PIL import Image
+
+from DetectSegment.models.sam_segmenter import SAMSegmenter
+from segment_anything import sam_model_registry
+
+BOX_COUNTS = [1, 5, 20, 50, 100, 200]
+
+
+def synthetic_image(size: int, seed: int = 0) -> Image.Image:
+    rng = np.random.default_rng(seed)
+    return Image.fromarray(rng.integers(0, 256, (size, size, 3), dtype=np.uint8))
+
+
+def random_boxes(n: int, size: int, seed: int = 0) -> List[Dict[str, Any]]:
+    rng = np.random.default_rng(seed)
+    boxes = []
+    for _ in range(n):
+        x0, y0 = rng.integers(0, size - 16, 2)
+        w, h = rng.integers(8, max(9, size // 3), 2)
+        boxes.append({
+            "box": {"xmin": int(x0), "ymin": int(y0),
+                    "xmax": int(min(size - 1, x0 + w)), "ymax": int(min(size - 1, y0 + h))},
+            "label": "object",
+            "score": 1.0,
+        })
+    return boxes
+
+
+def legacy_segment(seg: SAMSegmenter, boxes: List[Dict[str, Any]]) -> List[np.ndarray]:
+    """Previous segment_with_boxes behaviour: one predictor.predict call per box."""
+    masks = []
+    for det in boxes:
+        m, _, _ = seg.predictor.predict(box=seg._box_to_np(det["box"]), multimask_output=False)
+        masks.append(m[0])
+    return masks
+
+
+def mask_iou(a: np.ndarray, b: np.ndarray) -> float:
+    union = np.logical_or(a, b).sum()
+    return float(np.logical_and(a, b).sum() / union) if union else 1.0
+
+
+def time_it(fn, repeats: int):
+    """Return (best wall time in seconds, result of the last call)."""
+    best = float("inf")
+    result = None
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+
+def main():
+    p = argparse.ArgumentParser("SAM box-prompt batching benchmark")
+    p.add_argument("--checkpoint", default=None, help="SAM checkpoint; random weights if omitted")
+    p.add_argument("--model_type", default="vit_b")
+    p.add_argument("--image_size", type=int, default=1024)
+    p.add_argument("--box_batch_size", type=int, default=None, help="default: 64 on CUDA, 4 on CPU")
+    p.add_argument("--max_boxes", type=int, default=max(BOX_COUNTS))
+    p.add_argument("--repeats", type=int, default=1)
+    args = p.parse_args()
+
+    checkpoint = args.checkpoint
+    if checkpoint is None:
+        checkpoint = os.path.join(tempfile.gettempdir(), f"sam_{args.model_type}_random.pth")
+        if not os.path.exists(checkpoint):
+            torch.manual_seed(0)
+            torch.save(sam_model_registry[args.model_type]().state_dict(), checkpoint)
+
+    seg = SAMSegmenter(checkpoint, model_type=args.model_type, box_batch_size=args.box_batch_size)
+    image = synthetic_image(args.image_size)
+    t0 = time.perf_counter()
+    seg.set_image(np.array(image))
+    print(f"image embedding: {time.perf_counter() - t0:.2f}s ({args.image_size}x{args.image_size})")
+
+    print(f"box_batch_size: {seg.box_batch_size}, device: {seg.device}")
+    print(f"{'boxes':>5} {'legacy_s':>9} {'batched_s':>9} {'speedup':>8} {'same':>5} {'diff_px':>7} {'min_iou':>7}")
+    for n in [c for c in BOX_COUNTS if c <= args.max_boxes]:
+        boxes = random_boxes(n, args.image_size)
+        input_boxes = np.stack([seg._box_to_np(det["box"]) for det in boxes])
+        t_legacy, legacy_masks = time_it(lambda: legacy_segment(seg, boxes), args.repeats)
+        t_batched, batched_masks = time_it(lambda: list(seg._predict_boxes(input_boxes)), args.repeats)
+        assert len(legacy_masks) == len(batched_masks)
+        diff_px = sum(int((a != b).sum()) for a, b in zip(legacy_masks, batched_masks))
+        min_iou = min(mask_iou(a, b) for a, b in zip(legacy_masks, batched_masks))
+        print(
+            f"{n:>5} {t_legacy:>9.3f} {t_batched:>9.3f} {t_legacy / t_batched:>7.2f}x "
+            f"{str(diff_px == 0):>5} {diff_px:>7} {min_iou:>7.4f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+"""Offline stage benchmark for the /segment_image flow and DetectAndSegmentPipeline.
+
+Uses synthetic images and a local stand-in for the Gemini model (no network calls,
+optional simulated latency), times every stage separately and writes a JSON report.
+Reports from two versions can be diffed with `--compare` to catch regressions.
+
+Run from `src/`:
+    python -m benchmarks.bench_segment_pipeline --sizes 1024 2048 --classes 1 4 8 --out bench.json
+    python -m benchmarks.bench_segment_pipeline --sam_checkpoint sam_vit_b.pth --skip_sam3 --out bench.json
+    python -m benchmarks.bench_segment_pipeline --compare old.json --out new.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+import numpy as np
+import torch
+from PIL import Image, ImageDraw
+
+import UserPromptProcess.chat as chat
+from UserPromptProcess.image_prep import ImagePrepConfig
+from DetectSegment.utils.embedding_cache import EmbeddingCache
+from DetectSegment.utils.viz_utils import render_masks
+
+CLASS_POOL = [
+    "excavator", "helmet", "pipe", "scaffolding", "worker",
+    "crane", "truck", "dirt road", "container", "fence",
+]
+
+# Substring of the suggest_classes system prompt; every other prompt is a chat answer
+_SUGGEST_MARKER = "kategorii obiektów"
+
+
+class StubChatModel:
+    """Stand-in for chat.Model: canned responses after an optional fixed delay."""
+
+    def __init__(self, classes: List[str], latency_s: float = 0.0) -> None:
+        self.classes = classes
+        self.latency_s = latency_s
+        self.model_id = "stub"
+        self.image_config = ImagePrepConfig()
+
+    def predict(self, images_list: List[Image.Image], prompt: str, **kwargs) -> str:
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        if _SUGGEST_MARKER in prompt:
+            return ", ".join(self.classes)
+        return "Na zdjęciu widać plac budowy."
+
+
+def synthetic_image(size: int, n_objects: int = 12, seed: int = 0) -> Tuple[Image.Image, List[Dict[str, Any]]]:
+    """Noisy background with filled rectangles; returns the image and the rectangles as detections."""
+    rng = np.random.default_rng(seed)
+    arr = rng.integers(90, 140, (size, size, 3), dtype=np.uint8)
+    image = Image.fromarray(arr)
+    draw = ImageDraw.Draw(image)
+    boxes = []
+    for i in range(n_objects):
+        w, h = rng.integers(size // 20, size // 6, 2)
+        x, y = rng.integers(0, size - w), rng.integers(0, size - h)
+        draw.rectangle([int(x), int(y), int(x + w), int(y + h)], fill=tuple(int(c) for c in rng.integers(0, 256, 3)))
+        boxes.append({
+            "label": CLASS_POOL[i % len(CLASS_POOL)],
+            "score": 1.0,
+            "box": {"xmin": int(x), "ymin": int(y), "xmax": int(x + w), "ymax": int(y + h)},
+        })
+    return image, boxes
+
+
+def png_bytes(image: Image.Image) -> bytes:
+    buf = io.BytesIO()
+    image.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+class StageTimer:
+    """Collects wall times (seconds) per stage name across repeats."""
+
+    def __init__(self) -> None:
+        self.samples: Dict[str, List[float]] = {}
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - t0)
+
+    def add(self, name: str, seconds: float) -> None:
+        self.samples.setdefault(name, []).append(seconds)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        return {
+            name: {
+                "median_s": statistics.median(v),
+                "min_s": min(v),
+                "max_s": max(v),
+                "n": len(v),
+            }
+            for name, v in self.samples.items()
+        }
+
+
+def bench_api(sam3, size: int, n_classes: int, repeats: int, workdir: Path,
+              llm_latency_s: float, batch_size: int) -> Dict[str, Any]:
+    """Stages of one /segment_image request, in request order."""
+    classes = CLASS_POOL[:n_classes]
+    chat._MODEL = StubChatModel(classes, llm_latency_s)
+    image, _ = synthetic_image(size)
+    upload = png_bytes(image)
+    upload_path = workdir / f"upload_{size}.png"
+    upload_path.write_bytes(upload)
+    history = [{"role": "user", "content": "Co widać na placu budowy?"}]
+
+    timer = StageTimer()
+    n_masks = 0
+    for _ in range(repeats):
+        t_total = time.perf_counter()
+        with timer.stage("decode"):
+            img = Image.open(io.BytesIO(upload)).convert("RGB")
+        with timer.stage("suggest_classes"):
+            refined = chat.suggest_classes(str(upload_path), history)
+        with timer.stage("sam3_encode"):
+            embeds = sam3.encode_image(img)
+        masks, labels = [], []
+        t_class = time.perf_counter()
+        for class_name, res in sam3.iter_predict_for_classes(img, refined, batch_size=batch_size,
+                                                            image_embeds=embeds):
+            now = time.perf_counter()
+            # with batch_size > 1 a whole batch is decoded before the first yield
+            timer.add(f"sam3_class:{class_name}", now - t_class)
+            timer.add("sam3_class", now - t_class)
+            masks.extend(res["masks"].bool().cpu().numpy())
+            labels.extend([class_name] * len(res["masks"]))
+            t_class = time.perf_counter()
+        n_masks = len(masks)
+        with timer.stage("overlay"):
+            overlay = render_masks(img, np.stack(masks), labels) if masks else img.convert("RGBA")
+        with timer.stage("png_save"):
+            overlay.save(workdir / f"masked_{size}.png", format="PNG")
+        with timer.stage("chat_answer"):
+            chat.chat_answer(history, refined, overlay)
+        timer.add("total", time.perf_counter() - t_total)
+
+    return {"size": size, "classes": n_classes, "masks": n_masks, "stages": timer.summary()}
+
+
+def bench_pipeline(pipeline, size: int, n_classes: int, repeats: int, workdir: Path) -> Dict[str, Any]:
+    """OWL-ViT detection + SAM v1 box prompting, stage by stage, plus an end-to-end `run`."""
+    classes = CLASS_POOL[:n_classes]
+    image, synthetic_boxes = synthetic_image(size)
+    image_path = workdir / f"pipeline_{size}.png"
+    image.save(image_path)
+    classes_path = workdir / f"classes_{n_classes}.json"
+    classes_path.write_text(json.dumps({"classes": classes}))
+    image_np = np.array(image)
+
+    timer = StageTimer()
+    boxes_source = "detector"
+    n_boxes = 0
+    for i in range(repeats):
+        # fresh cache per repeat: encode is measured once, then reused by segment_with_boxes
+        pipeline.segmenter.embedding_cache = EmbeddingCache()
+        key = f"bench:{size}:{i}"
+        with timer.stage("detect"):
+            detections = pipeline.detector.predict(image, classes)
+        if not detections:
+            # random noise rarely triggers OWL-ViT; still exercise SAM with the drawn rectangles
+            detections, boxes_source = synthetic_boxes, "synthetic"
+        n_boxes = len(detections)
+        with timer.stage("sam_encode"):
+            pipeline.segmenter.set_image(image_np, cache_key=key)
+        with timer.stage("sam_masks"):
+            segs = pipeline.segmenter.segment_with_boxes(image, detections, cache_key=key)
+        with timer.stage("overlay"):
+            overlay = render_masks(image, np.stack([s["mask"] for s in segs]),
+                                   [s.get("label") or "object" for s in segs]) if segs else image
+        with timer.stage("png_save"):
+            overlay.save(workdir / f"pipeline_masks_{size}.png", format="PNG")
+
+        pipeline.segmenter.embedding_cache = None
+        with timer.stage("run_total"):
+            pipeline.run(str(image_path), str(classes_path), str(workdir / "pipeline_out"))
+
+    return {"size": size, "classes": n_classes, "boxes": n_boxes, "boxes_source": boxes_source,
+            "stages": timer.summary()}
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float, min_delta_s: float) -> List[str]:
+    """Print a per-stage median diff; return regressions slower than baseline by > tolerance and > min_delta_s."""
+    regressions = []
+    print(f"\n{'case':<28} {'stage':<24} {'base_s':>9} {'new_s':>9} {'change':>8}")
+    for section in ("api", "pipeline"):
+        base_cases = {(c["size"], c["classes"]): c for c in baseline.get(section, [])}
+        for case in report.get(section, []):
+            base = base_cases.get((case["size"], case["classes"]))
+            if base is None:
+                continue
+            label = f"{section} {case['size']}px/{case['classes']}cls"
+            for stage, stats in case["stages"].items():
+                if stage not in base["stages"]:
+                    continue
+                old, new = base["stages"][stage]["median_s"], stats["median_s"]
+                change = (new - old) / old if old > 0 else 0.0
+                flag = ""
+                if change > tolerance and new - old > min_delta_s:
+                    flag = "  REGRESSION"
+                    regressions.append(f"{label} {stage}: {old:.4f}s -> {new:.4f}s ({change:+.0%})")
+                print(f"{label:<28} {stage:<24} {old:>9.4f} {new:>9.4f} {change:>+7.0%}{flag}")
+    return regressions
+
+
+def _print_cases(title: str, cases: List[Dict[str, Any]]) -> None:
+    for case in cases:
+        print(f"\n[{title}] {case['size']}px, {case['classes']} classes")
+        for stage, stats in case["stages"].items():
+            if ":" in stage:
+                continue
+            print(f"  {stage:<18} median {stats['median_s']:.4f}s  (min {stats['min_s']:.4f}, max {stats['max_s']:.4f})")
+
+
+def _run_cases(fn: Callable[[int, int], Dict[str, Any]], sizes: List[int], classes: List[int]) -> List[Dict[str, Any]]:
+    return [fn(size, n) for size in sizes for n in classes]
+
+
+def main():
+    p = argparse.ArgumentParser("Segment pipeline stage benchmark")
+    p.add_argument("--sizes", type=int, nargs="+", default=[1024], help="Square image sides (pixels)")
+    p.add_argument("--classes", type=int, nargs="+", default=[1, 4], help="Class counts (max 10)")
+    p.add_argument("--repeats", type=int, default=3)
+    p.add_argument("--llm_latency_ms", type=float, default=0.0, help="Simulated Gemini latency per call")
+    p.add_argument("--sam3_model", default="facebook/sam3")
+    p.add_argument("--batch_size", type=int, default=1, help="SAM3 prompts per decoder pass")
+    p.add_argument("--skip_sam3", action="store_true")
+    p.add_argument("--sam_checkpoint", default=None, help="SAM v1 checkpoint; pipeline section is skipped without it")
+    p.add_argument("--sam_model_type", default="vit_b")
+    p.add_argument("--detector_model", default="google/owlvit-base-patch32")
+    p.add_argument("--out", default=None, help="Write the JSON report here")
+    p.add_argument("--compare", default=None, help="Baseline JSON report to diff against")
+    p.add_argument("--tolerance", type=float, default=0.10, help="Allowed relative slowdown per stage")
+    p.add_argument("--min_delta_ms", type=float, default=5.0, help="Ignore slowdowns smaller than this")
+    p.add_argument("--verbose", action="store_true", help="Show DEBUG logs (chat prompts, spans)")
+    args = p.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING)
+
+    classes = [max(1, min(n, len(CLASS_POOL))) for n in args.classes]
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    report: Dict[str, Any] = {
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "device": device,
+            "threads": torch.get_num_threads(),
+            "args": vars(args),
+        },
+        "api": [],
+        "pipeline": [],
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = Path(tmp)
+        if not args.skip_sam3:
+            from DetectSegment.models.sam3_segmenter import Sam3Segmenter
+            t0 = time.perf_counter()
+            sam3 = Sam3Segmenter(args.sam3_model, device=device, batch_size=args.batch_size)
+            report["meta"]["sam3_load_s"] = time.perf_counter() - t0
+            sam3.warmup()
+            report["api"] = _run_cases(
+                lambda size, n: bench_api(sam3, size, n, args.repeats, workdir,
+                                          args.llm_latency_ms / 1000.0, args.batch_size),
+                args.sizes, classes,
+            )
+            del sam3
+        if args.sam_checkpoint:
+            from DetectSegment.pipelines.detect_and_segment import DetectAndSegmentPipeline
+            t0 = time.perf_counter()
+            pipeline = DetectAndSegmentPipeline(
+                detector_model=args.detector_model,
+                sam_checkpoint=args.sam_checkpoint,
+                sam_model_type=args.sam_model_type,
+                device=device,
+            )
+            report["meta"]["pipeline_load_s"] = time.perf_counter() - t0
+            report["pipeline"] = _run_cases(
+                lambda size, n: bench_pipeline(pipeline, size, n, args.repeats, workdir),
+                args.sizes, classes,
+            )
+
+    _print_cases("api", report["api"])
+    _print_cases("pipeline", report["pipeline"])
+
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, indent=2))
+        print(f"\nReport written to {args.out}")
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())
+        regressions = compare(report, baseline, args.tolerance, args.min_delta_ms / 1000.0)
+        if regressions:
+            print("\nRegressions:")
+            for r in regressions:
+                print(f"  {r}")
+            sys.exit(1)
+        print("\nNo regressions.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,8 @@
 source ../../.venv/bin/activate
 
-uvicorn API.app:app --host 0.0.0.0 --port 8000 --reload
\ No newline at end of file
+# ./run_backend.sh prod: models load once, WORKERS (default 2) forked workers share them (API/serve.py)
+if [ "$1" = "prod" ]; then
+    exec python -m API.serve --host 0.0.0.0 --port 8000 --workers "${WORKERS:-2}"
+fi
+
+uvicorn API.app:app --host 0.0.0.0 --port 8000 --reload
@@ -1,83 +1,59 @@
-import math
-from io import BytesIO
-
-import requests
-from PIL import Image
-
-BASE_URL = "https://mapy.geoportal.gov.pl/wss/service/PZGIK/ORTO/WMS/HighResolution"
-
-# --- your original BBOX in EPSG:2180 ---
-minx, miny, maxx, maxy = 509288.45, 611214.95, 509432.12, 611381.00
-
-GRID_COLS = 4
-GRID_ROWS = 4
-PIXEL_SIZE_M = 0.03  
- 
-# 1) Split BBOX in map coordinates
-dx = maxx - minx
-dy = maxy - miny
-
-# column boundaries (x) west → east
-col_bounds = [minx + dx * c / GRID_COLS for c in range(GRID_COLS + 1)]
-# row boundaries (y) south → north
-row_bounds = [miny + dy * r / GRID_ROWS for r in range(GRID_ROWS + 1)]
-
-# 2) Pixel sizes for each col/row (so resolution is ~constant)
-col_widths = []
-for c in range(GRID_COLS):
-    w_m = col_bounds[c + 1] - col_bounds[c]
-    col_widths.append(math.ceil(w_m / PIXEL_SIZE_M))
-
-row_heights = []
-for r in range(GRID_ROWS):
-    h_m = row_bounds[r + 1] - row_bounds[r]
-    row_heights.append(math.ceil(h_m / PIXEL_SIZE_M))
-
-mosaic_width = sum(col_widths)
-mosaic_height = sum(row_heights)
-
-print("Mosaic size:", mosaic_width, "x", mosaic_height)
-
-mosaic = Image.new("RGB", (mosaic_width, mosaic_height))
-
-headers = {"User-Agent": "Mozilla/5.0 (Python script)"}
-
-for r in range(GRID_ROWS):      # r = 0 is SOUTH, r = GRID_ROWS-1 is NORTH
-    for c in range(GRID_COLS):  # c = 0 is WEST,  c = GRID_COLS-1 is EAST
-        xmin = col_bounds[c]
-        xmax = col_bounds[c + 1]
-        ymin = row_bounds[r]
-        ymax = row_bounds[r + 1]
-
-        width_px = col_widths[c]
-        height_px = row_heights[r]
-
-        bbox_str = f"{xmin},{ymin},{xmax},{ymax}"
-        print(f"Tile r={r}, c={c}, BBOX={bbox_str}, size={width_px}x{height_px}")
-
-        params = {
-            "SERVICE": "WMS",
-            "REQUEST": "GetMap",
-            "VERSION": "1.3.0",
-            "LAYERS": "Raster",
-            "STYLES": "default",
-            "FORMAT": "image/png",   # lossless
-            "CRS": "EPSG:2180",
-            "BBOX": bbox_str,
-            "WIDTH": height_px,
-            "HEIGHT": width_px,
-        }
-
-        resp = requests.get(BASE_URL, params=params, headers=headers, timeout=120)
-        resp.raise_for_status()
-        # print(resp)
-        tile = Image.open(BytesIO(resp.content)).convert("RGB").transpose(method=Image.TRANSVERSE)
-
-        # 3) Paste without any rotation:
-        #    image y=0 is TOP, but r=0 is SOUTH → flip rows when pasting
-        x_off = sum(col_widths[:c])
-        y_off = mosaic_height - sum(row_heights[: r + 1])  # bottom row at bottom
-        mosaic.paste(tile, (x_off, y_off))
-
-mosaic.save("geoportal_ortho_4x4_max.png")
-print("Saved geoportal_ortho_4x4_max.png")
+"""
+Download a geoportal.gov.pl orthophoto mosaic (EPSG:2180) with Geoportal.wms.
+
+    python webscraping.py --pixel_size 0.03 --workers 4 --out geoportal_ortho.npy
+
+Writes the mosaic as a memory-mappable .npy (+ .json georeference), which the segmentation
+pipeline reads directly; `--png preview.png` adds a downsampled PNG preview.
+"""
+import argparse
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+
+from DetectSegment.utils.io_utils import ImageReader
+from Geoportal.wms import GEOPORTAL_ORTO_URL, TileCache, WMSFetcher, WMSLayer, fetch_mosaic, open_raster
+
+# (minx, miny, maxx, maxy) in EPSG:2180 with x = easting, y = northing
+DEFAULT_BBOX = (611214.95, 509288.45, 611381.00, 509432.12)
+
+
+def main():
+    p = argparse.ArgumentParser("Geoportal WMS mosaic")
+    p.add_argument("--bbox", type=float, nargs=4, default=DEFAULT_BBOX, metavar=("MINX", "MINY", "MAXX", "MAXY"),
+                   help="EPSG:2180 easting/northing")
+    p.add_argument("--pixel_size", type=float, default=0.03, help="Metres per pixel")
+    p.add_argument("--tile_px", type=int, default=2048, help="GetMap tile size in pixels")
+    p.add_argument("--workers", type=int, default=4, help="Concurrent GetMap requests")
+    p.add_argument("--retries", type=int, default=4)
+    p.add_argument("--cache_dir", default=".wms_cache", help="Tile cache directory ('' disables)")
+    p.add_argument("--url", default=GEOPORTAL_ORTO_URL)
+    p.add_argument("--out", default="geoportal_ortho.npy")
+    p.add_argument("--png", default="", help="Also save a PNG preview here (default: none)")
+    p.add_argument("--png_max_side", type=int, default=4096,
+                   help="Longest side of the PNG preview, every n-th pixel; 0 saves full size, "
+                        "which loads the whole mosaic into memory")
+    args = p.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    fetcher = WMSFetcher(
+        WMSLayer(base_url=args.url),
+        cache=TileCache(args.cache_dir) if args.cache_dir else None,
+        max_workers=args.workers,
+        max_retries=args.retries,
+    )
+    meta = fetch_mosaic(tuple(args.bbox), args.pixel_size, args.out, fetcher, tile_px=args.tile_px)
+    print(f"Mosaic {meta['width']}x{meta['height']} -> {args.out} ({meta['seconds']}s, {meta['stats']})")
+
+    if args.png:
+        mosaic, _ = open_raster(args.out)
+        reader = ImageReader(mosaic, args.out)
+        preview = reader.thumbnail(args.png_max_side) if args.png_max_side else reader.to_pil()
+        preview.save(args.png)
+        print(f"Saved {args.png} ({preview.width}x{preview.height})")
+
+
+if __name__ == "__main__":
+    main()